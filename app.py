@@ -7,11 +7,9 @@ import os
 
 from flask import Flask, render_template
 
-from spellcheckapp import db
-from spellcheckapp.auth import auth, models
-from spellcheckapp.spellcheck import spellcheck
-
-from werkzeug.security import generate_password_hash
+from spellcheckapp import caching, compression, db, metrics, writebehind
+from spellcheckapp.auth import auth, models, passwords, qrcache, throttle, totp, usercache
+from spellcheckapp.spellcheck import jobs, languages, reloader, spellcheck
 
 
 def page_not_found(e):
@@ -39,6 +37,8 @@ def create_app(test_config=None):
         DATABASE=os.path.join(app.instance_path, 'spellchecker.sqlite'),
         SPELLCHECK='./a.out',
         WORDLIST='wordlist.txt',
+        SPELLCHECK_ENGINE='executable',
+        SPELLCHECK_TIMEOUT=10,
         SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(app.instance_path, 'spellchecker.sqlite'),
         ADMIN_USERNAME='replaceme',
         ADMIN_PASSWORD='replaceme',
@@ -64,9 +64,20 @@ def create_app(test_config=None):
 
     # Associate db with app
     db.init_app(app)
+    # Associate the dictionaries of the configured languages, wordlist reloading and background jobs with app
+    # along with the logged in user cache, password hashing, login throttling, TOTP verification and MFA QR codes
+    languages.init_app(app)
+    jobs.init_app(app)
+    reloader.init_app(app)
+    usercache.init_app(app)
+    passwords.init_app(app)
+    throttle.init_app(app)
+    totp.init_app(app)
+    qrcache.init_app(app)
     # Add the models so that create and drop all know which tables to manage
-    from spellcheckapp.auth.models import Users, MFA  # noqa: F401
-    from spellcheckapp.spellcheck.models import SpellChecks  # noqa: F401
+    from spellcheckapp.auth.models import Users, MFA, LoginThrottleBucket  # noqa: F401
+    from spellcheckapp.spellcheck.models import SpellChecks, SpellCheckCache, SpellCheckDocumentChunk, SpellCheckJob  # noqa: F401
+    from spellcheckapp.writebehind import WriteBehindCommit  # noqa: F401
 
     with app.app_context():
         db.create_all()
@@ -75,7 +86,7 @@ def create_app(test_config=None):
             if models.Users.query.filter_by(username=app.config['ADMIN_USERNAME']).first() is None:
                 # Create default admin
                 d_admin = models.Users(username=app.config['ADMIN_USERNAME'],
-                                       password=generate_password_hash(app.config['ADMIN_PASSWORD']),
+                                       password=passwords.get_hasher().hash(app.config['ADMIN_PASSWORD']),
                                        mfa_registered=False,
                                        is_admin=True)
                 db.session.add(d_admin)
@@ -83,10 +94,17 @@ def create_app(test_config=None):
         except KeyError:
             print("Admin credentials must be defined in config, continuing without default admin.")
 
+    # Queue audit rows if write-behind is enabled, once tables exist to replay old journals into
+    writebehind.init_app(app)
+
     app.register_blueprint(auth.bp)
     app.register_blueprint(spellcheck.bp)
+    app.register_blueprint(metrics.bp)
     app.add_url_rule('/', endpoint='index')
     app.register_error_handler(404, page_not_found)
+    # Compress responses and fingerprint static URLs, after request handlers run last first so compression sees the final headers
+    compression.init_app(app)
+    caching.init_app(app)
 
     return app
 
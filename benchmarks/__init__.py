@@ -0,0 +1 @@
+"""Load test benchmarks for spellcheckapp, see benchmarks/run.py."""
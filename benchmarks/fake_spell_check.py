@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Stand-in spell check executable for benchmarks.
+
+Called as `fake_spell_check.py <input file> <wordlist>` it prints every word of the input file missing from the wordlist,
+one per line, like the real executable.
+Called as `fake_spell_check.py --serve <wordlist>` it speaks the worker pool line protocol instead.
+"""
+import string
+import sys
+
+
+def load_words(path):
+    """Returns the set of words in a wordlist file."""
+    with open(path) as wordlist:
+        return set(wordlist.read().split())
+
+
+def misspelled(words, text):
+    """Yields the words of text missing from words."""
+    for word in text.split():
+        word = word.strip(string.punctuation)
+        if word and word not in words and word.lower() not in words:
+            yield word
+
+
+def main(argv):
+    """Runs the stand-in in the mode selected by argv."""
+    if argv[:1] == ['--serve']:
+        words = load_words(argv[1])
+        for line in sys.stdin:
+            for word in misspelled(words, line):
+                sys.stdout.write(word + '\n')
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+        return 0
+    if len(argv) != 2:
+        sys.stderr.write('usage: fake_spell_check.py <input file> <wordlist>\n')
+        return 2
+    words = load_words(argv[1])
+    with open(argv[0]) as inputfile:
+        for word in misspelled(words, inputfile.read()):
+            sys.stdout.write(word + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,89 @@
+"""
+Dictionary Lookup Benchmarks for Spellcheckapp.
+
+Compares the dictionary engine's word lookups with and without a Bloom filter prefilter,
+for a text wordlist loaded into a set and for a memory mapped compiled wordlist.
+Reports the mean time per word lookup and per checked submission as JSON.
+
+Usage: python -m benchmarks.lookup --wordlist-size 200000 --misspell-rate 0.1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_commit, make_texts, make_wordlist
+
+from spellcheckapp.spellcheck import compiled, engine
+
+
+def time_per_call(fn, items, repeat):
+    """Returns the best mean time in nanoseconds of fn over items, out of repeat runs."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1e9 / len(items), 1)
+
+
+def run_lookup_benchmark(wordlist_size=200000, misspell_rate=0.1, texts=2000, fp_rate=0.01, repeat=3, seed=0):
+    """Runs the benchmark and returns its results."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        text_name = os.path.join(workdir, 'wordlist.txt')
+        compiled_name = os.path.join(workdir, 'wordlist.bin')
+        words = make_wordlist(text_name, wordlist_size, rng)
+        compiled.compile_wordlist(words, compiled_name, bloom_fp_rate=fp_rate)
+        submissions = make_texts(words, texts, rng, misspell_rate)
+        tokens = [token for text in submissions for token in engine.tokenize(text)]
+        variants = {'set': engine.DictionaryEngine(text_name),
+                    'set+bloom': engine.DictionaryEngine(text_name, bloom_fp_rate=fp_rate),
+                    'compiled': engine.DictionaryEngine(compiled_name),
+                    'compiled+bloom': engine.DictionaryEngine(compiled_name, bloom_fp_rate=fp_rate)}
+        results = {}
+        for name, dictionary in variants.items():
+            started = time.perf_counter()
+            snapshot = dictionary.snapshot()
+            load_seconds = time.perf_counter() - started
+            lookup = snapshot.words if snapshot.prefiltered is None else snapshot.prefiltered
+            results[name] = {'load_ms': round(load_seconds * 1000, 3),
+                             'lookup_ns': time_per_call(lookup.__contains__, tokens, repeat),
+                             'check_us': round(time_per_call(dictionary.check, submissions, repeat) / 1000, 2)}
+            stats = dictionary.stats()
+            if 'bloom' in stats:
+                results[name]['bloom'] = stats['bloom']
+            dictionary.close()
+    return {'meta': {'commit': git_commit(),
+                     'wordlist_size': wordlist_size,
+                     'misspell_rate': misspell_rate,
+                     'texts': texts,
+                     'tokens': len(tokens),
+                     'fp_rate': fp_rate,
+                     'seed': seed},
+            'variants': results}
+
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description='Compare dictionary lookups with and without a Bloom filter prefilter.')
+    parser.add_argument('--wordlist-size', type=int, default=200000, help='words in the synthetic wordlist (default 200000)')
+    parser.add_argument('--misspell-rate', type=float, default=0.1, help='share of submitted words that are misspelled (default 0.1)')
+    parser.add_argument('--texts', type=int, default=2000, help='submissions to check (default 2000)')
+    parser.add_argument('--fp-rate', type=float, default=0.01, help='Bloom filter false positive rate (default 0.01)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs, the best is reported (default 3)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the wordlist and submissions (default 0)')
+    args = parser.parse_args(argv)
+    results = run_lookup_benchmark(wordlist_size=args.wordlist_size, misspell_rate=args.misspell_rate, texts=args.texts,
+                                   fp_rate=args.fp_rate, repeat=args.repeat, seed=args.seed)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+Load Test Benchmarks for Spellcheckapp.
+
+Starts the app with create_app against a fresh SQLite database, or the database given with --database-uri,
+using the stand-in spell check executable in this directory and a synthetic wordlist.
+Virtual users register, log in, submit spell checks, read their history and log out at the requested concurrency,
+while an admin reads each user's login history.
+Latency percentiles and throughput per endpoint are printed as JSON, so runs on different commits can be compared with --compare.
+
+Usage: python -m benchmarks.run --users 50 --concurrency 8 --output results.json
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import app
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+FAKE_SPELLCHECK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_spell_check.py')
+ADMIN_USERNAME = 'benchadmin'
+ADMIN_PASSWORD = 'benchadmin'
+USER_PASSWORD = 'benchpassword'
+
+
+def make_wordlist(path, size, rng):
+    """Writes size distinct random lowercase words to path and returns them."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    with open(path, 'w') as wordlist:
+        wordlist.write('\n'.join(words) + '\n')
+    return words
+
+
+def make_texts(words, count, rng, misspell_rate=0.1, max_length=500):
+    """Returns count submissions made of wordlist words, with about misspell_rate of them misspelled."""
+    texts = []
+    for _ in range(count):
+        text = []
+        length = 0
+        for _ in range(rng.randint(5, 60)):
+            word = rng.choice(words)
+            if rng.random() < misspell_rate:
+                word = word + rng.choice(string.ascii_lowercase) * 2
+            if length + len(word) + 1 > max_length:
+                break
+            text.append(word)
+            length += len(word) + 1
+        texts.append(' '.join(text))
+    return texts
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+class Recorder(object):
+    """
+    Latency Recorder.
+
+    Collects the duration of every request by endpoint, and counts failed requests.
+    """
+
+    def __init__(self):
+        """Creates an empty recorder."""
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, send, expected):
+        """Times send(), a test client request, recording an error if it raises or its status is not in expected."""
+        started = time.perf_counter()
+        try:
+            response = send()
+            failed = response.status_code not in expected
+        except Exception:
+            response = None
+            failed = True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[endpoint].append(elapsed)
+            if failed:
+                self.errors[endpoint] += 1
+        return response
+
+    def summary(self, wall_seconds):
+        """Returns the latency percentiles and throughput of each endpoint and of all requests together."""
+        def summarize(samples, errors):
+            samples = sorted(samples)
+            return {'requests': len(samples),
+                    'errors': errors,
+                    'throughput_rps': round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+                    'mean_ms': round(sum(samples) * 1000 / len(samples), 3) if samples else None,
+                    'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+                    'p95_ms': round(percentile(samples, 95) * 1000, 3) if samples else None,
+                    'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None}
+        with self._lock:
+            endpoints = {endpoint: summarize(samples, self.errors[endpoint]) for endpoint, samples in sorted(self.samples.items())}
+            overall = summarize([s for samples in self.samples.values() for s in samples], sum(self.errors.values()))
+        return endpoints, overall
+
+
+def run_user(base_app, recorder, admin, username, texts, history_reads):
+    """Runs one virtual user's session, then has the admin read the user's login history."""
+    client = base_app.test_client()
+    recorder.request('register', lambda: client.post('/register', data={'username': username, 'password': USER_PASSWORD}), (302,))
+    recorder.request('login', lambda: client.post('/login', data={'username': username, 'password': USER_PASSWORD}), (302,))
+    with client.session_transaction() as session:
+        user_id = session.get('user_id')
+    for text in texts:
+        recorder.request('spell_check', lambda text=text: client.post('/spell_check', data={'inputtext': text}), (200,))
+    for _ in range(history_reads):
+        recorder.request('history', lambda: client.get('/history'), (200,))
+    recorder.request('logout', lambda: client.get('/logout'), (302,))
+    if user_id is not None:
+        recorder.request('login_history', lambda: admin.client().post('/login_history', data={'userid': user_id}), (200,))
+
+
+class AdminClients(threading.local):
+    """One logged in admin test client per benchmark thread."""
+
+    def __init__(self, base_app, recorder):
+        """Stores what is needed to log an admin in on first use in a thread."""
+        self.base_app = base_app
+        self.recorder = recorder
+        self._client = None
+
+    def client(self):
+        """Returns this thread's admin client, logging it in if needed."""
+        if self._client is None:
+            self._client = self.base_app.test_client()
+            self.recorder.request('login', lambda: self._client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}), (302,))
+        return self._client
+
+
+def git_commit():
+    """Returns the current commit of the repo, or None if it is not available."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=parent_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(users=20, concurrency=4, spell_checks=5, history_reads=2, wordlist_size=5000,
+                  misspell_rate=0.1, engine='executable', database_uri=None, settings=None, seed=0):
+    """Runs the benchmark and returns its results."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        wordlist_name = os.path.join(workdir, 'wordlist.txt')
+        words = make_wordlist(wordlist_name, wordlist_size, rng)
+        config = {'SECRET_KEY': 'benchmark',
+                  'WTF_CSRF_ENABLED': False,
+                  'SQLALCHEMY_DATABASE_URI': database_uri or 'sqlite:///' + os.path.join(workdir, 'benchmark.sqlite'),
+                  'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+                  'SPELLCHECK': FAKE_SPELLCHECK,
+                  'SPELLCHECK_ENGINE': engine,
+                  'WORDLIST': wordlist_name,
+                  'ADMIN_USERNAME': ADMIN_USERNAME,
+                  'ADMIN_PASSWORD': ADMIN_PASSWORD,
+                  # Every client logs in from one address, and the admin clients all log in as one user.
+                  'LOGIN_THROTTLE': False}
+        config.update(settings or {})
+        base_app = app.create_app(config)
+        recorder = Recorder()
+        admin = AdminClients(base_app, recorder)
+        # Usernames are unique per run so repeated runs can share a database.
+        prefix = 'b%06x' % rng.getrandbits(24)
+        sessions = [('%s_%05d' % (prefix, i), make_texts(words, spell_checks, rng, misspell_rate)) for i in range(users)]
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run_user, base_app, recorder, admin, username, texts, history_reads) for username, texts in sessions]
+            for future in futures:
+                future.result()
+        wall_seconds = time.perf_counter() - started
+        base_app.extensions['spellcheck_dictionaries'].close()
+    endpoints, overall = recorder.summary(wall_seconds)
+    return {'meta': {'commit': git_commit(),
+                     'started': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'database': 'sqlite' if database_uri is None else database_uri.split(':', 1)[0],
+                     'engine': engine,
+                     'users': users,
+                     'concurrency': concurrency,
+                     'spell_checks': spell_checks,
+                     'history_reads': history_reads,
+                     'wordlist_size': wordlist_size,
+                     'misspell_rate': misspell_rate,
+                     'settings': settings or {},
+                     'seed': seed,
+                     'wall_seconds': round(wall_seconds, 3)},
+            'endpoints': endpoints,
+            'overall': overall}
+
+
+def compare(results, baseline):
+    """Returns lines comparing the p50/p95/p99 latency and throughput of results against a baseline run."""
+    lines = ['%-14s %-15s %12s %12s %9s' % ('endpoint', 'metric', 'baseline', 'current', 'change')]
+    rows = [(name, results['endpoints'][name], baseline['endpoints'].get(name)) for name in sorted(results['endpoints'])]
+    rows.append(('overall', results['overall'], baseline.get('overall')))
+    for name, current, old in rows:
+        if old is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if current[metric] is None or not old[metric]:
+                continue
+            change = (current[metric] - old[metric]) * 100.0 / old[metric]
+            lines.append('%-14s %-15s %12.3f %12.3f %+8.1f%%' % (name, metric, old[metric], current[metric], change))
+    return lines
+
+
+def parse_setting(setting):
+    """Parses a KEY=VALUE config override, the value is read as JSON if possible."""
+    key, sep, value = setting.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('Expected KEY=VALUE, got %r' % setting)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description='Load test spellcheckapp and report latency per endpoint as JSON.')
+    parser.add_argument('--users', type=int, default=20, help='virtual users, each runs one session (default 20)')
+    parser.add_argument('--concurrency', type=int, default=4, help='sessions run at the same time (default 4)')
+    parser.add_argument('--spell-checks', type=int, default=5, help='spell checks submitted per session (default 5)')
+    parser.add_argument('--history-reads', type=int, default=2, help='history page reads per session (default 2)')
+    parser.add_argument('--wordlist-size', type=int, default=5000, help='words in the synthetic wordlist (default 5000)')
+    parser.add_argument('--misspell-rate', type=float, default=0.1, help='share of submitted words that are misspelled (default 0.1)')
+    parser.add_argument('--engine', default='executable', help='SPELLCHECK_ENGINE to use (default executable)')
+    parser.add_argument('--database-uri', help='SQLALCHEMY_DATABASE_URI to use instead of a fresh SQLite file, e.g. a local postgres')
+    parser.add_argument('--set', dest='settings', action='append', type=parse_setting, default=[], metavar='KEY=VALUE',
+                        help='extra app config, values are read as JSON when possible, may be repeated')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the wordlist and submissions (default 0)')
+    parser.add_argument('--output', help='file to write the JSON results to instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(users=args.users,
+                            concurrency=args.concurrency,
+                            spell_checks=args.spell_checks,
+                            history_reads=args.history_reads,
+                            wordlist_size=args.wordlist_size,
+                            misspell_rate=args.misspell_rate,
+                            engine=args.engine,
+                            database_uri=args.database_uri,
+                            settings=dict(args.settings),
+                            seed=args.seed)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outputfile:
+            outputfile.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as baselinefile:
+            baseline = json.load(baselinefile)
+        sys.stderr.write('\n'.join(compare(results, baseline)) + '\n')
+    return 1 if results['overall']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Tokenizer Benchmarks for Spellcheckapp.
+
+Compares the dictionary engine's check, which looks each distinct token up once, with a per-token loop that strips,
+lower cases and looks up every token, for a text wordlist loaded into a set and for a memory mapped compiled wordlist.
+Submissions follow a Zipf distribution like natural text, so common words repeat, and range from a form submission
+to a large document. Reports the mean time per check and per token as JSON.
+
+Usage: python -m benchmarks.tokenizer --sizes 500 65536 1048576
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.run import git_commit, make_wordlist
+
+from spellcheckapp.spellcheck import compiled, engine
+
+
+def per_token_check(text, words):
+    """The check every token is looked up by, as the dictionary engine did before deduplicating."""
+    return [word for word in engine.tokenize(text) if word not in words and word.lower() not in words]
+
+
+def make_document(words, size, rng, vocabulary=5000, misspell_rate=0.05):
+    """Returns about size characters of Zipf distributed words with trailing punctuation, misspell_rate of the vocabulary misspelled."""
+    vocabulary = [word + 'zz' if rng.random() < misspell_rate else word for word in rng.sample(words, min(vocabulary, len(words)))]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choices(vocabulary, weights)[0] + rng.choice(['', '', '', ',', '.'])
+        text.append(word)
+        length += len(word) + 1
+    return ' '.join(text)[:size]
+
+
+def time_check(check, text, words, repeat):
+    """Returns the best time in seconds of check(text, words) out of repeat runs, and its result."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = check(text, words)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_tokenizer_benchmark(sizes=(500, 65536, 1048576), wordlist_size=100000, repeat=3, seed=0):
+    """Runs the benchmark and returns its results."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        text_name = os.path.join(workdir, 'wordlist.txt')
+        compiled_name = os.path.join(workdir, 'wordlist.bin')
+        words = make_wordlist(text_name, wordlist_size, rng)
+        compiled.compile_wordlist(words, compiled_name)
+        documents = {size: make_document(words, size, rng) for size in sizes}
+        results = {}
+        for name, path in (('set', text_name), ('compiled', compiled_name)):
+            wordlist = engine.open_wordlist(path)
+            results[name] = {}
+            for size, document in documents.items():
+                # Short submissions are timed in a loop so the clock resolution does not dominate.
+                loops = max(1, 65536 // size)
+                text_repeat = [document] * loops
+                tokens = len(document.split()) * loops
+                per_token, expected = time_check(lambda texts, words: [per_token_check(text, words) for text in texts], text_repeat, wordlist, repeat)
+                deduped, result = time_check(lambda texts, words: [engine.find_misspelled(text, words) for text in texts], text_repeat, wordlist, repeat)
+                if result != expected:
+                    raise AssertionError('find_misspelled disagrees with the per-token check for %d characters' % size)
+                results[name][str(size)] = {'tokens': tokens // loops,
+                                            'distinct': len(set(document.split())),
+                                            'per_token_us': round(per_token * 1e6 / loops, 1),
+                                            'deduped_us': round(deduped * 1e6 / loops, 1),
+                                            'per_token_ns_per_token': round(per_token * 1e9 / tokens, 1),
+                                            'deduped_ns_per_token': round(deduped * 1e9 / tokens, 1),
+                                            'speedup': round(per_token / deduped, 2)}
+            if hasattr(wordlist, 'close'):
+                wordlist.close()
+    return {'meta': {'commit': git_commit(),
+                     'wordlist_size': wordlist_size,
+                     'sizes': list(sizes),
+                     'seed': seed},
+            'wordlists': results}
+
+
+def main(argv=None):
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description='Compare per-token and deduplicated dictionary checks on inputs of growing size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 65536, 1048576], help='submission sizes in characters (default 500 65536 1048576)')
+    parser.add_argument('--wordlist-size', type=int, default=100000, help='words in the synthetic wordlist (default 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs, the best is reported (default 3)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the wordlist and submissions (default 0)')
+    args = parser.parse_args(argv)
+    results = run_tokenizer_benchmark(sizes=args.sizes, wordlist_size=args.wordlist_size, repeat=args.repeat, seed=args.seed)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,19 +9,23 @@ import functools
 import sqlite3
 
 from flask import (
-    Blueprint, abort, flash, g, make_response, redirect, render_template, session, url_for
+    Blueprint, abort, flash, g, jsonify, make_response, redirect, render_template, request, session, url_for
 )
 
-import pyqrcode
-
-from spellcheckapp import db
+from spellcheckapp import db, writebehind
 from spellcheckapp.auth import forms
 from spellcheckapp.auth import models
-
-from werkzeug.security import check_password_hash, generate_password_hash
+from spellcheckapp.auth import passwords
+from spellcheckapp.auth import qrcache
+from spellcheckapp.auth import throttle
+from spellcheckapp.auth import totp
+from spellcheckapp.auth import usercache
 
 bp = Blueprint('auth', __name__, template_folder="../templates")
 
+BUSY = 'The server is busy, please try again shortly.'
+THROTTLED = 'Too many login attempts, please try again later.'
+
 
 def login_required(view):
     """
@@ -39,6 +43,22 @@ def login_required(view):
     return wrapped_view
 
 
+def api_login_required(view):
+    """
+    API Login required wrapper.
+
+    Wraps an API view and responds with a 401 JSON error, unless a user is logged in.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if g.user is None:
+            return jsonify({'error': 'Authentication required.'}), 401
+
+        return view(**kwargs)
+
+    return wrapped_view
+
+
 @bp.route('/register', methods=('GET', 'POST'))
 def register():
     """
@@ -48,6 +68,7 @@ def register():
     Performs form validation and handles database calls to create and validate a user.
     """
     form = forms.RegisterForm()
+    status = 200
     if g.user is None:
         if form.validate_on_submit():
             # Validate and santize
@@ -61,7 +82,15 @@ def register():
                 flash('Registration failure.')
 
             if error is None:
-                new_user = models.Users(username=username, password=generate_password_hash(password), mfa_registered=False)
+                try:
+                    pwhash = passwords.get_hasher().hash(password)
+                except passwords.PasswordHasherBusyError:
+                    error = BUSY
+                    flash(error)
+                    status = 503
+
+            if error is None:
+                new_user = models.Users(username=username, password=pwhash, mfa_registered=False)
                 db.session.add(new_user)
                 try:
                     db.session.commit()
@@ -70,7 +99,9 @@ def register():
                     flash('User Registration failure.')
                 return redirect(url_for('auth.register'))
 
-    render = make_response(render_template('auth/register.html', form=form))
+    render = make_response(render_template('auth/register.html', form=form), status)
+    if status == 503:
+        render.headers.set('Retry-After', '1')
     render.headers.set('Content-Security-Policy', "default-src 'self'")
     render.headers.set('X-Content-Type-Options', 'nosniff')
     render.headers.set('X-Frame-Options', 'SAMEORIGIN')
@@ -85,34 +116,45 @@ def account():
     Account Page View.
 
     Displays form to update user account details..
+    All changes of a submission are applied with a single commit, based on the logged in user's cached record.
     """
     mfa_status = g.user.mfa_registered
     form = forms.UpdateAccountForm(mfa_enabled=mfa_status)
+    status = 200
     if form.validate_on_submit():
         password = form.password.data
         mfa_enabled = form.mfa_enabled.data
-        user = models.Users.query.filter_by(username=g.user.username).first()
+        mfa_changed = mfa_enabled != g.user.mfa_registered
+        changes = {}
 
         if password:
-            user.password = generate_password_hash(password)
+            try:
+                changes[models.Users.password] = passwords.get_hasher().hash(password)
+            except passwords.PasswordHasherBusyError:
+                flash(BUSY)
+                status = 503
+
+        if status == 200 and (changes or mfa_changed):
+            if mfa_changed:
+                # A new secret has to be confirmed before it is used, so MFA is unregistered until then.
+                models.MFA.query.filter_by(username=g.user.username).delete(synchronize_session=False)
+                changes[models.Users.mfa_registered] = False
+                if mfa_enabled:
+                    db.session.add(models.MFA(username=g.user.username))
+            models.Users.query.filter_by(id=g.user.id).update(changes, synchronize_session=False)
             db.session.commit()
-            flash('Password has been updated.')
-
-        if mfa_enabled != user.mfa_registered:
-            cur_mfa = models.MFA.query.filter_by(username=g.user.username).first()
-            if cur_mfa is not None:
-                db.session.delete(cur_mfa)
-                db.session.commit()
-            if mfa_enabled:
-                new_mfa = models.MFA(username=g.user.username)
-                db.session.add(new_mfa)
-                db.session.commit()
+            usercache.invalidate(g.user.id)
+            if mfa_changed:
+                qrcache.invalidate(g.user.username)
+            if password:
+                flash('Password has been updated.')
+            if mfa_changed and mfa_enabled:
                 return redirect(url_for('auth.mfa_setup'))
-            else:
-                user.mfa_registered = False
-                db.session.commit()
+            if mfa_changed:
                 flash('MFA has been disabled.')
-    render = make_response(render_template('auth/account.html', form=form))
+    render = make_response(render_template('auth/account.html', form=form), status)
+    if status == 503:
+        render.headers.set('Retry-After', '1')
     render.headers.set('Cache-Control', 'no-cache, no-store, must-revalidate')
     render.headers.set('Pragma', 'no-cache')
     render.headers.set('Expires', '0')
@@ -140,6 +182,7 @@ def mfa_setup():
             user = models.Users.query.filter_by(username=g.user.username).first()
             user.mfa_registered = True
             db.session.commit()
+            usercache.invalidate(user.id)
             flash('MFA Setup success.')
         else:
             flash('MFA was not enabled.')
@@ -169,20 +212,23 @@ def qrcode():
     if g.user.mfa_registered:
         abort(404)
 
-    # render qrcode
-    url = pyqrcode.create(mfa_candidate.get_totp_uri())
-    from io import BytesIO
-    stream = BytesIO()
-    url.svg(stream, scale=5)
-    return stream.getvalue(), 200, {
-        'Content-Type': 'image/svg+xml',
-        'Cache-Control': 'no-cache, no-store, must-revalidate',
-        'Pragma': 'no-cache',
-        'Expires': '0',
-        'Content-Security-Policy': "default-src 'self'",
-        'X-Content-Type-Options': 'nosniff',
-        'X-Frame-Options': 'SAMEORIGIN',
-        'X-XSS-Protection': '1; mode=block'}
+    # render qrcode, or reuse the one rendered for this secret
+    code = qrcache.get_code(mfa_candidate)
+    if request.if_none_match.contains_weak(code.etag):
+        render = make_response('', 304)
+    else:
+        render = make_response(code.svg)
+        render.headers.set('Content-Type', 'image/svg+xml')
+    render.set_etag(code.etag)
+    # The code holds the secret, so it must not be stored anywhere, the ETag only lets a client that kept it revalidate.
+    render.headers.set('Cache-Control', 'no-cache, no-store, must-revalidate')
+    render.headers.set('Pragma', 'no-cache')
+    render.headers.set('Expires', '0')
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
 
 
 @bp.route('/login', methods=('GET', 'POST'))
@@ -195,42 +241,78 @@ def login():
     Logs the login time for the session.
     """
     form = forms.LoginForm()
+    status = 200
+    retry_after = None
     if g.user is None:
         if form.validate_on_submit():
             username = form.username.data
             password = form.password.data
             error = None
-            user = models.Users.query.filter_by(username=username).first()
+            hasher = passwords.get_hasher()
+            # Throttled attempts are refused before the user is looked up or a password hash is checked.
+            login_throttle = throttle.get_throttle()
+            if login_throttle is not None:
+                ip = throttle.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'), login_throttle.proxies)
+                retry_after = login_throttle.check(username, ip) or None
+            if retry_after is None:
+                # The MFA secret is loaded in the same query as the user.
+                user = models.Users.query.options(db.joinedload(models.Users.mfa)).filter_by(username=username).first()
+            else:
+                user = None
 
-            if user is None:
-                error = 'Invalid/Incorrect credentials.'
+            if retry_after is not None:
+                error = THROTTLED
                 flash(error)
-            elif not check_password_hash(user.password, password):
+                status = 429
+            elif user is None:
                 error = 'Invalid/Incorrect credentials.'
                 flash(error)
-
-            if user is not None:
-                if user.mfa_registered:
-                    mfa = form.mfa.data
-                    mfa_stored = models.MFA.query.filter_by(username=username).first()
-                    if mfa_stored is None:
-                        error = 'Corrupt state, contact site admin.'
-                        flash(error)
-                    elif not mfa_stored.verify_totp(mfa):
-                        error = 'Two-factor authentication failure.'
+            else:
+                try:
+                    if not hasher.check(user.password, password):
+                        error = 'Invalid/Incorrect credentials.'
                         flash(error)
+                except passwords.PasswordHasherBusyError:
+                    error = BUSY
+                    flash(error)
+                    status = 503
+
+            # The code is only checked, and used up, once the password has matched.
+            if error is None and user.mfa_registered:
+                mfa = form.mfa.data
+                mfa_stored = user.mfa
+                if mfa_stored is None:
+                    error = 'Corrupt state, contact site admin.'
+                    flash(error)
+                elif not totp.get_verifier().verify(user.id, mfa_stored.mfa_secret, mfa):
+                    error = 'Two-factor authentication failure.'
+                    flash(error)
 
             if error is None:
+                # Hashes made with an older method or cost are replaced now that the password is known.
+                new_hash = hasher.upgrade(user.password, password)
+                if new_hash is not None:
+                    user.password = new_hash
+                    db.session.commit()
                 session.clear()
                 session['user_id'] = user.id
-                new_login = models.AuthLog(userid=user.id, username=username, login_time=datetime.datetime.now())
-                db.session.add(new_login)
-                db.session.commit()
-                session['login_id'] = new_login.id
+                login_time = datetime.datetime.now()
+                if writebehind.enabled():
+                    writebehind.enqueue('auth_log', {'userid': user.id, 'username': username, 'login_time': login_time})
+                    session['login_time'] = login_time.strftime(writebehind.DATETIME_FORMAT)
+                else:
+                    new_login = models.AuthLog(userid=user.id, username=username, login_time=login_time)
+                    db.session.add(new_login)
+                    db.session.commit()
+                    session['login_id'] = new_login.id
                 flash('Login success.')
                 return redirect(url_for('auth.login'))
 
-    render = make_response(render_template('auth/login.html', form=form))
+    render = make_response(render_template('auth/login.html', form=form), status)
+    if status == 503:
+        render.headers.set('Retry-After', '1')
+    elif status == 429:
+        render.headers.set('Retry-After', str(retry_after))
     render.headers.set('Content-Security-Policy', "default-src 'self'")
     render.headers.set('X-Content-Type-Options', 'nosniff')
     render.headers.set('X-Frame-Options', 'SAMEORIGIN')
@@ -278,13 +360,17 @@ def login_history():
 
 @bp.before_app_request
 def load_logged_in_user():
-    """Configures the session information for a logged in user."""
+    """
+    Configures the session information for a logged in user.
+
+    The user record comes from the per-worker user cache, so warm requests do not query the database.
+    """
     user_id = session.get('user_id')
 
     if user_id is None:
         g.user = None
     else:
-        g.user = models.Users.query.filter_by(id=user_id).first()
+        g.user = usercache.get_user(user_id)
 
 
 @bp.route('/logout')
@@ -294,10 +380,24 @@ def logout():
 
     Defines logic for the logout view.
     Terminates the session and logs the logout time for the session.
+    When the login was queued by write-behind, its AuthLog row is updated by user ID and login time.
+    If another worker queued the login and has not written it yet, the row is inserted here and that worker skips it.
     """
     login_id = session.get('login_id')
-    login_log = models.AuthLog.query.get(login_id)
-    login_log.logout_time = datetime.datetime.now()
-    db.session.commit()
+    login_time = session.get('login_time')
+    if login_id is not None:
+        login_log = models.AuthLog.query.get(login_id)
+        if login_log is not None:
+            login_log.logout_time = datetime.datetime.now()
+            db.session.commit()
+    elif login_time is not None and g.user is not None:
+        writebehind.flush()
+        login_time = datetime.datetime.strptime(login_time, writebehind.DATETIME_FORMAT)
+        logout_time = datetime.datetime.now()
+        updated = models.AuthLog.query.filter_by(userid=g.user.id, login_time=login_time) \
+            .update({models.AuthLog.logout_time: logout_time}, synchronize_session=False)
+        if not updated:
+            db.session.add(models.AuthLog(userid=g.user.id, username=g.user.username, login_time=login_time, logout_time=logout_time))
+        db.session.commit()
     session.clear()
     return redirect(url_for('index'))
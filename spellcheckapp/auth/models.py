@@ -2,8 +2,6 @@
 import base64
 import os
 
-import onetimepass
-
 from spellcheckapp import db
 
 
@@ -19,6 +17,8 @@ class Users(db.Model):
     password = db.Column(db.String(100), unique=False, nullable=False)
     mfa_registered = db.Column(db.Boolean, unique=False, default=False)
     is_admin = db.Column(db.Boolean, unique=False, default=False)
+    spell_check_count = db.Column(db.Integer, unique=False, nullable=False, default=0, server_default='0')
+    mfa = db.relationship('MFA', uselist=False, viewonly=True)
 
     def __repr__(self):
         """Defines string representation of a Users tuple."""
@@ -47,10 +47,6 @@ class MFA(db.Model):
         return 'otpauth://totp/Spell-Checker-Web:{0}?secret={1}&issuer=Spell-Checker-Web' \
             .format(self.username, self.mfa_secret)
 
-    def verify_totp(self, token):
-        """Verifies TOTP."""
-        return onetimepass.valid_totp(token, self.mfa_secret, window=1)
-
     def __repr__(self):
         """Defines string representation of a MFA tuple."""
         return '<MFA_User %r' % self.username
@@ -72,3 +68,21 @@ class AuthLog(db.Model):
     def __repr__(self):
         """Defines string representation of an AuthLog tuple."""
         return '<AuthLog %r' % self.id
+
+
+class LoginThrottleBucket(db.Model):
+    """
+    LoginThrottleBucket Database Model.
+
+    Defines the token bucket fields of the shared login throttle, keyed on a username or client IP.
+    """
+
+    __tablename__ = 'login_throttle'
+
+    key = db.Column(db.String(128), primary_key=True)
+    tokens = db.Column(db.Float, unique=False, nullable=False)
+    updated = db.Column(db.Float, unique=False, nullable=False, index=True)
+
+    def __repr__(self):
+        """Defines string representation of a LoginThrottleBucket tuple."""
+        return '<LoginThrottleBucket %r>' % self.key
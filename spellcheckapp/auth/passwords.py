@@ -0,0 +1,140 @@
+"""
+Password Hashing for the Auth Module.
+
+Password hashes are computed and checked on a pool of PASSWORD_HASH_WORKERS threads per worker process. The request thread
+still waits for its hash, the pool only caps how many hashes run at once, so a burst of logins keeps at most that many cores
+busy with PBKDF2.
+
+At most PASSWORD_HASH_MAX_PENDING hashes may be queued or running, further requests are refused right away with
+PasswordHasherBusyError rather than queueing behind them, which bounds the request threads left waiting on hashes.
+New hashes use PASSWORD_HASH_METHOD, a werkzeug method such as `pbkdf2:sha256:260000`.
+Hashes made with another method or cost are replaced with one made with it on the next successful login.
+"""
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+
+from flask import current_app
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when PASSWORD_HASH_MAX_PENDING hashes are already queued or running."""
+
+
+def normalize_method(method):
+    """Returns a werkzeug hash method with the PBKDF2 iterations spelled out, as they are stored in hashes."""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+
+class PasswordHasher(object):
+    """
+    Password Hasher.
+
+    Hashes and checks passwords on a thread pool that is started by the first request of each worker process.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', workers=2, max_pending=32):
+        """Stores the hasher settings."""
+        self.method = normalize_method(method)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.hashed = 0
+        self.checked = 0
+        self.rehashed = 0
+        self.rejected = 0
+        self.last_seconds = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._pending = 0
+
+    def _run(self, fn, *args):
+        """Runs fn(*args) on the pool and returns its result, raises PasswordHasherBusyError if the pool is saturated."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # A pool inherited from a parent process has no threads.
+                self._pid = os.getpid()
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                self._pending = 0
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusyError('Too many password hashes are pending.')
+            self._pending += 1
+        started = time.monotonic()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self.last_seconds = time.monotonic() - started
+            with self._lock:
+                self._pending -= 1
+
+    def hash(self, password):
+        """Returns a hash of password made with the configured method."""
+        pwhash = self._run(generate_password_hash, password, self.method)
+        self.hashed += 1
+        return pwhash
+
+    def check(self, pwhash, password):
+        """Returns True if password matches pwhash."""
+        matches = self._run(check_password_hash, pwhash, password)
+        self.checked += 1
+        return matches
+
+    def needs_rehash(self, pwhash):
+        """Returns True if pwhash was made with another method or cost than the configured one."""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def upgrade(self, pwhash, password):
+        """
+        Returns a new hash of the password that matched pwhash if pwhash needs a rehash, otherwise None.
+
+        Also returns None when the pool is saturated, the hash is then upgraded on a later login.
+        """
+        if not self.needs_rehash(pwhash):
+            return None
+        try:
+            new_hash = self.hash(password)
+        except PasswordHasherBusyError:
+            return None
+        self.rehashed += 1
+        return new_hash
+
+    def stats(self):
+        """Returns the hasher counters, including the number of hashes this worker has queued or running."""
+        with self._lock:
+            pending = self._pending if self._pid == os.getpid() else 0
+        return {'method': self.method,
+                'pending': pending,
+                'hashed': self.hashed,
+                'checked': self.checked,
+                'rehashed': self.rehashed,
+                'rejected': self.rejected,
+                'last_seconds': self.last_seconds}
+
+    def close(self):
+        """Stops the thread pool of this worker."""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+
+
+def init_app(app):
+    """Creates the password hasher and associates it with the app."""
+    from spellcheckapp import metrics
+    hasher = PasswordHasher(method=app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+                            workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+                            max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 32))
+    app.extensions['password_hasher'] = hasher
+    metrics.register(app, 'passwords', hasher.stats)
+    atexit.register(hasher.close)
+
+
+def get_hasher():
+    """Returns the password hasher of the current app."""
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,89 @@
+"""
+MFA QR Code Cache for the Auth Module.
+
+Rendering the SVG QR code of an MFA secret builds the whole QR matrix, and browsers fetch it again on every refresh
+of the MFA setup page. Rendered codes are kept per worker, keyed on the username and secret, along with an ETag
+so a repeat fetch is answered with a 304 without rendering anything.
+
+A new secret gets a new key, so a recreated MFA row never serves the old code. Views that delete or recreate
+a user's MFA row also invalidate the user's entry, so the old secret is not kept in memory.
+"""
+import collections
+import hashlib
+import io
+import threading
+
+from flask import current_app
+
+import pyqrcode
+
+RenderedCode = collections.namedtuple('RenderedCode', ['etag', 'svg'])
+
+
+def render_svg(uri, scale=5):
+    """Returns the SVG QR code of uri."""
+    stream = io.BytesIO()
+    pyqrcode.create(uri).svg(stream, scale=scale)
+    return stream.getvalue()
+
+
+class QRCodeCache(object):
+    """
+    QR Code Cache.
+
+    Maps (username, secret) to the RenderedCode of its TOTP URI, keeping at most max_entries.
+    """
+
+    def __init__(self, max_entries=1000):
+        """Creates an empty cache."""
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, mfa):
+        """Returns the RenderedCode of an MFA row, rendering it if needed."""
+        key = (mfa.username, mfa.mfa_secret)
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return code
+        self.misses += 1
+        uri = mfa.get_totp_uri()
+        code = RenderedCode(hashlib.sha256(uri.encode('utf-8')).hexdigest()[:32], render_svg(uri))
+        with self._lock:
+            self._entries[key] = code
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return code
+
+    def invalidate(self, username):
+        """Drops the cached codes of username."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == username]:
+                del self._entries[key]
+
+    def stats(self):
+        """Returns the cache counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def init_app(app):
+    """Creates the QR code cache and associates it with the app."""
+    from spellcheckapp import metrics
+    qr_cache = QRCodeCache(max_entries=app.config.get('QRCODE_CACHE_MAX_ENTRIES', 1000))
+    app.extensions['qrcode_cache'] = qr_cache
+    metrics.register(app, 'qrcode_cache', qr_cache.stats)
+
+
+def get_code(mfa):
+    """Returns the RenderedCode of an MFA row from the current app's cache."""
+    return current_app.extensions['qrcode_cache'].get(mfa)
+
+
+def invalidate(username):
+    """Drops the cached codes of username from the current app's cache."""
+    current_app.extensions['qrcode_cache'].invalidate(username)
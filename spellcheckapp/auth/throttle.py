@@ -0,0 +1,207 @@
+"""
+Login Throttling for the Auth Module.
+
+Each login attempt takes a token from a bucket for the username before the user is looked up or a password hash is checked.
+A bucket holds up to `burst` tokens and refills at `per_minute` tokens a minute, an attempt that finds its bucket empty
+is refused with a 429.
+
+Attempts can also be limited per client IP with LOGIN_THROTTLE_IP. This is off by default: behind a load balancer or
+a Service that rewrites source addresses every client shares one address, and a single busy period would lock everyone out.
+When the app sits behind proxies, LOGIN_THROTTLE_PROXIES says how many of them append to X-Forwarded-For, and the client IP
+is taken from the entry the outermost trusted proxy added. Entries a client sent itself are never trusted.
+
+Buckets are kept per worker by default. The database backend keeps them in the login_throttle table instead,
+so every replica using the database shares them.
+"""
+import collections
+import math
+import threading
+import time
+
+from flask import current_app
+
+from spellcheckapp import db
+from spellcheckapp.auth.models import LoginThrottleBucket
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+
+def refill(tokens, updated, now, burst, rate):
+    """
+    Refills a bucket last updated at updated and takes a token from it if it has one.
+
+    Returns (tokens, retry_after), retry_after is 0 if a token was taken, otherwise the seconds until one is available.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class LocalBucketStore(object):
+    """
+    Local Bucket Store.
+
+    Keeps buckets in process, dropping the least recently used once there are more than max_entries.
+    """
+
+    def __init__(self, max_entries=100000):
+        """Creates an empty store."""
+        self.max_entries = max_entries
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate):
+        """Takes a token from the bucket for key, returns 0 or the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, retry_after = refill(tokens, updated, now, burst, rate)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self):
+        """Returns the number of buckets."""
+        return len(self._buckets)
+
+
+class DatabaseBucketStore(object):
+    """
+    Shared Database Bucket Store.
+
+    Keeps buckets in the login_throttle table so every replica using the database shares them.
+    Buckets that have refilled completely are pruned every prune_every attempts.
+    """
+
+    def __init__(self, prune_every=1000):
+        """Stores the pruning settings."""
+        self.prune_every = prune_every
+        self._takes = 0
+
+    def take(self, key, burst, rate):
+        """Takes a token from the bucket for key, returns 0 or the seconds until a token is available."""
+        table = LoginThrottleBucket.__table__
+        for attempt in range(2):
+            now = time.time()
+            try:
+                with db.engine.begin() as conn:
+                    row = conn.execute(select([table.c.tokens, table.c.updated]).where(table.c.key == key).with_for_update()).first()
+                    if row is None:
+                        tokens, retry_after = refill(burst, now, now, burst, rate)
+                        conn.execute(table.insert().values(key=key, tokens=tokens, updated=now))
+                    else:
+                        tokens, retry_after = refill(row.tokens, row.updated, now, burst, rate)
+                        conn.execute(table.update().where(table.c.key == key).values(tokens=tokens, updated=now))
+                break
+            except IntegrityError:
+                # Another replica created the bucket first, take from it instead.
+                if attempt:
+                    raise
+        self._takes += 1
+        if self._takes % self.prune_every == 0:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.updated < now - burst / rate))
+        return retry_after
+
+    def __len__(self):
+        """Returns the number of buckets."""
+        with db.engine.connect() as conn:
+            return conn.execute(select([db.func.count()]).select_from(LoginThrottleBucket.__table__)).scalar()
+
+
+def client_ip(remote_addr, forwarded_for, proxies=0):
+    """
+    Returns the client IP of a request from remote_addr and its X-Forwarded-For header.
+
+    proxies is the number of trusted proxies in front of the app that append to X-Forwarded-For, 0 if clients connect directly.
+    """
+    if proxies <= 0:
+        return remote_addr
+    forwarded = [address.strip() for address in (forwarded_for or '').split(',') if address.strip()]
+    if len(forwarded) < proxies:
+        return remote_addr
+    return forwarded[-proxies]
+
+
+class LoginThrottle(object):
+    """
+    Login Throttle.
+
+    Limits login attempts per username, and optionally per client IP, with token buckets kept in a bucket store.
+    """
+
+    def __init__(self, store, user_burst=10, user_per_minute=5, ip_burst=None, ip_per_minute=30, proxies=0):
+        """Stores the bucket store and the limits, attempts are only limited per client IP if ip_burst is set."""
+        self.store = store
+        self.proxies = proxies
+        self.user_burst = user_burst
+        self.user_rate = user_per_minute / 60.0
+        self.ip_burst = ip_burst
+        self.ip_rate = ip_per_minute / 60.0
+        self.allowed = 0
+        self.limited_user = 0
+        self.limited_ip = 0
+        self.errors = 0
+
+    def check(self, username, ip):
+        """
+        Takes a token for an attempt to log in as username from ip, ip is ignored unless per IP limits are set.
+
+        Returns 0 if the attempt may proceed, otherwise the whole number of seconds until it may be retried.
+        Attempts are allowed if the store fails, so an unavailable shared store does not lock every user out.
+        """
+        try:
+            if self.ip_burst is not None:
+                retry_after = self.store.take('ip:%s' % ip, self.ip_burst, self.ip_rate)
+                if retry_after:
+                    self.limited_ip += 1
+                    return int(math.ceil(retry_after))
+            retry_after = self.store.take('user:%s' % username.lower(), self.user_burst, self.user_rate)
+            if retry_after:
+                self.limited_user += 1
+                return int(math.ceil(retry_after))
+        except SQLAlchemyError:
+            current_app.logger.exception('Login throttle store failed, allowing the attempt.')
+            self.errors += 1
+        self.allowed += 1
+        return 0
+
+    def stats(self):
+        """Returns the throttle counters."""
+        return {'allowed': self.allowed,
+                'limited_user': self.limited_user,
+                'limited_ip': self.limited_ip,
+                'errors': self.errors,
+                'buckets': len(self.store) if isinstance(self.store, LocalBucketStore) else None}
+
+
+def init_app(app):
+    """Creates the login throttle described by the LOGIN_THROTTLE_* config keys and associates it with the app."""
+    from spellcheckapp import metrics
+    if not app.config.get('LOGIN_THROTTLE', True):
+        app.extensions['login_throttle'] = None
+        return
+    backend = app.config.get('LOGIN_THROTTLE_BACKEND', 'local')
+    if backend == 'local':
+        store = LocalBucketStore(app.config.get('LOGIN_THROTTLE_MAX_ENTRIES', 100000))
+    elif backend == 'database':
+        store = DatabaseBucketStore()
+    else:
+        raise ValueError('Unknown LOGIN_THROTTLE_BACKEND: %r' % backend)
+    throttle = LoginThrottle(store,
+                             user_burst=app.config.get('LOGIN_THROTTLE_USER_BURST', 10),
+                             user_per_minute=app.config.get('LOGIN_THROTTLE_USER_PER_MINUTE', 5),
+                             ip_burst=app.config.get('LOGIN_THROTTLE_IP_BURST', 50) if app.config.get('LOGIN_THROTTLE_IP', False) else None,
+                             ip_per_minute=app.config.get('LOGIN_THROTTLE_IP_PER_MINUTE', 30),
+                             proxies=app.config.get('LOGIN_THROTTLE_PROXIES', 0))
+    app.extensions['login_throttle'] = throttle
+    metrics.register(app, 'login_throttle', throttle.stats)
+
+
+def get_throttle():
+    """Returns the login throttle of the current app, or None if throttling is disabled."""
+    return current_app.extensions['login_throttle']
@@ -0,0 +1,112 @@
+"""
+TOTP Verification for the Auth Module.
+
+Codes are accepted for the current 30 second interval and one interval either side, to allow for clock skew.
+The codes of a secret for those intervals are computed once and kept until the intervals pass, so repeated
+submissions do not compute them again.
+
+A code is accepted once: after a code has been used, codes of the same or an earlier interval are refused for that user,
+which stops a code seen over someone's shoulder or in a log from being replayed. Used intervals are kept per worker
+in buckets that are dropped once the interval can no longer be submitted.
+"""
+import threading
+import time
+
+from flask import current_app
+
+import onetimepass
+
+INTERVAL = 30
+WINDOW = 1
+TOKEN_LENGTH = 6
+
+
+class TOTPVerifier(object):
+    """
+    TOTP Verifier.
+
+    Checks TOTP codes against the codes of the current window, refusing codes that were already used.
+    """
+
+    def __init__(self, max_secrets=10000):
+        """Creates empty code and replay caches."""
+        self.max_secrets = max_secrets
+        self.accepted = 0
+        self.rejected = 0
+        self.replays = 0
+        self.code_hits = 0
+        self.code_misses = 0
+        # interval -> {secret: code}, so the codes of an interval are dropped together once it passes
+        self._codes = {}
+        # interval -> IDs of the users who used a code of that interval
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def _code(self, secret, interval):
+        """Returns the code of secret for an interval, computing it only if it is not cached. Called with the lock held."""
+        codes = self._codes.setdefault(interval, {})
+        code = codes.get(secret)
+        if code is not None:
+            self.code_hits += 1
+            return code
+        self.code_misses += 1
+        code = onetimepass.get_totp(secret, as_string=True, token_length=TOKEN_LENGTH, interval_length=INTERVAL, clock=interval * INTERVAL).decode('ascii')
+        codes[secret] = code
+        if len(codes) > self.max_secrets:
+            # Drop the code computed first, the bucket goes away with its interval anyway.
+            del codes[next(iter(codes))]
+        return code
+
+    def _expire(self, current):
+        """Drops used intervals and codes that can no longer be submitted. Called with the lock held."""
+        for buckets in (self._used, self._codes):
+            for interval in [interval for interval in buckets if interval < current - WINDOW]:
+                del buckets[interval]
+
+    def verify(self, user_id, secret, token, now=None):
+        """Returns True if token is a valid code of secret that user_id has not used yet, and records it as used."""
+        token = (token or '').strip()
+        if len(token) != TOKEN_LENGTH or not token.isdigit():
+            self.rejected += 1
+            return False
+        current = int(time.time() if now is None else now) // INTERVAL
+        with self._lock:
+            self._expire(current)
+            for interval in range(current - WINDOW, current + WINDOW + 1):
+                if self._code(secret, interval) != token:
+                    continue
+                if any(user_id in self._used.get(used, ()) for used in range(interval, current + WINDOW + 1)):
+                    self.replays += 1
+                    self.rejected += 1
+                    return False
+                self._used.setdefault(interval, set()).add(user_id)
+                self.accepted += 1
+                return True
+        self.rejected += 1
+        return False
+
+    def stats(self):
+        """Returns the verifier counters."""
+        with self._lock:
+            used = sum(len(users) for users in self._used.values())
+            codes = sum(len(codes) for codes in self._codes.values())
+        return {'accepted': self.accepted,
+                'rejected': self.rejected,
+                'replays': self.replays,
+                'code_hits': self.code_hits,
+                'code_misses': self.code_misses,
+                'codes': codes,
+                'used': used}
+
+
+def init_app(app):
+    """Creates the TOTP verifier and associates it with the app."""
+    from spellcheckapp import metrics
+    verifier = TOTPVerifier(max_secrets=app.config.get('TOTP_CACHE_MAX_SECRETS', 10000))
+    app.extensions['totp_verifier'] = verifier
+    metrics.register(app, 'totp', verifier.stats)
+
+
+def get_verifier():
+    """Returns the TOTP verifier of the current app."""
+    return current_app.extensions['totp_verifier']
@@ -0,0 +1,85 @@
+"""
+Logged In User Cache for the Auth Module.
+
+Keeps a small per-worker record of recently seen users so that authenticating a request does not query the database.
+Entries expire after USER_CACHE_TTL seconds, views that change a user's record invalidate it right away.
+Other workers and replicas pick up changes once their entry expires.
+"""
+import collections
+import threading
+import time
+
+from flask import current_app
+
+from spellcheckapp.auth import models
+
+CachedUser = collections.namedtuple('CachedUser', ['id', 'username', 'is_admin', 'mfa_registered'])
+
+
+class UserCache(object):
+    """
+    User Cache.
+
+    Maps user IDs to CachedUser records for ttl seconds, keeping at most max_entries.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        """Creates an empty cache."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Returns the CachedUser for user_id, loading it from the database if needed, or None if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        row = models.Users.query \
+            .with_entities(models.Users.id, models.Users.username, models.Users.is_admin, models.Users.mfa_registered) \
+            .filter_by(id=user_id) \
+            .first()
+        if row is None:
+            return None
+        user = CachedUser(row.id, row.username, bool(row.is_admin), bool(row.mfa_registered))
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        """Drops the cached record for user_id."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        """Returns the cache counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def init_app(app):
+    """Creates the user cache and associates it with the app."""
+    from spellcheckapp import metrics
+    user_cache = UserCache(ttl=app.config.get('USER_CACHE_TTL', 30))
+    app.extensions['user_cache'] = user_cache
+    metrics.register(app, 'user_cache', user_cache.stats)
+
+
+def get_user(user_id):
+    """Returns the CachedUser for user_id from the current app's cache."""
+    return current_app.extensions['user_cache'].get(user_id)
+
+
+def invalidate(user_id):
+    """Drops the cached record for user_id from the current app's cache."""
+    current_app.extensions['user_cache'].invalidate(user_id)
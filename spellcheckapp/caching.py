@@ -0,0 +1,89 @@
+"""
+HTTP Caching for Spellcheckapp.
+
+Static asset URLs built with url_for('static', ...) carry a hash of the file's content as the `v` argument.
+A request for the current version of a file is answered with `Cache-Control: immutable` and a one year max-age,
+as a changed file gets a new URL. Requests without a version, or for an old one, get the default short-lived caching.
+
+Views whose pages only change with the data they show compute an ETag from that data, along with the templates and
+stylesheet that render it, and answer a matching If-None-Match with a 304 before rendering anything.
+"""
+import hashlib
+import os
+import threading
+
+from flask import current_app, request
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def file_hash(path):
+    """Returns a short hash of the content of the file at path, recomputed only when the file changes, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _hashes.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, 'rb') as asset:
+        digest = hashlib.sha1(asset.read()).hexdigest()[:12]
+    with _hashes_lock:
+        _hashes[path] = (key, digest)
+    return digest
+
+
+def static_hash(filename):
+    """Returns the content hash of a file in the app's static folder."""
+    return file_hash(os.path.join(current_app.static_folder, filename))
+
+
+def template_hash(name):
+    """Returns the content hash of a template of the app."""
+    _, path, _ = current_app.jinja_env.loader.get_source(current_app.jinja_env, name)
+    return file_hash(path)
+
+
+def etag(templates, *parts):
+    """
+    Returns an ETag for a page rendered from templates, showing the data in parts.
+
+    The ETag changes with the templates and the stylesheet, so a deploy that changes how a page looks never serves a stale one.
+    """
+    digest = hashlib.sha1()
+    for name in templates:
+        digest.update(('%s:%s\0' % (name, template_hash(name))).encode('utf-8'))
+    digest.update(('style.css:%s\0' % static_hash('style.css')).encode('utf-8'))
+    digest.update(repr(parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def not_modified(tag):
+    """Returns True if the request's If-None-Match holds tag."""
+    return request.if_none_match.contains_weak(tag)
+
+
+def _add_static_version(endpoint, values):
+    """URL defaults callback, adds the content hash of static files to their URLs."""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = static_hash(values['filename'])
+        if digest is not None:
+            values['v'] = digest
+
+
+def _static_cache_headers(response):
+    """Marks the current version of a static file as immutable."""
+    if request.endpoint == 'static' and response.status_code == 200 and request.args.get('v'):
+        if request.args['v'] == static_hash(request.view_args['filename']):
+            response.headers.set('Cache-Control', 'public, max-age=%d, immutable' % STATIC_MAX_AGE)
+    return response
+
+
+def init_app(app):
+    """Adds content hashes to static URLs and long-lived caching to the versioned static files of the app."""
+    app.url_defaults(_add_static_version)
+    app.after_request(_static_cache_headers)
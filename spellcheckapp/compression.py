@@ -0,0 +1,102 @@
+"""
+Response Compression for Spellcheckapp.
+
+JSON responses and static CSS and JavaScript of at least COMPRESS_MIN_SIZE bytes are compressed with the best encoding
+the client accepts: brotli if the optional brotli package is installed, otherwise gzip.
+Streamed responses, such as NDJSON results of a document check, are sent as they are produced and never compressed.
+
+HTML is not compressed by default. Pages echo submitted text next to secrets such as CSRF tokens, and the compressed size
+of such a page leaks those secrets (BREACH). HTML can be added to COMPRESS_MIMETYPES, but a response is never compressed
+once a CSRF token was generated for its request.
+"""
+import gzip
+
+from flask import current_app, g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/css', 'application/javascript')
+
+
+class Compressor(object):
+    """
+    Compressor.
+
+    An after_request handler that compresses response bodies, and counts how many bytes it saved.
+    """
+
+    def __init__(self, min_size=500, gzip_level=6, brotli_quality=5, mimetypes=COMPRESSIBLE_MIMETYPES):
+        """Stores the compression settings."""
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = mimetypes
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def encoding(self, response):
+        """Returns the encoding to compress a response with, or None to send it as it is."""
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return None
+        if response.mimetype not in self.mimetypes or 'Content-Encoding' in response.headers:
+            return None
+        if current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g:
+            return None
+        # Static files are sent from disk, they are read into memory to be compressed.
+        if response.direct_passthrough and request.endpoint != 'static':
+            return None
+        if response.is_streamed and not response.direct_passthrough:
+            return None
+        if (response.content_length or 0) < self.min_size:
+            return None
+        return request.accept_encodings.best_match(self.encodings)
+
+    def __call__(self, response):
+        """Compresses the response if it is worth it and the client accepts it."""
+        encoding = self.encoding(response)
+        if encoding is None:
+            if response.mimetype in self.mimetypes:
+                response.vary.add('Accept-Encoding')
+            return response
+        response.direct_passthrough = False
+        data = response.get_data()
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(data, self.gzip_level)
+        response.set_data(compressed)
+        response.headers.set('Content-Encoding', encoding)
+        response.vary.add('Accept-Encoding')
+        if response.get_etag()[0] is not None:
+            # The compressed body differs from the one the ETag was made for, so it is only weakly the same.
+            response.set_etag(response.get_etag()[0], weak=True)
+        self.compressed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return response
+
+    def stats(self):
+        """Returns the compression counters."""
+        return {'encodings': self.encodings,
+                'compressed': self.compressed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out}
+
+
+def init_app(app):
+    """Compresses the app's responses unless COMPRESS_ENABLED is False."""
+    from spellcheckapp import metrics
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    compressor = Compressor(min_size=app.config.get('COMPRESS_MIN_SIZE', 500),
+                            gzip_level=app.config.get('COMPRESS_GZIP_LEVEL', 6),
+                            brotli_quality=app.config.get('COMPRESS_BROTLI_QUALITY', 5),
+                            mimetypes=tuple(app.config.get('COMPRESS_MIMETYPES', COMPRESSIBLE_MIMETYPES)))
+    app.extensions['compression'] = compressor
+    app.after_request(compressor)
+    metrics.register(app, 'compression', compressor.stats)
@@ -0,0 +1,34 @@
+"""
+Metrics for Spellcheckapp.
+
+Components register a provider, a function returning a dict of counters, under a name.
+The /metrics view returns every provider's counters as JSON when METRICS_ENABLED is set.
+"""
+from flask import Blueprint, abort, current_app, jsonify
+
+bp = Blueprint('metrics', __name__)
+
+
+def register(app, name, provider):
+    """Registers a metrics provider for the app."""
+    app.extensions.setdefault('metrics', {})[name] = provider
+
+
+def collect(app):
+    """Returns the counters of every registered provider."""
+    return {name: provider() for name, provider in app.extensions.get('metrics', {}).items()}
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Metrics View.
+
+    Returns app counters as JSON for monitoring, or a 404 if metrics are disabled.
+    """
+    if not current_app.config.get('METRICS_ENABLED'):
+        abort(404)
+    render = jsonify(collect(current_app))
+    render.headers.set('Cache-Control', 'no-cache, no-store, must-revalidate')
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    return render
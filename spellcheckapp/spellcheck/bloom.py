@@ -0,0 +1,105 @@
+"""
+Bloom Filter Prefilter for the Dictionary Engine.
+
+A Bloom filter answers `word in filter` with either "definitely not" or "maybe".
+Put in front of a wordlist it settles definite misses without looking at the wordlist,
+only words the filter may hold are confirmed with an exact lookup, so misspelled words are never accepted.
+The filter is sized from the word count and SPELLCHECK_BLOOM_FP_RATE, the share of misses that still need confirming.
+"""
+import math
+import zlib
+
+
+def optimal_size(count, fp_rate):
+    """Returns the (bits, hashes) of the smallest filter holding count words at the given false positive rate."""
+    if not 0 < fp_rate < 1:
+        raise ValueError('Bloom filter false positive rate must be between 0 and 1, got %r' % fp_rate)
+    count = max(count, 1)
+    bits = max(int(math.ceil(-count * math.log(fp_rate) / (math.log(2) ** 2))), 8)
+    hashes = max(int(round(bits / count * math.log(2))), 1)
+    return bits, hashes
+
+
+def _hashes(word):
+    """Returns the two 32 bit hashes of word that its bit positions are derived from by double hashing."""
+    encoded = word.encode('utf-8', 'surrogatepass')
+    return zlib.crc32(encoded), zlib.crc32(encoded[::-1]) | 1
+
+
+class BloomFilter(object):
+    """
+    Bloom Filter.
+
+    The bit array is a bytearray when built in process, or any indexable bytes such as a memory map starting at offset.
+    """
+
+    def __init__(self, bits, hashes, data=None, offset=0):
+        """Creates an empty filter, or wraps an existing bit array."""
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+        self.offset = offset
+
+    @classmethod
+    def from_words(cls, words, fp_rate):
+        """Builds a filter holding words."""
+        words = list(words)
+        bloom = cls(*optimal_size(len(words), fp_rate))
+        for word in words:
+            bloom.add(word)
+        return bloom
+
+    def add(self, word):
+        """Adds word to the filter."""
+        h1, h2 = _hashes(word)
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.bits
+            self.data[self.offset + (position >> 3)] |= 1 << (position & 7)
+
+    def __contains__(self, word):
+        """Returns False if word is definitely not in the filter, True if it may be."""
+        h1, h2 = _hashes(word)
+        bits = self.bits
+        data = self.data
+        offset = self.offset
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % bits
+            if not data[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_bytes(self):
+        """Returns the bit array."""
+        return bytes(self.data[self.offset:self.offset + (self.bits + 7) // 8])
+
+
+class PrefilteredWordlist(object):
+    """
+    Prefiltered Wordlist.
+
+    Checks membership against a Bloom filter first and confirms possible hits against the wordlist.
+    Counts how many lookups the filter settled on its own.
+    """
+
+    def __init__(self, bloom, words):
+        """Stores the filter and the wordlist it was built from."""
+        self.bloom = bloom
+        self.words = words
+        self.rejected = 0
+        self.confirmed = 0
+
+    def __contains__(self, word):
+        """Returns True if word is in the wordlist."""
+        if word not in self.bloom:
+            self.rejected += 1
+            return False
+        self.confirmed += 1
+        return word in self.words
+
+    def __len__(self):
+        """Returns the number of words."""
+        return len(self.words)
+
+    def stats(self):
+        """Returns the filter counters."""
+        return {'bits': self.bloom.bits, 'hashes': self.bloom.hashes, 'rejected': self.rejected, 'confirmed': self.confirmed}
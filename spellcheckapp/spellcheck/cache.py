@@ -0,0 +1,220 @@
+"""
+Spell Check Result Cache for Spellcheckapp.
+
+Results are keyed on a hash of the normalized submission and the engine fingerprint,
+so a new wordlist or executable never serves results computed with the old one.
+A per-worker LRU sits in front of an optional backend shared by every replica.
+"""
+import collections
+import datetime
+import hashlib
+import threading
+
+from spellcheckapp import db
+from spellcheckapp.spellcheck.engine import SpellCheckEngine
+from spellcheckapp.spellcheck.models import SpellCheckCache
+
+from sqlalchemy.exc import IntegrityError
+
+
+def cache_key(text, fingerprint):
+    """Returns the cache key for text checked by an engine with the given fingerprint."""
+    normalized = ' '.join(text.split())
+    return hashlib.sha256((fingerprint + '\0' + normalized).encode('utf-8')).hexdigest()
+
+
+def entry_size(key, words):
+    """Estimates the memory used by a cache entry in bytes."""
+    return 200 + len(key) + sum(len(word) + 50 for word in words)
+
+
+class LocalCache(object):
+    """
+    Local LRU Cache.
+
+    Keeps entries in process and evicts the least recently used once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes):
+        """Creates an empty cache."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached words for key, or None."""
+        with self._lock:
+            words = self._entries.get(key)
+            if words is None:
+                return None
+            self._entries.move_to_end(key)
+            return list(words)
+
+    def set(self, key, words):
+        """Stores words under key, evicting old entries to stay under max_bytes."""
+        size = entry_size(key, words)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= entry_size(key, self._entries.pop(key))
+            self._entries[key] = tuple(words)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_words = self._entries.popitem(last=False)
+                self.size -= entry_size(old_key, old_words)
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        """Returns the number of cached entries."""
+        return len(self._entries)
+
+
+class DatabaseCache(object):
+    """
+    Shared Database Cache.
+
+    Stores entries in the spell_check_cache table so every replica using the database shares them.
+    Entries older than ttl seconds are ignored and pruned every prune_every writes.
+    """
+
+    def __init__(self, ttl=86400, prune_every=100):
+        """Stores the expiry settings."""
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def get(self, key):
+        """Returns the cached words for key, or None."""
+        table = SpellCheckCache.__table__
+        oldest = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+        with db.engine.connect() as conn:
+            row = conn.execute(table.select().where(table.c.key == key).where(table.c.created >= oldest)).first()
+        if row is None:
+            return None
+        return list(filter(None, row.misspelled_words.split('\n')))
+
+    def set(self, key, words):
+        """Stores words under key, replacing an existing entry, unless another replica inserts one at the same time."""
+        table = SpellCheckCache.__table__
+        now = datetime.datetime.now()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.key == key))
+                conn.execute(table.insert().values(key=key, misspelled_words='\n'.join(words), created=now))
+        except IntegrityError:
+            pass
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.created < now - datetime.timedelta(seconds=self.ttl)))
+
+
+class ResultCache(object):
+    """
+    Spell Check Result Cache.
+
+    Looks entries up in the local LRU first and then in the shared backend, if there is one.
+    """
+
+    def __init__(self, local, shared=None):
+        """Stores the cache tiers."""
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached words for key, or None, and updates the hit counters."""
+        words = self.local.get(key)
+        if words is None and self.shared is not None:
+            words = self.shared.get(key)
+            if words is not None:
+                self.shared_hits += 1
+                self.local.set(key, words)
+        if words is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return words
+
+    def set(self, key, words):
+        """Stores words under key in every tier."""
+        self.local.set(key, words)
+        if self.shared is not None:
+            self.shared.set(key, words)
+
+    def stats(self):
+        """Returns the cache counters."""
+        return {'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'entries': len(self.local),
+                'bytes': self.local.size,
+                'evictions': self.local.evictions}
+
+
+class CachingEngine(SpellCheckEngine):
+    """
+    Caching Engine.
+
+    Wraps another engine and serves repeated submissions from a ResultCache.
+    """
+
+    def __init__(self, engine, cache):
+        """Stores the wrapped engine and the cache."""
+        self.engine = engine
+        self.cache = cache
+        self.name = engine.name
+
+    def fingerprint(self):
+        """Returns the wrapped engine's fingerprint."""
+        return self.engine.fingerprint()
+
+    def check(self, text):
+        """Returns the misspelled words in text, from the cache when possible."""
+        return self.check_many([text])[0]
+
+    def check_many(self, texts):
+        """Returns the misspelled words for each text, only checking texts that are not cached."""
+        fingerprint = self.engine.fingerprint()
+        keys = [cache_key(text, fingerprint) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, words in enumerate(results) if words is None]
+        if missing:
+            checked = self.engine.check_many([texts[i] for i in missing])
+            for i, words in zip(missing, checked):
+                results[i] = words
+                self.cache.set(keys[i], words)
+        return results
+
+    def uncached(self):
+        """Returns the wrapped engine, so the texts it checks are neither looked up nor stored."""
+        return self.engine
+
+    def reload(self):
+        """Reloads the wrapped engine, its fingerprint changes so results cached before are no longer used."""
+        return self.engine.reload()
+
+    def memory(self):
+        """Returns the wrapped engine's memory estimate, the cache has a budget of its own."""
+        return self.engine.memory()
+
+    def stats(self):
+        """Returns the wrapped engine's counters along with the cache counters."""
+        stats = self.engine.stats()
+        stats['cache'] = self.cache.stats()
+        return stats
+
+    def close(self):
+        """Closes the wrapped engine."""
+        self.engine.close()
@@ -0,0 +1,144 @@
+"""
+Compiled Wordlist Format for Spellcheckapp.
+
+`flask spellcheck compile-wordlist` turns a text wordlist into a binary file that the dictionary engine maps read-only,
+so every worker on a host shares one page cache copy instead of building its own set of words.
+
+Layout, all integers are little-endian unsigned 32 bit:
+
+- header: MAGIC, format version, word count, bucket count, string table size, Bloom filter bits and hashes.
+- bucket table: bucket count + 1 entry indexes, the entries of bucket b are entries[table[b]:table[b + 1]].
+- entry table: word count + 1 offsets into the string table, entry i is strings[offsets[i]:offsets[i + 1]].
+- string table: the UTF-8 words, ordered by bucket and sorted within each bucket.
+- Bloom filter: the bit array of an optional prefilter over the words, absent when its size in bits is 0.
+
+A word is in bucket crc32(word) & (bucket count - 1), the bucket count being a power of two at least the word count.
+"""
+import mmap
+import os
+import struct
+import zlib
+
+from spellcheckapp.spellcheck.bloom import BloomFilter
+
+MAGIC = b'SCWORDS\0'
+VERSION = 2
+
+_HEADER = struct.Struct('<8sIIIIII')
+_U32 = struct.Struct('<I')
+_U32_PAIR = struct.Struct('<II')
+
+
+def bucket_of(word, buckets):
+    """Returns the bucket of a UTF-8 encoded word."""
+    return zlib.crc32(word) & (buckets - 1)
+
+
+def is_compiled(path):
+    """Returns True if the file at path is a compiled wordlist."""
+    with open(path, 'rb') as wordlist:
+        return wordlist.read(len(MAGIC)) == MAGIC
+
+
+def compile_wordlist(words, path, bloom_fp_rate=None):
+    """
+    Writes words to path in the compiled format and returns the number of distinct words written.
+
+    If bloom_fp_rate is set a Bloom filter with that false positive rate is stored along with the words.
+
+    The file is written next to path and moved into place, so workers with the old file mapped keep reading it unchanged.
+    """
+    encoded = sorted({word.encode('utf-8') for word in words})
+    buckets = 1
+    while buckets < len(encoded):
+        buckets *= 2
+    encoded.sort(key=lambda word: (bucket_of(word, buckets), word))
+
+    bucket_table = [0] * (buckets + 1)
+    for word in encoded:
+        bucket_table[bucket_of(word, buckets) + 1] += 1
+    for bucket in range(buckets):
+        bucket_table[bucket + 1] += bucket_table[bucket]
+    offsets = [0]
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    if bloom_fp_rate:
+        bloom = BloomFilter.from_words((word.decode('utf-8') for word in encoded), bloom_fp_rate)
+        bloom_bits, bloom_hashes, bloom_data = bloom.bits, bloom.hashes, bloom.to_bytes()
+    else:
+        bloom_bits, bloom_hashes, bloom_data = 0, 0, b''
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as compiled:
+            compiled.write(_HEADER.pack(MAGIC, VERSION, len(encoded), buckets, offsets[-1], bloom_bits, bloom_hashes))
+            compiled.write(struct.pack('<%dI' % len(bucket_table), *bucket_table))
+            compiled.write(struct.pack('<%dI' % len(offsets), *offsets))
+            compiled.write(b''.join(encoded))
+            compiled.write(bloom_data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(encoded)
+
+
+class CompiledWordlist(object):
+    """
+    Compiled Wordlist.
+
+    A read-only memory map of a compiled wordlist file that supports `word in wordlist`, len() and iteration.
+    """
+
+    def __init__(self, path):
+        """Maps the file at path, raising ValueError if it is not a compiled wordlist."""
+        with open(path, 'rb') as compiled:
+            self._map = mmap.mmap(compiled.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _HEADER.size:
+                raise ValueError('%s is not a compiled wordlist' % path)
+            magic, version, self.count, self.buckets, strings_size, self.bloom_bits, self.bloom_hashes = _HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError('%s is not a compiled wordlist' % path)
+            if version != VERSION:
+                raise ValueError('%s has unsupported compiled wordlist version %d' % (path, version))
+            self._bucket_table = _HEADER.size
+            self._offsets = self._bucket_table + (self.buckets + 1) * _U32.size
+            self._strings = self._offsets + (self.count + 1) * _U32.size
+            self._bloom = self._strings + strings_size
+            if len(self._map) != self._bloom + (self.bloom_bits + 7) // 8:
+                raise ValueError('%s is truncated' % path)
+        except Exception:
+            self._map.close()
+            raise
+
+    def __contains__(self, word):
+        """Returns True if word is in the wordlist."""
+        encoded = word.encode('utf-8', 'surrogatepass')
+        start, end = _U32_PAIR.unpack_from(self._map, self._bucket_table + bucket_of(encoded, self.buckets) * _U32.size)
+        for entry in range(start, end):
+            word_start, word_end = _U32_PAIR.unpack_from(self._map, self._offsets + entry * _U32.size)
+            if self._map[self._strings + word_start:self._strings + word_end] == encoded:
+                return True
+        return False
+
+    def __len__(self):
+        """Returns the number of words."""
+        return self.count
+
+    def __iter__(self):
+        """Yields every word."""
+        for entry in range(self.count):
+            word_start, word_end = _U32_PAIR.unpack_from(self._map, self._offsets + entry * _U32.size)
+            yield self._map[self._strings + word_start:self._strings + word_end].decode('utf-8')
+
+    def bloom(self):
+        """Returns the stored Bloom filter, read straight from the memory map, or None if the file has none."""
+        if not self.bloom_bits:
+            return None
+        return BloomFilter(self.bloom_bits, self.bloom_hashes, self._map, self._bloom)
+
+    def close(self):
+        """Unmaps the file."""
+        self._map.close()
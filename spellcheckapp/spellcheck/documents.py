@@ -0,0 +1,143 @@
+"""
+Large Document Spell Checking for Spellcheckapp.
+
+Documents are read from the request body DOCUMENT_CHUNK_SIZE bytes at a time and checked chunk by chunk,
+so a worker holds about one chunk of a document in memory whatever its size. Chunks are cut at whitespace,
+only a word longer than a chunk is split across two chunks.
+
+The full text is stored out of row, zlib compressed, in spell_check_document_chunks. It is compressed into a temporary file
+while the document is checked and written in one short transaction at the end, so nothing is stored for a document that
+fails part way and the database is not held up for the length of the upload.
+"""
+import codecs
+import tempfile
+import zlib
+
+from spellcheckapp import db
+from spellcheckapp.auth import models as authmodels
+from spellcheckapp.spellcheck import models
+
+PREVIEW_LENGTH = 500
+
+
+class DocumentTooLargeError(Exception):
+    """Raised when a document is larger than DOCUMENT_MAX_BYTES."""
+
+
+def iter_chunks(stream, chunk_size=65536, max_bytes=None):
+    """
+    Reads UTF-8 text from a binary stream and yields it in chunks that end at whitespace.
+
+    Chunks are shorter than twice chunk_size characters: a chunk runs past chunk_size only to finish its last word,
+    and a word longer than chunk_size is split.
+    Raises DocumentTooLargeError once more than max_bytes have been read.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    pending = ''
+    read = 0
+    while True:
+        data = stream.read(chunk_size)
+        read += len(data)
+        if max_bytes is not None and read > max_bytes:
+            raise DocumentTooLargeError('Exceeded max document size: %d bytes' % max_bytes)
+        if len(pending) >= chunk_size:
+            # pending is the start of a word longer than a chunk, yield it before the next read makes it longer still.
+            yield pending
+            pending = ''
+        pending += decoder.decode(data, final=not data)
+        if not data:
+            break
+        cut = max(pending.rfind(' '), pending.rfind('\n'), pending.rfind('\t'), pending.rfind('\r'))
+        if cut >= 0:
+            yield pending[:cut + 1]
+            pending = pending[cut + 1:]
+    if pending:
+        yield pending
+
+
+class DocumentWriter(object):
+    """
+    Document Writer.
+
+    Compresses a document's text into a temporary file as it is checked, and stores it along with a SpellChecks row
+    summarizing the results once it is complete.
+    """
+
+    def __init__(self, chunk_size=65536, level=6):
+        """Opens the temporary file the compressed text is written to."""
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.preview = ''
+        self.misspelled = []
+        self._summary_length = 0
+        self._seen = set()
+        self._compressor = zlib.compressobj(level)
+        self._file = tempfile.TemporaryFile()
+
+    def write(self, text, misspelled):
+        """Adds a chunk of text and the misspelled words found in it."""
+        encoded = text.encode('utf-8')
+        self.size += len(encoded)
+        if len(self.preview) < PREVIEW_LENGTH:
+            self.preview += text[:PREVIEW_LENGTH - len(self.preview)]
+        self._file.write(self._compressor.compress(encoded))
+        # Only as many distinct words as fit in SpellChecks.misspelled_words are kept.
+        for word in misspelled:
+            if word not in self._seen and self._summary_length + len(word) + 2 <= PREVIEW_LENGTH:
+                self._seen.add(word)
+                self.misspelled.append(word)
+                self._summary_length += len(word) + 2
+
+    def store(self, username, language, no_misspelled):
+        """
+        Stores the document and its SpellChecks row, and increments the user's spell_check_count.
+
+        The caller is responsible for committing. Returns the new SpellChecks row.
+        """
+        self._file.write(self._compressor.flush())
+        self._file.seek(0)
+        spell_check = models.SpellChecks(username=username,
+                                         submitted_text=self.preview,
+                                         misspelled_words=', '.join(self.misspelled) if self.misspelled else no_misspelled,
+                                         language=language,
+                                         document_size=self.size)
+        db.session.add(spell_check)
+        db.session.flush()
+        seq = 0
+        while True:
+            data = self._file.read(self.chunk_size)
+            if not data:
+                break
+            db.session.execute(models.SpellCheckDocumentChunk.__table__.insert(),
+                               {'spell_check_id': spell_check.id, 'seq': seq, 'data': data})
+            seq += 1
+        authmodels.Users.query.filter_by(username=username) \
+            .update({authmodels.Users.spell_check_count: authmodels.Users.spell_check_count + 1}, synchronize_session=False)
+        return spell_check
+
+    def close(self):
+        """Removes the temporary file."""
+        self._file.close()
+
+
+def iter_document(spell_check_id, chunk_size=65536):
+    """Yields the stored text of a document as UTF-8 bytes, at most chunk_size bytes at a time, reading one stored chunk at a time."""
+    decompressor = zlib.decompressobj()
+    last_seq = -1
+    while True:
+        row = db.session.query(models.SpellCheckDocumentChunk.seq, models.SpellCheckDocumentChunk.data) \
+            .filter(models.SpellCheckDocumentChunk.spell_check_id == spell_check_id, models.SpellCheckDocumentChunk.seq > last_seq) \
+            .order_by(models.SpellCheckDocumentChunk.seq) \
+            .first()
+        if row is None:
+            break
+        last_seq = row.seq
+        data = row.data
+        while data:
+            text = decompressor.decompress(data, chunk_size)
+            if text:
+                yield text
+            data = decompressor.unconsumed_tail
+    text = decompressor.flush()
+    if text:
+        yield text
@@ -0,0 +1,416 @@
+"""
+Spell Check Engines for Spellcheckapp.
+
+An engine takes submitted text and returns the misspelled words found in it.
+The engine used for each language's wordlist is selected with the SPELLCHECK_ENGINE config key:
+
+- 'dictionary' loads the wordlist once per worker and checks words in memory, or maps it if it is a compiled wordlist.
+- 'executable' runs the SPELLCHECK executable once per submission.
+- 'pool' keeps SPELLCHECK_POOL_SIZE SPELLCHECK executables running and reuses them.
+"""
+import collections
+import hashlib
+import itertools
+import os
+import select
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from spellcheckapp.spellcheck import compiled
+from spellcheckapp.spellcheck.bloom import BloomFilter, PrefilteredWordlist
+
+
+class SpellCheckError(Exception):
+    """Raised when an engine is unable to check a submission."""
+
+
+def tokenize(text):
+    """
+    Splits text into words.
+
+    Words are separated by whitespace and stripped of leading and trailing punctuation.
+    """
+    for word in text.split():
+        word = word.strip(string.punctuation)
+        if word:
+            yield word
+
+
+def find_misspelled(text, words):
+    """
+    Returns the words of text that are not in words, in the order they appear in text.
+
+    Words are tokenized as by tokenize, and a word is accepted if it or its lower case form is in words.
+    Each distinct token is stripped, lower cased and looked up once however often it appears.
+    Splitting, deduplicating, stripping and picking the misspelled tokens back out in order all run in C,
+    Python code only runs once per distinct token.
+    """
+    tokens = text.split()
+    distinct = set(tokens)
+    stripped = dict(zip(distinct, map(str.strip, distinct, itertools.repeat(string.punctuation))))
+    misspelled = {token for token, word in stripped.items() if word and word not in words and word.lower() not in words}
+    if not misspelled:
+        return []
+    return list(map(stripped.__getitem__, filter(misspelled.__contains__, tokens)))
+
+
+def file_fingerprint(*paths):
+    """Returns a short identifier that changes whenever one of the files is replaced or modified."""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append('%s:%d:%d' % (path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            parts.append('%s:missing' % path)
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def load_wordlist(path):
+    """Reads a wordlist file into a set, one word per line."""
+    with open(path, encoding='utf-8', errors='replace') as wordlist:
+        return {line.strip() for line in wordlist if line.strip()}
+
+
+def open_wordlist(path):
+    """Returns a read-only mapping of a compiled wordlist file, or the words of a text wordlist file as a set."""
+    if compiled.is_compiled(path):
+        return compiled.CompiledWordlist(path)
+    return load_wordlist(path)
+
+
+def prefilter(words, fp_rate):
+    """Puts a Bloom filter in front of words, using the one stored with a compiled wordlist or building one."""
+    stored = words.bloom() if isinstance(words, compiled.CompiledWordlist) else None
+    return PrefilteredWordlist(stored or BloomFilter.from_words(words, fp_rate), words)
+
+
+def wordlist_memory(words, prefiltered=None):
+    """Returns an estimate of the bytes held in process by a wordlist and its prefilter, a compiled wordlist's map is not counted."""
+    size = 0
+    if not isinstance(words, compiled.CompiledWordlist):
+        size += sys.getsizeof(words) + sum(sys.getsizeof(word) for word in words)
+    if prefiltered is not None and isinstance(prefiltered.bloom.data, bytearray):
+        size += sys.getsizeof(prefiltered.bloom.data)
+    return size
+
+
+WordlistSnapshot = collections.namedtuple('WordlistSnapshot', ['words', 'prefiltered', 'fingerprint', 'memory'])
+
+
+class SpellCheckEngine(object):
+    """
+    Spell Check Engine Interface.
+
+    Subclasses implement check, which returns a list of misspelled words for a text.
+    """
+
+    name = None
+
+    def check(self, text):
+        """Returns the list of misspelled words in text."""
+        raise NotImplementedError
+
+    def check_many(self, texts):
+        """Returns a list of misspelled word lists, one for each text."""
+        return [self.check(text) for text in texts]
+
+    def uncached(self):
+        """Returns the engine to check texts that are not worth caching with, such as the chunks of a document."""
+        return self
+
+    def fingerprint(self):
+        """Returns an identifier of the dictionary in use, results may only be reused while it is unchanged."""
+        raise NotImplementedError
+
+    def reload(self):
+        """
+        Picks up a changed wordlist.
+
+        Returns the seconds spent building and swapping in the new wordlist as a (build, swap) pair,
+        or None if the engine reads the wordlist on every check and has nothing to reload.
+        """
+        return None
+
+    def memory(self):
+        """Returns an estimate of the bytes of worker memory held by the engine's dictionary."""
+        return 0
+
+    def stats(self):
+        """Returns counters describing the engine."""
+        return {'engine': self.name}
+
+    def close(self):
+        """Releases any resources held by the engine."""
+
+
+class DictionaryEngine(SpellCheckEngine):
+    """
+    In-process Dictionary Engine.
+
+    Loads the wordlist into a set on first use and keeps it for the life of the worker.
+    A compiled wordlist is memory mapped instead, so it is shared by every worker on the host.
+    With bloom_fp_rate set, lookups go through a Bloom filter first, the one stored in a compiled wordlist if it has one.
+    The loaded wordlist is an immutable snapshot, reload builds a new one and swaps it in while requests keep using the old one.
+    """
+
+    name = 'dictionary'
+
+    def __init__(self, wordlist, bloom_fp_rate=None):
+        """Stores the wordlist path, the wordlist itself is loaded lazily."""
+        self.wordlist = wordlist
+        self.bloom_fp_rate = bloom_fp_rate
+        self.reloads = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Returns a snapshot of the wordlist file as it is now."""
+        try:
+            fingerprint = file_fingerprint(self.wordlist)
+            words = open_wordlist(self.wordlist)
+            prefiltered = prefilter(words, self.bloom_fp_rate) if self.bloom_fp_rate else None
+        except (OSError, ValueError) as e:
+            raise SpellCheckError('Unable to load wordlist: %s' % e)
+        return WordlistSnapshot(words, prefiltered, fingerprint, wordlist_memory(words, prefiltered))
+
+    def snapshot(self):
+        """Returns the current wordlist snapshot, loading it if needed."""
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+        return self._snapshot
+
+    def words(self):
+        """Returns the dictionary words of the current snapshot."""
+        return self.snapshot().words
+
+    def fingerprint(self):
+        """Returns the fingerprint of the wordlist as it was when the current snapshot was loaded."""
+        return self.snapshot().fingerprint
+
+    def check(self, text):
+        """Returns the words in text that are not in the dictionary."""
+        snapshot = self.snapshot()
+        return find_misspelled(text, snapshot.words if snapshot.prefiltered is None else snapshot.prefiltered)
+
+    def reload(self):
+        """
+        Loads the wordlist again and swaps the new snapshot in.
+
+        The old snapshot is left to requests still using it, a compiled wordlist is unmapped once the last one is done.
+        """
+        started = time.monotonic()
+        snapshot = self._load()
+        built = time.monotonic()
+        with self._lock:
+            self._snapshot = snapshot
+            self.reloads += 1
+        return built - started, time.monotonic() - built
+
+    def memory(self):
+        """Returns the estimated size of the loaded snapshot, 0 until it is loaded."""
+        snapshot = self._snapshot
+        return snapshot.memory if snapshot is not None else 0
+
+    def stats(self):
+        """Returns the engine name, along with the size and format of the wordlist once it is loaded."""
+        stats = super().stats()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            stats['words'] = len(snapshot.words)
+            stats['compiled'] = isinstance(snapshot.words, compiled.CompiledWordlist)
+            stats['reloads'] = self.reloads
+            if snapshot.prefiltered is not None:
+                stats['bloom'] = snapshot.prefiltered.stats()
+        return stats
+
+    def close(self):
+        """Unmaps a compiled wordlist."""
+        snapshot = self._snapshot
+        if snapshot is not None and isinstance(snapshot.words, compiled.CompiledWordlist):
+            snapshot.words.close()
+
+
+class ExecutableEngine(SpellCheckEngine):
+    """
+    External Executable Engine.
+
+    Runs the spell check executable as `<executable> <input file> <wordlist>`, it prints one misspelled word per line.
+    The input file is passed according to io_mode:
+
+    - 'tempfile' writes the text to a temporary file and collects the output in another one.
+    - 'stdin' passes /dev/stdin as the input file and writes the text to the executable's stdin.
+    - 'devfd' passes /dev/fd/<n> for the read end of a pipe, for executables that already use stdin.
+
+    In the pipe modes no file is written and the output is read line by line as the executable prints it.
+    """
+
+    name = 'executable'
+    io_modes = ('tempfile', 'stdin', 'devfd')
+
+    def __init__(self, executable, wordlist, timeout=None, io_mode='tempfile'):
+        """Stores the executable and wordlist paths, the per-submission timeout in seconds and the I/O mode."""
+        if io_mode not in self.io_modes:
+            raise ValueError('Unknown SPELLCHECK_IO: %r' % io_mode)
+        self.executable = executable
+        self.wordlist = wordlist
+        self.timeout = timeout
+        self.io_mode = io_mode
+
+    def fingerprint(self):
+        """Returns the fingerprint of the executable and wordlist files."""
+        return file_fingerprint(self.executable, self.wordlist)
+
+    def check(self, text):
+        """Returns the misspelled words printed by the executable."""
+        if self.io_mode == 'tempfile':
+            return self._check_tempfile(text)
+        return list(self.iter_check([bytes(text, 'utf-8')]))
+
+    def check_many(self, texts):
+        """
+        Checks each text with a run of its own.
+
+        The executable splits words its own way, so the words of a joined run cannot be told apart by text.
+        """
+        return [self.check(text) for text in texts]
+
+    def _check_tempfile(self, text):
+        """Runs the executable against a temporary input file and reads its output back from a temporary file."""
+        result = None
+        with tempfile.NamedTemporaryFile() as inputfile:
+            inputfile.write(bytes(text, 'utf-8'))
+            inputfile.flush()
+            with tempfile.TemporaryFile() as tempf:
+                try:
+                    proc = subprocess.Popen([self.executable, inputfile.name, self.wordlist], stdout=tempf)
+                except OSError as e:
+                    raise SpellCheckError('Unable to run spell check executable: %s' % e)
+                try:
+                    proc.wait(timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                    raise SpellCheckError('Spell check executable timed out.')
+                tempf.seek(0)
+                result = tempf.read()
+        return list(filter(None, result.decode().split("\n")))
+
+    def iter_check(self, chunks):
+        """
+        Streams chunks of encoded text to the executable over a pipe.
+
+        Yields misspelled words as soon as the executable prints them.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            if self.io_mode == 'devfd':
+                read_fd, write_fd = os.pipe()
+                try:
+                    proc = subprocess.Popen([self.executable, '/dev/fd/%d' % read_fd, self.wordlist], stdout=subprocess.PIPE, pass_fds=(read_fd,))
+                except OSError:
+                    os.close(write_fd)
+                    raise
+                finally:
+                    os.close(read_fd)
+                input_pipe = os.fdopen(write_fd, 'wb')
+            else:
+                proc = subprocess.Popen([self.executable, '/dev/stdin', self.wordlist], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                input_pipe = proc.stdin
+        except OSError as e:
+            raise SpellCheckError('Unable to run spell check executable: %s' % e)
+        feeder = threading.Thread(target=_feed, args=(input_pipe, chunks), daemon=True)
+        feeder.start()
+        try:
+            for line in _iter_lines(proc.stdout, deadline):
+                if line:
+                    yield line.decode('utf-8', 'replace')
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            proc.wait(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            raise SpellCheckError('Spell check executable timed out.')
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            feeder.join()
+
+
+def _feed(pipe, chunks):
+    """Writes chunks to pipe and closes it, stopping early if the reader goes away."""
+    try:
+        for chunk in chunks:
+            pipe.write(chunk)
+    except OSError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+
+def _iter_lines(pipe, deadline=None):
+    """Yields lines read from pipe without their newline, raising TimeoutExpired once deadline passes."""
+    fd = pipe.fileno()
+    buf = b''
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise subprocess.TimeoutExpired(fd, 0)
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            continue
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        buf += chunk
+        *lines, buf = buf.split(b'\n')
+        for line in lines:
+            yield line
+    if buf:
+        yield buf
+
+
+def create_engine(config, wordlist=None):
+    """Builds the engine named by SPELLCHECK_ENGINE from an app config, checking against wordlist or WORDLIST."""
+    name = config.get('SPELLCHECK_ENGINE', ExecutableEngine.name)
+    wordlist = wordlist or config['WORDLIST']
+    if name == DictionaryEngine.name:
+        return DictionaryEngine(wordlist, bloom_fp_rate=config.get('SPELLCHECK_BLOOM_FP_RATE'))
+    if name == ExecutableEngine.name:
+        return ExecutableEngine(config['SPELLCHECK'], wordlist, timeout=config.get('SPELLCHECK_TIMEOUT'),
+                                io_mode=config.get('SPELLCHECK_IO', 'tempfile'))
+    if name == 'pool':
+        from spellcheckapp.spellcheck.pool import PoolEngine, WorkerPool
+        command = [config['SPELLCHECK']] + list(config.get('SPELLCHECK_POOL_ARGS', ['--serve'])) + [wordlist]
+        return PoolEngine(WorkerPool(command,
+                                     size=config.get('SPELLCHECK_POOL_SIZE', 4),
+                                     timeout=config.get('SPELLCHECK_TIMEOUT'),
+                                     acquire_timeout=config.get('SPELLCHECK_POOL_ACQUIRE_TIMEOUT', 5)))
+    raise ValueError('Unknown SPELLCHECK_ENGINE: %r' % name)
+
+
+def create_cache(config):
+    """Builds the result cache described by the SPELLCHECK_CACHE_* config keys."""
+    from spellcheckapp.spellcheck.cache import DatabaseCache, LocalCache, ResultCache
+    local = LocalCache(config.get('SPELLCHECK_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+    backend = config.get('SPELLCHECK_CACHE_BACKEND', 'local')
+    if backend == 'local':
+        return ResultCache(local)
+    if backend == 'database':
+        return ResultCache(local, DatabaseCache(ttl=config.get('SPELLCHECK_CACHE_TTL', 86400)))
+    raise ValueError('Unknown SPELLCHECK_CACHE_BACKEND: %r' % backend)
+
+
+def get_engine(language=None):
+    """Returns the engine for language, or for the default language, of the current app."""
+    from spellcheckapp.spellcheck.languages import get_dictionary
+    return get_dictionary(language).engine
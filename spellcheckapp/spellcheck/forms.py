@@ -1,7 +1,7 @@
 """Defines forms for the SpellCheck module."""
 from flask_wtf import FlaskForm
 
-from wtforms import StringField, TextAreaField
+from wtforms import SelectField, StringField, TextAreaField
 from wtforms.validators import DataRequired, Length, Regexp
 
 
@@ -10,9 +10,11 @@ class SpellCheckForm(FlaskForm):
     Spell Check Submission Form.
 
     This form is used to submit text for spell checking.
+    The language choices are the configured WORDLISTS, set by the view.
     """
 
     inputtext = TextAreaField(label='Input Text to Spell Check', id='inputtext', validators=[DataRequired(), Length(max=500, message='Exceeded max text length: 500')])  # noqa: E501
+    language = SelectField(label='Language', id='language', choices=[])
 
 
 class UserHistoryForm(FlaskForm):
@@ -0,0 +1,211 @@
+"""
+Asynchronous Spell Check Jobs for Spellcheckapp.
+
+A job checks a list of texts in the background of the worker it was submitted to, on a pool of SPELLCHECK_JOB_WORKERS threads,
+so the request that submitted it returns right away. No broker is needed: jobs and their results are kept
+in the spell_check_jobs table, so any worker can answer a poll for them.
+
+A worker holds at most SPELLCHECK_JOBS_MAX_PENDING jobs that have not finished, further submissions are refused until some do.
+Jobs are lost if their worker dies, a job that has not finished after SPELLCHECK_JOB_TIMEOUT seconds is reported as failed.
+The number of queued jobs and the age of the oldest one are reported on /metrics for autoscaling.
+
+Jobs hold the full texts and results, so jobs that finished more than SPELLCHECK_JOB_RETENTION hours ago are deleted,
+every SPELLCHECK_JOB_PRUNE_EVERY submissions or with `flask spellcheck prune-jobs`.
+"""
+import atexit
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+from spellcheckapp import db
+from spellcheckapp.spellcheck import engine, models
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueueFullError(Exception):
+    """Raised when a worker already holds SPELLCHECK_JOBS_MAX_PENDING jobs."""
+
+
+class JobRunner(object):
+    """
+    Job Runner.
+
+    Runs submitted jobs on a thread pool that is started by the first submission of each worker process.
+    """
+
+    def __init__(self, app, workers=2, max_pending=100, timeout=600, retention=24, prune_every=100):
+        """Stores the runner settings, finished jobs are kept for retention hours, or for good if it is None."""
+        self.app = app
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retention = retention
+        self.prune_every = prune_every
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.pruned = 0
+        self.last_wait_seconds = 0.0
+        self.last_run_seconds = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        # Job ID -> submission time, for jobs that have not started, and the number of jobs that have not finished.
+        self._queued = collections.OrderedDict()
+        self._unfinished = 0
+
+    def _start(self):
+        """Starts the thread pool for this process, a pool inherited from a parent process has no threads."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='spellcheck-job')
+            self._queued = collections.OrderedDict()
+            self._unfinished = 0
+
+    def submit(self, username, texts, language):
+        """
+        Stores a pending job for texts and queues it, returns the job row.
+
+        Raises JobQueueFullError if this worker already holds max_pending unfinished jobs.
+        """
+        with self._lock:
+            self._start()
+            if self._unfinished >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFullError('Too many spell check jobs are pending.')
+            self._unfinished += 1
+        try:
+            job = models.SpellCheckJob(id=uuid.uuid4().hex, username=username, status=PENDING, language=language,
+                                       texts=json.dumps(texts), created=datetime.datetime.now())
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            with self._lock:
+                self._unfinished -= 1
+            raise
+        with self._lock:
+            self._queued[job.id] = time.monotonic()
+            self.submitted += 1
+            prune = self.retention is not None and self.submitted % self.prune_every == 0
+        self._executor.submit(self._run, job.id)
+        if prune:
+            self.prune(self.retention)
+        return job
+
+    def prune(self, hours):
+        """
+        Deletes jobs that finished more than hours ago, returns the number deleted.
+
+        Jobs that never finished because their worker died are deleted once they are that much older than the timeout.
+        """
+        table = models.SpellCheckJob.__table__
+        cutoff = datetime.datetime.now() - datetime.timedelta(hours=hours)
+        lost = cutoff - datetime.timedelta(seconds=self.timeout or 0)
+        with db.engine.begin() as conn:
+            deleted = conn.execute(table.delete().where(db.or_(table.c.finished < cutoff,
+                                                               db.and_(table.c.finished.is_(None), table.c.created < lost)))).rowcount
+        self.pruned += deleted
+        return deleted
+
+    def _run(self, job_id):
+        """Thread pool task, checks a job's texts and stores the results."""
+        with self._lock:
+            queued = self._queued.pop(job_id, None)
+        started = time.monotonic()
+        if queued is not None:
+            self.last_wait_seconds = started - queued
+        try:
+            with self.app.app_context():
+                self._run_job(job_id)
+        except Exception:
+            self.app.logger.exception('Spell check job %s failed.', job_id)
+        finally:
+            self.last_run_seconds = time.monotonic() - started
+            with self._lock:
+                self._unfinished -= 1
+
+    def _run_job(self, job_id):
+        """Checks a job's texts in the current app context, recording them as query history."""
+        from spellcheckapp.spellcheck.spellcheck import check_texts
+        job = models.SpellCheckJob.query.get(job_id)
+        job.status = RUNNING
+        db.session.commit()
+        try:
+            results = check_texts(job.username, json.loads(job.texts), job.language)
+        except engine.SpellCheckError:
+            db.session.rollback()
+            job.status = FAILED
+            job.error = 'Spell check is currently unavailable.'
+            self.failed += 1
+        except Exception:
+            db.session.rollback()
+            job.status = FAILED
+            job.error = 'Spell check failed.'
+            self.failed += 1
+            raise
+        else:
+            job.status = DONE
+            job.results = json.dumps(results)
+            self.completed += 1
+        finally:
+            job.finished = datetime.datetime.now()
+            db.session.commit()
+
+    def status(self, job):
+        """Returns a job's status, unfinished jobs older than timeout are reported as failed."""
+        if job.status in (PENDING, RUNNING) and self.timeout and (datetime.datetime.now() - job.created).total_seconds() > self.timeout:
+            return FAILED
+        return job.status
+
+    def stats(self):
+        """Returns the runner counters, including the depth of this worker's queue and the age of its oldest queued job."""
+        with self._lock:
+            depth = len(self._queued)
+            oldest = time.monotonic() - next(iter(self._queued.values())) if self._queued else 0.0
+            unfinished = self._unfinished if self._pid == os.getpid() else 0
+        return {'depth': depth,
+                'oldest_seconds': oldest,
+                'unfinished': unfinished,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'pruned': self.pruned,
+                'last_wait_seconds': self.last_wait_seconds,
+                'last_run_seconds': self.last_run_seconds}
+
+    def close(self):
+        """Waits for the jobs of this worker to finish."""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+
+
+def init_app(app):
+    """Creates the job runner and associates it with the app."""
+    from spellcheckapp import metrics
+    runner = JobRunner(app,
+                       workers=app.config.get('SPELLCHECK_JOB_WORKERS', 2),
+                       max_pending=app.config.get('SPELLCHECK_JOBS_MAX_PENDING', 100),
+                       timeout=app.config.get('SPELLCHECK_JOB_TIMEOUT', 600),
+                       retention=app.config.get('SPELLCHECK_JOB_RETENTION', 24),
+                       prune_every=app.config.get('SPELLCHECK_JOB_PRUNE_EVERY', 100))
+    app.extensions['spellcheck_jobs'] = runner
+    metrics.register(app, 'jobs', runner.stats)
+    atexit.register(runner.close)
+
+
+def get_runner():
+    """Returns the job runner of the current app."""
+    return current_app.extensions['spellcheck_jobs']
@@ -0,0 +1,186 @@
+"""
+Dictionaries for Spellcheckapp.
+
+The WORDLISTS config key maps language codes to wordlist files, each language is checked with its own engine
+and gets its own spelling suggestions. Without WORDLISTS, WORDLIST is served as SPELLCHECK_DEFAULT_LANGUAGE.
+
+A language's dictionary is created on its first use in a worker. Loaded dictionaries are kept in least recently used order,
+and whenever the memory they hold exceeds WORDLISTS_MAX_BYTES the least recently used ones are dropped until it fits again.
+A dropped language is loaded again on its next use. Requests still checking with a dropped dictionary finish with it,
+its memory is freed once they are done.
+Compiled wordlists are mapped and shared by every worker on the host, and executables run in their own processes,
+so neither counts towards the budget.
+"""
+import atexit
+import collections
+import threading
+
+from flask import current_app
+
+from spellcheckapp.spellcheck import engine, suggest
+
+
+class UnknownLanguageError(ValueError):
+    """Raised when a language is not in WORDLISTS."""
+
+
+class Dictionary(object):
+    """
+    Dictionary.
+
+    A language's spell check engine, and its suggester which is None when suggestions are disabled.
+    """
+
+    def __init__(self, language, spellcheck_engine, suggester=None):
+        """Stores the language with its engine and suggester."""
+        self.language = language
+        self.engine = spellcheck_engine
+        self.suggester = suggester
+
+    def memory(self):
+        """Returns an estimate of the bytes of worker memory held by the engine and suggester."""
+        return self.engine.memory() + (self.suggester.memory() if self.suggester is not None else 0)
+
+    def reload(self):
+        """Reloads the engine and the suggester, returns the (build, swap) seconds of each that had something to reload."""
+        timings = {'engine': self.engine.reload()}
+        if self.suggester is not None:
+            timings['suggestions'] = self.suggester.reload()
+        return {name: timing for name, timing in timings.items() if timing is not None}
+
+    def stats(self):
+        """Returns the engine and suggester counters."""
+        stats = {'engine': self.engine.stats(), 'bytes': self.memory()}
+        if self.suggester is not None:
+            stats['suggestions'] = self.suggester.stats()
+        return stats
+
+    def close(self):
+        """Closes the engine."""
+        self.engine.close()
+
+
+class DictionaryRegistry(object):
+    """
+    Dictionary Registry.
+
+    Creates the dictionary of each language on first use with factory(language, wordlist),
+    and drops the least recently used ones once they hold more than max_bytes.
+    """
+
+    def __init__(self, wordlists, default_language, factory, max_bytes=None):
+        """Stores the wordlist of each language, no dictionary is created until it is used."""
+        if default_language not in wordlists:
+            raise ValueError('SPELLCHECK_DEFAULT_LANGUAGE %r is not in WORDLISTS' % default_language)
+        self.wordlists = dict(wordlists)
+        self.default_language = default_language
+        self.factory = factory
+        self.max_bytes = max_bytes
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def languages(self):
+        """Returns every configured language, the default one first."""
+        return [self.default_language] + sorted(language for language in self.wordlists if language != self.default_language)
+
+    def get(self, language=None):
+        """Returns the dictionary of language, or of the default language, creating it if it is not loaded."""
+        language = language or self.default_language
+        if language not in self.wordlists:
+            raise UnknownLanguageError('Unknown language: %r' % language)
+        with self._lock:
+            dictionary = self._loaded.get(language)
+            if dictionary is None:
+                dictionary = self.factory(language, self.wordlists[language])
+                self._loaded[language] = dictionary
+                self.loads += 1
+            else:
+                self._loaded.move_to_end(language)
+            self._evict()
+        return dictionary
+
+    def _evict(self):
+        """
+        Drops least recently used dictionaries until the loaded ones fit in max_bytes.
+
+        The most recently used dictionary is always kept. A dictionary only holds memory once it has been used,
+        so the one just created is accounted for on the next call.
+        """
+        if not self.max_bytes:
+            return
+        sizes = collections.OrderedDict((language, dictionary.memory()) for language, dictionary in self._loaded.items())
+        total = sum(sizes.values())
+        for language, size in list(sizes.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            if size:
+                del self._loaded[language]
+                total -= size
+                self.evictions += 1
+
+    def loaded(self):
+        """Returns the loaded dictionaries, least recently used first."""
+        with self._lock:
+            return list(self._loaded.values())
+
+    def reload(self, languages=None):
+        """
+        Reloads the loaded dictionaries of languages, or every loaded dictionary.
+
+        Returns the (build, swap) seconds of each part that was reloaded, by language.
+        """
+        return {dictionary.language: dictionary.reload() for dictionary in self.loaded()
+                if languages is None or dictionary.language in languages}
+
+    def stats(self):
+        """Returns the registry counters and the counters of each loaded dictionary."""
+        dictionaries = self.loaded()
+        languages = {dictionary.language: dictionary.stats() for dictionary in dictionaries}
+        return {'default_language': self.default_language,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'bytes': sum(stats['bytes'] for stats in languages.values()),
+                'max_bytes': self.max_bytes,
+                'languages': languages}
+
+    def close(self):
+        """Closes every loaded dictionary."""
+        for dictionary in self.loaded():
+            dictionary.close()
+
+
+def wordlists(config):
+    """Returns the language to wordlist mapping of an app config."""
+    return config.get('WORDLISTS') or {config.get('SPELLCHECK_DEFAULT_LANGUAGE', 'en'): config['WORDLIST']}
+
+
+def init_app(app):
+    """Creates the dictionary registry and associates it with the app, dictionaries share one result cache if it is enabled."""
+    from spellcheckapp import metrics
+    from spellcheckapp.spellcheck.cache import CachingEngine
+    config = app.config
+    cache = engine.create_cache(config) if config.get('SPELLCHECK_CACHE', True) else None
+
+    def create_dictionary(language, wordlist):
+        spellcheck_engine = engine.create_engine(config, wordlist)
+        if cache is not None:
+            spellcheck_engine = CachingEngine(spellcheck_engine, cache)
+        return Dictionary(language, spellcheck_engine, suggest.create_suggester(config, wordlist))
+
+    registry = DictionaryRegistry(wordlists(config), config.get('SPELLCHECK_DEFAULT_LANGUAGE', 'en'), create_dictionary,
+                                  max_bytes=config.get('WORDLISTS_MAX_BYTES'))
+    app.extensions['spellcheck_dictionaries'] = registry
+    metrics.register(app, 'spellcheck', registry.stats)
+    atexit.register(registry.close)
+
+
+def get_registry():
+    """Returns the dictionary registry of the current app."""
+    return current_app.extensions['spellcheck_dictionaries']
+
+
+def get_dictionary(language=None):
+    """Returns the dictionary of language, or of the default language, for the current app."""
+    return get_registry().get(language)
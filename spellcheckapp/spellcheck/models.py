@@ -1,4 +1,6 @@
 """Defines Data Models for Spellcheck Module."""
+import json
+
 from spellcheckapp import db
 
 
@@ -7,13 +9,84 @@ class SpellChecks(db.Model):
     SpellChecks Database Model.
 
     Defines SpellChecks fields.
+    History is read per user in ID order, so (username, id) is indexed.
     """
 
+    __table_args__ = (db.Index('ix_spell_checks_username_id', 'username', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), db.ForeignKey('users.username'), unique=False, nullable=False)
     submitted_text = db.Column(db.String(501), unique=False, nullable=False)
     misspelled_words = db.Column(db.String(501), unique=False, nullable=True)
+    suggestions = db.Column(db.Text, unique=False, nullable=True)
+    language = db.Column(db.String(20), unique=False, nullable=True)
+    # Set for large documents, whose full text is stored in SpellCheckDocumentChunk rows, submitted_text only holds the start.
+    document_size = db.Column(db.Integer, unique=False, nullable=True)
+
+    def suggestion_list(self):
+        """Returns the stored (word, suggestions) pairs for the misspelled words."""
+        return [(word, words) for word, words in json.loads(self.suggestions)] if self.suggestions else []
 
     def __repr__(self):
         """Defines string representation of a SpellChecks tuple."""
         return '<User %r Spell_check_id %r>' % (self.username, self.id)
+
+
+class SpellCheckDocumentChunk(db.Model):
+    """
+    SpellCheckDocumentChunk Database Model.
+
+    Defines the out of row storage of a large document's text, a zlib stream split over rows in seq order.
+    """
+
+    __tablename__ = 'spell_check_document_chunks'
+
+    spell_check_id = db.Column(db.Integer, db.ForeignKey('spell_checks.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.LargeBinary, unique=False, nullable=False)
+
+    def __repr__(self):
+        """Defines string representation of a SpellCheckDocumentChunk tuple."""
+        return '<Spell_check_id %r Chunk %r>' % (self.spell_check_id, self.seq)
+
+
+class SpellCheckJob(db.Model):
+    """
+    SpellCheckJob Database Model.
+
+    Defines asynchronous spell check job fields, the submitted texts and results are stored as JSON.
+    """
+
+    __tablename__ = 'spell_check_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    username = db.Column(db.String(20), db.ForeignKey('users.username'), unique=False, nullable=False)
+    status = db.Column(db.String(10), unique=False, nullable=False)
+    language = db.Column(db.String(20), unique=False, nullable=True)
+    texts = db.Column(db.Text, unique=False, nullable=False)
+    results = db.Column(db.Text, unique=False, nullable=True)
+    error = db.Column(db.String(100), unique=False, nullable=True)
+    created = db.Column(db.DateTime(), unique=False, nullable=False)
+    finished = db.Column(db.DateTime(), unique=False, nullable=True, index=True)
+
+    def __repr__(self):
+        """Defines string representation of a SpellCheckJob tuple."""
+        return '<User %r Spell_check_job %r>' % (self.username, self.id)
+
+
+class SpellCheckCache(db.Model):
+    """
+    SpellCheckCache Database Model.
+
+    Defines shared spell check result cache fields, keyed on a hash of the submission and dictionary.
+    """
+
+    __tablename__ = 'spell_check_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    misspelled_words = db.Column(db.Text, unique=False, nullable=False)
+    created = db.Column(db.DateTime(), unique=False, nullable=False, index=True)
+
+    def __repr__(self):
+        """Defines string representation of a SpellCheckCache tuple."""
+        return '<SpellCheckCache %r>' % self.key
@@ -0,0 +1,244 @@
+"""
+Spell Check Worker Pool for Spellcheckapp.
+
+Keeps a fixed number of spell check executables running and feeds them submissions over pipes.
+Workers are started as `<executable> <args...> <wordlist>` and must speak a line protocol:
+each request is one line of text on stdin, and the response is the misspelled words,
+one per line on stdout, terminated by an empty line.
+"""
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+from spellcheckapp.spellcheck.engine import SpellCheckEngine, SpellCheckError, file_fingerprint
+
+
+class PoolBusyError(SpellCheckError):
+    """Raised when no worker became free within the acquire timeout."""
+
+
+class Worker(object):
+    """
+    Spell Check Worker.
+
+    Wraps one long-lived spell check process.
+    """
+
+    def __init__(self, command, generation=0):
+        """Starts the worker process."""
+        self.command = command
+        self.generation = generation
+        self.requests = 0
+        try:
+            self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        except OSError as e:
+            raise SpellCheckError('Unable to start spell check worker: %s' % e)
+
+    def alive(self):
+        """Returns True if the worker process is still running."""
+        return self.proc.poll() is None
+
+    def request(self, text, timeout=None):
+        """Sends text to the worker and returns the misspelled words, waiting at most timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        line = ' '.join(text.splitlines()) + '\n'
+        try:
+            self.proc.stdin.write(line.encode('utf-8'))
+        except OSError as e:
+            raise SpellCheckError('Spell check worker exited: %s' % e)
+        self.requests += 1
+        fd = self.proc.stdout.fileno()
+        buf = b''
+        while True:
+            lines = buf.split(b'\n')[:-1]
+            if b'' in lines:
+                return [word.decode('utf-8', 'replace') for word in lines[:lines.index(b'')]]
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise SpellCheckError('Spell check worker timed out.')
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise SpellCheckError('Spell check worker exited.')
+            buf += chunk
+
+    def stop(self):
+        """Terminates the worker process."""
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            pipe.close()
+
+
+class WorkerPool(object):
+    """
+    Spell Check Worker Pool.
+
+    Workers are started lazily and handed out one request at a time.
+    Callers wait up to acquire_timeout seconds for a free worker before being rejected.
+    Dead or misbehaving workers are replaced, and so are workers started before the last recycle.
+    """
+
+    def __init__(self, command, size=4, timeout=None, acquire_timeout=None):
+        """Stores the pool settings, no worker is started until the first request."""
+        self.command = command
+        self.size = size
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.restarts = 0
+        self.rejected = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Empties the pool, used on creation and after a fork."""
+        self._pid = os.getpid()
+        self._workers = []
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _acquire(self):
+        """Returns a live worker, starting or restarting one if needed."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.rejected += 1
+            raise PoolBusyError('All spell check workers are busy.')
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            worker = None
+        try:
+            if worker is None:
+                worker = self._start()
+            elif not worker.alive() or worker.generation != self.generation:
+                worker = self._replace(worker)
+        except SpellCheckError:
+            self._slots.release()
+            raise
+        return worker
+
+    def _release(self, worker):
+        """Returns a worker to the pool, or only its slot if worker is None."""
+        if worker is not None:
+            self._idle.put(worker)
+        self._slots.release()
+
+    def _discard(self, worker):
+        """Replaces a worker that failed a request, returns None if no new worker could be started."""
+        try:
+            return self._replace(worker)
+        except SpellCheckError:
+            return None
+
+    def _replace(self, worker):
+        """Stops a worker and starts a new one in its place."""
+        worker.stop()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self.restarts += 1
+        return self._start()
+
+    def _start(self):
+        """Starts a worker of the current generation."""
+        worker = Worker(self.command, self.generation)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def recycle(self):
+        """Has every worker replaced once it is next handed out, so that they load the wordlist again."""
+        with self._lock:
+            self.generation += 1
+
+    def check(self, text):
+        """Returns the misspelled words in text as reported by a pooled worker."""
+        worker = self._acquire()
+        try:
+            return worker.request(text, timeout=self.timeout)
+        except SpellCheckError:
+            worker = self._discard(worker)
+            raise
+        finally:
+            self._release(worker)
+
+    def check_many(self, texts):
+        """Returns the misspelled words for each text, sending every text to the same pooled worker."""
+        worker = self._acquire()
+        try:
+            return [worker.request(text, timeout=self.timeout) for text in texts]
+        except SpellCheckError:
+            worker = self._discard(worker)
+            raise
+        finally:
+            self._release(worker)
+
+    def stats(self):
+        """Returns counters describing the pool."""
+        with self._lock:
+            alive = sum(1 for worker in self._workers if worker.alive())
+        return {'size': self.size,
+                'workers': alive,
+                'idle': self._idle.qsize(),
+                'restarts': self.restarts,
+                'rejected': self.rejected,
+                'generation': self.generation}
+
+    def close(self):
+        """Stops every worker."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+
+class PoolEngine(SpellCheckEngine):
+    """
+    Pooled Executable Engine.
+
+    Sends submissions to a WorkerPool of long-lived spell check executables.
+    """
+
+    name = 'pool'
+
+    def __init__(self, pool):
+        """Stores the worker pool."""
+        self.pool = pool
+
+    def fingerprint(self):
+        """Returns the fingerprint of the files the workers were started with."""
+        return file_fingerprint(self.pool.command[0], self.pool.command[-1])
+
+    def check(self, text):
+        """Returns the misspelled words reported by a pooled worker."""
+        return self.pool.check(text)
+
+    def check_many(self, texts):
+        """Returns the misspelled words for each text, checked by a single pooled worker."""
+        return self.pool.check_many(texts)
+
+    def reload(self):
+        """Recycles the pool's workers, each finishes its current request and is replaced by one reading the new wordlist."""
+        started = time.monotonic()
+        self.pool.recycle()
+        return 0.0, time.monotonic() - started
+
+    def stats(self):
+        """Returns the pool counters."""
+        stats = super(PoolEngine, self).stats()
+        stats['pool'] = self.pool.stats()
+        return stats
+
+    def close(self):
+        """Stops the pool's workers."""
+        self.pool.close()
@@ -0,0 +1,125 @@
+"""
+Wordlist Reloading for Spellcheckapp.
+
+A reload rebuilds the wordlist and spelling suggestion index of each loaded language in the background and swaps them in,
+requests already running finish with the old ones. The engine's fingerprint changes with the file,
+so results cached for the old wordlist are never served again. Languages that are not loaded have nothing to rebuild,
+they read the current file when they are first used.
+
+Reloads are started by an admin through the reload API, which reloads the worker that handles the request,
+or by a watcher thread in every worker that checks the wordlist files every WORDLIST_WATCH_INTERVAL seconds
+and reloads the languages whose file changed.
+"""
+import atexit
+import os
+import threading
+
+from flask import current_app
+
+from spellcheckapp.spellcheck.engine import file_fingerprint
+from spellcheckapp.spellcheck.languages import wordlists
+
+
+class WordlistReloader(object):
+    """
+    Wordlist Reloader.
+
+    Runs at most one reload at a time for an app, and optionally watches the wordlist files for changes.
+    """
+
+    def __init__(self, app, interval=0):
+        """Stores the reload settings, the watcher is started by the first request of each worker process."""
+        self.app = app
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self.last_build_seconds = None
+        self.last_swap_seconds = None
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+        self.wordlists = wordlists(app.config)
+        self._fingerprints = {language: file_fingerprint(wordlist) for language, wordlist in self.wordlists.items()}
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def reload(self, background=True, languages=None):
+        """
+        Reloads the wordlists of languages, or of every language, in a background thread unless background is False.
+
+        Returns False if a reload is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            return False
+        languages = sorted(languages or self.wordlists)
+        if background:
+            threading.Thread(target=self._reload, args=(languages,), name='wordlist-reload', daemon=True).start()
+        else:
+            self._reload(languages)
+        return True
+
+    def _reload(self, languages):
+        """Reloads the dictionaries of languages and logs how long it took, releasing the reload lock when done."""
+        try:
+            with self.app.app_context():
+                fingerprints = {language: file_fingerprint(self.wordlists[language]) for language in languages}
+                try:
+                    timings = self.app.extensions['spellcheck_dictionaries'].reload(languages)
+                except Exception:
+                    self.failures += 1
+                    self.app.logger.exception('Reloading wordlists for %s failed, still using the old ones.', ', '.join(languages))
+                    return
+                self._fingerprints.update(fingerprints)
+                self.reloads += 1
+                timings = [(language, name, build, swap) for language, parts in timings.items() for name, (build, swap) in parts.items()]
+                self.last_build_seconds = sum(build for _, _, build, _ in timings)
+                self.last_swap_seconds = sum(swap for _, _, _, swap in timings)
+                summary = ', '.join('%s %s built in %.3fs and swapped in %.6fs' % timing for timing in sorted(timings))
+                self.app.logger.info('Reloaded wordlists for %s: %s.', ', '.join(languages), summary or 'nothing to rebuild')
+        finally:
+            self._running.release()
+
+    def ensure_watching(self):
+        """Starts the watcher thread in this worker process if watching is enabled and it is not running yet."""
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._watch, name='wordlist-watcher', daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        """Watcher thread, reloads a language whenever its wordlist file changes. A missing file is waited for rather than reloaded."""
+        while not self._stop.wait(self.interval):
+            changed = [language for language, wordlist in self.wordlists.items()
+                       if os.path.exists(wordlist) and file_fingerprint(wordlist) != self._fingerprints[language]]
+            if changed:
+                self.reload(background=False, languages=changed)
+
+    def close(self):
+        """Stops the watcher thread."""
+        self._stop.set()
+
+    def stats(self):
+        """Returns the reload counters."""
+        return {'reloads': self.reloads,
+                'failures': self.failures,
+                'last_build_seconds': self.last_build_seconds,
+                'last_swap_seconds': self.last_swap_seconds,
+                'watching': self._pid == os.getpid()}
+
+
+def init_app(app):
+    """Creates the wordlist reloader and associates it with the app, watching the files if WORDLIST_WATCH_INTERVAL is set."""
+    from spellcheckapp import metrics
+    reloader = WordlistReloader(app, interval=app.config.get('WORDLIST_WATCH_INTERVAL', 0))
+    app.extensions['wordlist_reloader'] = reloader
+    metrics.register(app, 'wordlist_reload', reloader.stats)
+    app.before_request(reloader.ensure_watching)
+    atexit.register(reloader.close)
+
+
+def reload(languages=None):
+    """Starts a background reload of the current app's wordlists, or those of languages, returns False if one is already running."""
+    return current_app.extensions['wordlist_reloader'].reload(languages=languages)
@@ -4,24 +4,68 @@ SpellCheck Module for Spellcheckapp.
 Contains spell check related views.
 All responses are constructed with security headers.
 """
-import subprocess
-import tempfile
-from shlex import quote
+import datetime
+import json
+import os
+import shlex
+
+import click
 
 from flask import (
-    Blueprint, current_app, flash, g, make_response, render_template
+    Blueprint, Response, current_app, flash, g, jsonify, make_response, render_template, request, stream_with_context, url_for
 )
 
-from spellcheckapp import db
+from spellcheckapp import caching, db, writebehind
 from spellcheckapp.auth import models as authmodels
-from spellcheckapp.auth.auth import login_required
-from spellcheckapp.spellcheck import forms, models
+from spellcheckapp.auth.auth import api_login_required, login_required
+from spellcheckapp.spellcheck import compiled, documents, engine, forms, jobs, languages, models, reloader, suggest
 
 from werkzeug.exceptions import abort
 
 
 bp = Blueprint('spellcheck', __name__, template_folder="spellcheckapp/templates")
 
+NO_MISSPELLED = "No misspelled words were found."
+
+
+def store_spell_checks(username, spell_checks):
+    """
+    Adds spell check rows for a user to the session with a single insert.
+
+    The user's spell_check_count is incremented in the same transaction, the caller is responsible for committing.
+    Each item of spell_checks is a dict of submitted_text, misspelled_words, suggestions and language, suggestions being JSON or None.
+    """
+    db.session.bulk_insert_mappings(models.SpellChecks, [dict(spell_check, username=username) for spell_check in spell_checks])
+    authmodels.Users.query.filter_by(username=username) \
+        .update({authmodels.Users.spell_check_count: authmodels.Users.spell_check_count + len(spell_checks)}, synchronize_session=False)
+
+
+def record_spell_checks(username, spell_checks):
+    """
+    Records spell checks for a user as query history.
+
+    Rows are queued when write-behind is enabled, otherwise they are stored and committed right away.
+    """
+    if writebehind.enabled():
+        for spell_check in spell_checks:
+            writebehind.enqueue('spell_checks', dict(spell_check, username=username))
+    else:
+        store_spell_checks(username, spell_checks)
+        db.session.commit()
+
+
+def encode_suggestions(suggestions):
+    """Returns (word, suggestions) pairs as stored in SpellChecks.suggestions, or None if there are none."""
+    return json.dumps(suggestions) if suggestions else None
+
+
+def spell_check_row(submitted_text, misspelled, suggestions, language):
+    """Returns the SpellChecks fields recorded for a checked text."""
+    return {'submitted_text': submitted_text,
+            'misspelled_words': ", ".join(misspelled) if misspelled else NO_MISSPELLED,
+            'suggestions': encode_suggestions(suggestions),
+            'language': language}
+
 
 @bp.route('/')
 def index():
@@ -47,46 +91,151 @@ def spell_check():
     Must be logged in to access this view, otherwise redirected to login page.
     Text is submitted here to be spell checked.
     Text submissions and results are stored as query history for the logged in user.
+    Ranked suggestions for each misspelled word are shown and stored along with the results.
+    Text is checked against the dictionary of the selected language, the default language is preselected.
     """
-    form = forms.SpellCheckForm()
+    dictionaries = languages.get_registry()
+    form = forms.SpellCheckForm(language=dictionaries.default_language)
+    form.language.choices = [(language, language) for language in dictionaries.languages()]
     results = {}
+    suggestions = []
+    status = 200
     if form.validate_on_submit():
-        inputtext = quote(form.inputtext.data)
+        inputtext = form.inputtext.data
         error = None
 
         if not inputtext:
             error = "Invalid input"
             flash(error)
 
-        inputtext = bytes(inputtext, 'utf-8')
-        results["textout"] = inputtext.decode()
+        results["textout"] = inputtext
+
+        if error is None:
+            try:
+                result = engine.get_engine(form.language.data).check(results["textout"])
+            except engine.SpellCheckError:
+                error = "Spell check is currently unavailable."
+                flash(error)
+                status = 503
 
-        new_spell_check = None
         if error is None:
-            result = None
-            with tempfile.NamedTemporaryFile() as inputfile:
-                # inputfile = tempfile.NamedTemporaryFile()
-                inputfile.write(inputtext)
-                inputfile.flush()
-                with tempfile.TemporaryFile() as tempf:
-                    proc = subprocess.Popen([current_app.config['SPELLCHECK'], inputfile.name, current_app.config['WORDLIST']], stdout=tempf)
-                    proc.wait()
-                    tempf.seek(0)
-                    result = tempf.read()
-            result = result.decode().split("\n")
-            result = list(filter(None, result))
             if result:
                 results["misspelled"] = ", ".join(result)
-                new_spell_check = models.SpellChecks(username=g.user.username, submitted_text=results["textout"], misspelled_words=results["misspelled"])
+                suggestions = suggest.suggest(result, form.language.data)
             else:
-                results["no_misspelled"] = "No misspelled words were found."
-                new_spell_check = models.SpellChecks(username=g.user.username, submitted_text=results["textout"], misspelled_words=results["no_misspelled"])
+                results["no_misspelled"] = NO_MISSPELLED
+            record_spell_checks(g.user.username, [spell_check_row(results["textout"], result, suggestions, form.language.data)])
 
-        if new_spell_check is not None:
-            db.session.add(new_spell_check)
-            db.session.commit()
+    render = make_response(render_template('spellcheck/spell_check.html', form=form, results=results, suggestions=suggestions), status)
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+def parse_batch(data):
+    """
+    Validates a batch of texts submitted as JSON, e.g. {"texts": ["some text", "more text"], "language": "en"}.
+
+    Returns (texts, language, error), error being None for a valid batch.
+    """
+    texts = data.get('texts') if isinstance(data, dict) else None
+    dictionaries = languages.get_registry()
+    language = (data.get('language') or dictionaries.default_language) if isinstance(data, dict) else None
+    error = None
+
+    if not isinstance(texts, list) or not texts:
+        error = 'Expected a JSON object with a non-empty list of texts.'
+    elif len(texts) > current_app.config.get('SPELLCHECK_BATCH_MAX', 100):
+        error = 'Exceeded max batch size: %d' % current_app.config.get('SPELLCHECK_BATCH_MAX', 100)
+    elif not all(isinstance(text, str) and text.strip() for text in texts):
+        error = 'Every text must be a non-empty string.'
+    elif any(len(text) > 500 for text in texts):
+        error = 'Exceeded max text length: 500'
+    elif not isinstance(language, str) or language not in dictionaries.wordlists:
+        error = 'Unknown language, expected one of: %s' % ', '.join(dictionaries.languages())
+    return texts, language, error
+
+
+def check_texts(username, texts, language):
+    """
+    Checks a batch of texts in one pass through the engine and records them as the user's query history.
+
+    Returns the misspelled words found in each text, in order, with suggestions for each of them.
+    Raises SpellCheckError if the engine is unavailable, nothing is recorded then.
+    """
+    misspelled = engine.get_engine(language).check_many(texts)
+    suggestions = [suggest.suggest(words, language) for words in misspelled]
+    record_spell_checks(username, [spell_check_row(text, words, text_suggestions, language)
+                                   for text, words, text_suggestions in zip(texts, misspelled, suggestions)])
+    return [{'textout': text, 'misspelled': words, 'suggestions': dict(text_suggestions)}
+            for text, words, text_suggestions in zip(texts, misspelled, suggestions)]
+
+
+@bp.route('/api/spell_check/batch', methods=['POST'])
+@api_login_required
+def spell_check_batch():
+    """
+    Batch Spell Check API View.
+
+    Must be logged in to access this view, otherwise a 401 is returned.
+    Accepts a JSON object with a list of texts, e.g. {"texts": ["some text", "more text"]}, and optionally a language from WORDLISTS.
+    Only JSON request bodies are accepted, which browsers will not send cross-site without CORS.
+    All texts are checked in one pass through the engine and stored as query history with a single insert, or queued when write-behind is enabled.
+    Returns the misspelled words found in each text, in the order the texts were submitted, with suggestions for each of them.
+    """
+    texts, language, error = parse_batch(request.get_json(silent=True))
+
+    status = 200
+    if error is not None:
+        render = jsonify({'error': error})
+        status = 400
+    else:
+        try:
+            results = check_texts(g.user.username, texts, language)
+        except engine.SpellCheckError:
+            render = jsonify({'error': 'Spell check is currently unavailable.'})
+            status = 503
+        else:
+            render = jsonify({'language': language, 'results': results})
+    render.status_code = status
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+@bp.route('/api/spell_check/jobs', methods=['POST'])
+@api_login_required
+def submit_job():
+    """
+    Spell Check Job Submission API View.
+
+    Must be logged in to access this view, otherwise a 401 is returned.
+    Accepts the same JSON body as the batch API, and only JSON for the same reason.
+    The texts are checked in the background, see spellcheckapp.spellcheck.jobs, and stored as query history once they are.
+    Returns a 202 with the job ID and the URL to poll for its status right away,
+    or a 503 if this worker already holds SPELLCHECK_JOBS_MAX_PENDING jobs.
+    """
+    texts, language, error = parse_batch(request.get_json(silent=True))
 
-    render = make_response(render_template('spellcheck/spell_check.html', form=form, results=results))
+    if error is not None:
+        render = jsonify({'error': error})
+        render.status_code = 400
+    else:
+        try:
+            job = jobs.get_runner().submit(g.user.username, texts, language)
+        except jobs.JobQueueFullError as e:
+            render = jsonify({'error': str(e)})
+            render.status_code = 503
+            render.headers.set('Retry-After', '1')
+        else:
+            location = url_for('spellcheck.job_status', job_id=job.id)
+            render = jsonify({'job': job.id, 'status': job.status, 'url': location})
+            render.status_code = 202
+            render.headers.set('Location', location)
     render.headers.set('Content-Security-Policy', "default-src 'self'")
     render.headers.set('X-Content-Type-Options', 'nosniff')
     render.headers.set('X-Frame-Options', 'SAMEORIGIN')
@@ -94,6 +243,166 @@ def spell_check():
     return render
 
 
+@bp.route('/api/spell_check/jobs/<job_id>', methods=['GET'])
+@api_login_required
+def job_status(job_id):
+    """
+    Spell Check Job Status API View.
+
+    Must be logged in to access this view, otherwise a 401 is returned.
+    Only the user that submitted a job, or an admin, can see it, otherwise a 404 is returned.
+    Returns the job's status, one of pending, running, done or failed, and its age in seconds.
+    Done jobs include the same results as the batch API, failed jobs an error.
+    """
+    job = models.SpellCheckJob.query.get(job_id)
+    if job is None or not (g.user.is_admin or g.user.username == job.username):
+        render = jsonify({'error': 'No job with this ID found.'})
+        render.status_code = 404
+    else:
+        runner = jobs.get_runner()
+        status = runner.status(job)
+        body = {'job': job.id, 'status': status, 'language': job.language,
+                'age_seconds': ((job.finished or datetime.datetime.now()) - job.created).total_seconds()}
+        if status == jobs.DONE:
+            body['results'] = json.loads(job.results)
+        elif status == jobs.FAILED:
+            body['error'] = job.error or 'Spell check job did not finish in time.'
+        render = jsonify(body)
+        if status in (jobs.PENDING, jobs.RUNNING):
+            render.headers.set('Retry-After', '1')
+    render.headers.set('Cache-Control', 'no-cache, no-store, must-revalidate')
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+@bp.route('/api/spell_check/document', methods=['POST'])
+@api_login_required
+def spell_check_document():
+    """
+    Document Spell Check API View.
+
+    Must be logged in to access this view, otherwise a 401 is returned.
+    Accepts a UTF-8 document of up to DOCUMENT_MAX_BYTES as the request body, checked against the wordlist of the `language` argument.
+    Only application/octet-stream request bodies are accepted, which browsers will not send cross-site without CORS.
+    The document is checked DOCUMENT_CHUNK_SIZE bytes at a time, see spellcheckapp.spellcheck.documents, and results are streamed back
+    as newline delimited JSON, one line for each chunk with misspelled words:
+    {"offset": <character offset of the chunk>, "misspelled": [...], "suggestions": {...}}
+    followed by {"done": true, "query": <query ID>, "size": <bytes>, "misspelled": <misspelled word count>} once it is stored.
+    Errors found after the response has started are reported with a last {"error": ...} line, and the document is not stored.
+    """
+    dictionaries = languages.get_registry()
+    language = request.args.get('language') or dictionaries.default_language
+    max_bytes = current_app.config.get('DOCUMENT_MAX_BYTES', 10 * 1024 * 1024)
+    chunk_size = current_app.config.get('DOCUMENT_CHUNK_SIZE', 65536)
+    error = None
+    status = 400
+
+    if request.mimetype != 'application/octet-stream':
+        error = 'Expected an application/octet-stream request body.'
+    elif language not in dictionaries.wordlists:
+        error = 'Unknown language, expected one of: %s' % ', '.join(dictionaries.languages())
+    elif request.content_length == 0:
+        error = 'Expected a non-empty document.'
+    elif request.content_length is not None and request.content_length > max_bytes:
+        error = 'Exceeded max document size: %d bytes' % max_bytes
+        status = 413
+
+    if error is not None:
+        render = jsonify({'error': error})
+        render.status_code = status
+    else:
+        render = Response(stream_with_context(_check_document(g.user.username, language, chunk_size, max_bytes)), mimetype='application/x-ndjson')
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+def _check_document(username, language, chunk_size, max_bytes):
+    """
+    Checks the request body chunk by chunk, yielding NDJSON result lines, and stores the document once it is complete.
+
+    Chunks bypass the result cache, a document's chunks are rarely submitted again and would each take an entry.
+    """
+    spellcheck_engine = engine.get_engine(language).uncached()
+    writer = documents.DocumentWriter(chunk_size)
+    offset = 0
+    count = 0
+    try:
+        for text in documents.iter_chunks(request.stream, chunk_size, max_bytes):
+            misspelled = spellcheck_engine.check(text)
+            writer.write(text, misspelled)
+            if misspelled:
+                count += len(misspelled)
+                yield json.dumps({'offset': offset, 'misspelled': misspelled, 'suggestions': dict(suggest.suggest(misspelled, language))}) + '\n'
+            offset += len(text)
+        spell_check = writer.store(username, language, NO_MISSPELLED)
+        db.session.commit()
+        yield json.dumps({'done': True, 'query': spell_check.id, 'size': writer.size, 'misspelled': count}) + '\n'
+    except documents.DocumentTooLargeError as e:
+        yield json.dumps({'error': str(e)}) + '\n'
+    except engine.SpellCheckError:
+        yield json.dumps({'error': 'Spell check is currently unavailable.'}) + '\n'
+    finally:
+        writer.close()
+
+
+@bp.route('/api/admin/reload_wordlist', methods=['POST'])
+@api_login_required
+def reload_wordlist():
+    """
+    Wordlist Reload API View.
+
+    This is an admin only view.
+    Starts a background reload of the wordlist in the worker handling the request, see spellcheckapp.spellcheck.reloader.
+    Only JSON requests are accepted, so that a cross-site form can not trigger a reload.
+    Returns a 202 once the reload has started, or a 409 if one is already running.
+    """
+    if not g.user.is_admin:
+        render = jsonify({'error': 'Admin access required.'})
+        render.status_code = 403
+    elif not request.is_json:
+        render = jsonify({'error': 'Expected a JSON request.'})
+        render.status_code = 400
+    elif reloader.reload():
+        render = jsonify({'status': 'Reloading wordlist.'})
+        render.status_code = 202
+    else:
+        render = jsonify({'error': 'A wordlist reload is already running.'})
+        render.status_code = 409
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+def history_page(username, after=0, page_size=50):
+    """
+    Fetches one page of a user's query history.
+
+    Uses keyset pagination on the (username, id) index: the page holds the IDs of up to page_size queries after the given ID.
+    The total number of queries comes from the user's spell_check_count and is returned by the same statement.
+    Returns (ids, total, next_after), next_after is None on the last page.
+    """
+    total = db.session.query(authmodels.Users.spell_check_count).filter(authmodels.Users.username == username).as_scalar()
+    rows = db.session.query(models.SpellChecks.id, total.label('total')) \
+        .filter(models.SpellChecks.username == username, models.SpellChecks.id > after) \
+        .order_by(models.SpellChecks.id) \
+        .limit(page_size + 1) \
+        .all()
+    if rows:
+        numqueries = rows[0].total
+    else:
+        numqueries = db.session.query(total).scalar() or 0
+    next_after = rows[page_size - 1].id if len(rows) > page_size else None
+    return [row.id for row in rows[:page_size]], numqueries, next_after
+
+
 @bp.route('/history', methods=('GET', 'POST'))
 @login_required
 def history():
@@ -101,22 +410,29 @@ def history():
     History View.
 
     Must be logged in to access this view, otherwise redirected to login page.
-    This page will list links to queries that the user has submitted.
+    This page will list links to queries that the user has submitted, HISTORY_PAGE_SIZE links at a time.
     Will also show total number of queries submitted so far.
+    The page after a given query ID is requested with the `after` argument.
 
     If an admin user visits this page, there will be a form available.
     Admins can lookup another user's history by submitting a username.
+    Later pages of another user's history are requested with the `user` argument.
     Performs form validation and user level validation.
     """
     render = None
     form = forms.UserHistoryForm()
     username = g.user.username
-    queryhistory = models.SpellChecks.query.filter_by(username=username)
-    numqueries = queryhistory.count()
+    after = request.args.get('after', 0, type=int)
 
     if g.user.is_admin:
+        quser = None
         if form.validate_on_submit():
             quser = form.userquery.data
+            after = 0
+        elif request.method == 'GET' and request.args.get('user'):
+            quser = request.args.get('user')
+
+        if quser is not None:
             error = None
 
             if not quser:
@@ -128,13 +444,26 @@ def history():
 
             if error is None:
                 username = quser
-                queryhistory = models.SpellChecks.query.filter_by(username=username)
-                numqueries = queryhistory.count()
 
-    if g.user.is_admin:
-        render = make_response(render_template('spellcheck/history.html', form=form, numqueries=numqueries, queryhistory=queryhistory, username=username))
+    page_size = current_app.config.get('HISTORY_PAGE_SIZE', 50)
+    queryhistory, numqueries, next_after = history_page(username, after, page_size)
+    page_user = username if username != g.user.username else None
+
+    # The admin page holds a form with a fresh CSRF token, so only the pages of users who are not admins are revalidated with an ETag.
+    tag = None
+    if not g.user.is_admin:
+        tag = caching.etag(['base.html', 'spellcheck/history.html'], g.user.username, after, queryhistory, numqueries, next_after)
+    if tag is not None and caching.not_modified(tag):
+        render = make_response('', 304)
+    elif g.user.is_admin:
+        render = make_response(render_template('spellcheck/history.html', form=form, numqueries=numqueries, queryhistory=queryhistory, username=username,
+                                               after=after, next_after=next_after, page_user=page_user))
     else:
-        render = make_response(render_template('spellcheck/history.html', numqueries=numqueries, queryhistory=queryhistory, username=username))
+        render = make_response(render_template('spellcheck/history.html', numqueries=numqueries, queryhistory=queryhistory, username=username,
+                                               after=after, next_after=next_after, page_user=page_user))
+    if tag is not None:
+        render.set_etag(tag)
+        render.headers.set('Cache-Control', 'private, no-cache')
     render.headers.set('Content-Security-Policy', "default-src 'self'")
     render.headers.set('X-Content-Type-Options', 'nosniff')
     render.headers.set('X-Frame-Options', 'SAMEORIGIN')
@@ -155,8 +484,15 @@ def query(queryid):
     """
     query = models.SpellChecks.query.get(queryid)
     if query is not None and ((g.user.is_admin) or (g.user.username == query.username)):
-        query
-        render = make_response(render_template('spellcheck/history_s_query.html', query=query))
+        tag = caching.etag(['base.html', 'spellcheck/history_s_query.html'], g.user.username, g.user.is_admin,
+                           query.id, query.username, query.language, query.submitted_text, query.misspelled_words,
+                           query.suggestions, query.document_size, current_app.config.get('SPELLCHECK_DEFAULT_LANGUAGE', 'en'))
+        if caching.not_modified(tag):
+            render = make_response('', 304)
+        else:
+            render = make_response(render_template('spellcheck/history_s_query.html', query=query))
+        render.set_etag(tag)
+        render.headers.set('Cache-Control', 'private, no-cache')
         render.headers.set('Content-Security-Policy', "default-src 'self'")
         render.headers.set('X-Content-Type-Options', 'nosniff')
         render.headers.set('X-Frame-Options', 'SAMEORIGIN')
@@ -164,3 +500,104 @@ def query(queryid):
         return render
     else:
         abort(404)
+
+
+@bp.route('/history/query<int:queryid>/document', methods=['GET'])
+@login_required
+def query_document(queryid):
+    """
+    Query Document View.
+
+    Must be logged in to access this view, otherwise redirected to login page.
+    Streams the full text of a query submitted as a large document, decompressing it as it is sent.
+    The same users as for the query itself have access, otherwise a 404 is returned.
+    """
+    query = models.SpellChecks.query.get(queryid)
+    if query is None or query.document_size is None or not (g.user.is_admin or g.user.username == query.username):
+        abort(404)
+    render = Response(stream_with_context(documents.iter_document(queryid)), mimetype='text/plain')
+    render.headers.set('Content-Length', str(query.document_size))
+    render.headers.set('Content-Disposition', 'attachment', filename='query%d.txt' % queryid)
+    render.headers.set('Content-Security-Policy', "default-src 'self'")
+    render.headers.set('X-Content-Type-Options', 'nosniff')
+    render.headers.set('X-Frame-Options', 'SAMEORIGIN')
+    render.headers.set('X-XSS-Protection', '1; mode=block')
+    return render
+
+
+@bp.cli.command('rebuild-counters')
+def rebuild_counters():
+    """Recomputes every user's spell_check_count from the spell check history."""
+    count = db.session.query(db.func.count(models.SpellChecks.id)) \
+        .filter(models.SpellChecks.username == authmodels.Users.username) \
+        .as_scalar()
+    updated = authmodels.Users.query.update({authmodels.Users.spell_check_count: count}, synchronize_session=False)
+    db.session.commit()
+    print('Rebuilt spell check counters for %d users.' % updated)
+
+
+@bp.cli.command('prune-jobs')
+@click.option('--hours', type=float, default=None, help='Delete jobs that finished more than this many hours ago, defaults to SPELLCHECK_JOB_RETENTION.')
+def prune_jobs(hours):
+    """Deletes finished spell check jobs, along with their texts and results, once they are past retention."""
+    runner = jobs.get_runner()
+    hours = hours if hours is not None else runner.retention
+    if hours is None:
+        raise click.UsageError('SPELLCHECK_JOB_RETENTION is not set, pass --hours.')
+    print('Deleted %d spell check jobs.' % runner.prune(hours))
+
+
+def unquote(text):
+    """Returns the text that shlex.quote turned into text, or None if text is not the output of shlex.quote."""
+    if len(text) < 2 or text[0] != "'" or text[-1] != "'":
+        return None
+    unquoted = text[1:-1].replace("'\"'\"'", "'")
+    return unquoted if shlex.quote(unquoted) == text else None
+
+
+@bp.cli.command('unquote-history')
+@click.option('--up-to', type=int, default=None, help='Only rows with an ID up to this one, the last row stored quoted.')
+@click.option('--batch-size', type=int, default=1000, help='Rows updated per transaction.')
+def unquote_history(up_to, batch_size):
+    """
+    Removes the shell quoting that texts used to be stored with from the spell check history.
+
+    Texts were passed through shlex.quote before they were checked and stored. Texts made only of safe characters
+    were stored as they were, the rest wrapped in single quotes with single quotes escaped, which is undone here.
+    Rows stored since quoting was removed can look quoted too if the user typed the quotes, pass --up-to with the ID
+    of the last row stored before the upgrade to leave them alone.
+    """
+    last_id = 0
+    updated = 0
+    while True:
+        query = db.session.query(models.SpellChecks.id, models.SpellChecks.submitted_text) \
+            .filter(models.SpellChecks.id > last_id, models.SpellChecks.document_size.is_(None))
+        if up_to is not None:
+            query = query.filter(models.SpellChecks.id <= up_to)
+        rows = query.order_by(models.SpellChecks.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = [{'id': row.id, 'submitted_text': unquote(row.submitted_text)} for row in rows]
+        changes = [change for change in changes if change['submitted_text']]
+        if changes:
+            db.session.bulk_update_mappings(models.SpellChecks, changes)
+            db.session.commit()
+            updated += len(changes)
+    print('Unquoted %d spell check texts.' % updated)
+
+
+@bp.cli.command('compile-wordlist')
+@click.argument('source', required=False)
+@click.argument('dest', required=False)
+@click.option('--bloom-fp-rate', type=float, default=None, help='Also store a Bloom filter with this false positive rate.')
+def compile_wordlist(source, dest, bloom_fp_rate):
+    """
+    Compiles a text wordlist into the memory mapped format used by the dictionary engine.
+
+    SOURCE defaults to WORDLIST and DEST to SOURCE with a .bin extension.
+    """
+    source = source or current_app.config['WORDLIST']
+    dest = dest or os.path.splitext(source)[0] + '.bin'
+    count = compiled.compile_wordlist(engine.load_wordlist(source), dest, bloom_fp_rate=bloom_fp_rate)
+    print('Compiled %d words from %s into %s.' % (count, source, dest))
@@ -0,0 +1,295 @@
+"""
+Spelling Suggestions for Spellcheckapp.
+
+Suggestions come from a symmetric delete index (SymSpell) over the wordlist of the language being checked.
+Every dictionary word is indexed under the strings left by deleting up to max_distance characters from its first
+prefix_length characters. A misspelled word is looked up under its own deletes, which finds every dictionary word within
+max_distance edits without scanning the dictionary, and the candidates are ranked by their true edit distance.
+Words of up to SHORT_WORD_LENGTH characters only get suggestions one edit away.
+
+The index is built once per worker on a background thread, started by the first lookup. Requests do not wait for it
+beyond SPELLCHECK_SUGGEST_WAIT seconds (default 0), words checked before it is ready get no suggestions.
+"""
+import logging
+import sys
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+SHORT_WORD_LENGTH = 4
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Returns the optimal string alignment distance between a and b.
+
+    Insertions, deletions, substitutions and transpositions of adjacent characters each count as one edit.
+    Only cells within max_distance of the diagonal are computed, and max_distance + 1 is returned
+    as soon as the distance is known to be larger than max_distance.
+    """
+    if a == b:
+        return 0
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    over = max_distance + 1
+    previous_previous = None
+    previous = [j if j <= max_distance else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [over] * (len_b + 1)
+        if i <= max_distance:
+            current[0] = i
+        char_a = a[i - 1]
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(len_b, i + max_distance) + 1):
+            char_b = b[j - 1]
+            value = previous[j - 1] if char_a == char_b else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b and previous_previous[j - 2] + 1 < value:
+                value = previous_previous[j - 2] + 1
+            current[j] = value if value < over else over
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(word, max_distance):
+    """Returns the set of strings left by deleting up to max_distance characters from word, including word itself."""
+    deletes = {word}
+    edges = [word]
+    for _ in range(max_distance):
+        edges = [edge[:i] + edge[i + 1:] for edge in edges if len(edge) > 1 for i in range(len(edge))]
+        deletes.update(edges)
+    return deletes
+
+
+class SymSpellIndex(object):
+    """
+    Symmetric Delete Index.
+
+    Maps the deletes of every word's prefix to the words they came from, words are compared in lower case.
+    """
+
+    def __init__(self, words, max_distance=2, prefix_length=7):
+        """Indexes words."""
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        # Lower case form -> dictionary spellings, only kept for words that are not all lower case.
+        self._spellings = {}
+        self._deletes = {}
+        seen = set()
+        lower_words = set()
+        for word in words:
+            lower = word.lower()
+            if lower != word:
+                self._spellings.setdefault(lower, []).append(word)
+            else:
+                lower_words.add(lower)
+            if lower in seen:
+                continue
+            seen.add(lower)
+            for delete in _deletes(lower[:prefix_length], max_distance):
+                entry = self._deletes.get(delete)
+                if entry is None:
+                    # Most deletes have a single word, stored as the string itself rather than a list.
+                    self._deletes[delete] = lower
+                elif isinstance(entry, str):
+                    self._deletes[delete] = [entry, lower]
+                else:
+                    entry.append(lower)
+        for lower, spellings in self._spellings.items():
+            if lower in lower_words:
+                spellings.append(lower)
+
+    def __len__(self):
+        """Returns the number of index entries."""
+        return len(self._deletes)
+
+    def memory(self):
+        """Returns an estimate of the bytes held by the index."""
+        size = sys.getsizeof(self._deletes) + sys.getsizeof(self._spellings)
+        for delete, entry in self._deletes.items():
+            size += sys.getsizeof(delete)
+            if not isinstance(entry, str):
+                size += sys.getsizeof(entry)
+        return size
+
+    def lookup(self, word, max_suggestions=5):
+        """Returns up to max_suggestions dictionary words within max_distance edits of word, closest first."""
+        lower = word.lower()
+        # Short words are within two edits of a large part of any dictionary, so they only get one edit.
+        limit = min(self.max_distance, 1 if len(lower) <= SHORT_WORD_LENGTH else self.max_distance)
+        ranked = []
+        checked = set()
+        for delete in _deletes(lower[:self.prefix_length], limit):
+            entry = self._deletes.get(delete)
+            if entry is None:
+                continue
+            for candidate in ((entry,) if isinstance(entry, str) else entry):
+                if abs(len(candidate) - len(lower)) > limit or candidate in checked:
+                    continue
+                checked.add(candidate)
+                distance = edit_distance(lower, candidate, limit)
+                if distance > limit:
+                    continue
+                ranked.append((distance, abs(len(candidate) - len(lower)), candidate))
+                if len(ranked) >= max_suggestions:
+                    # Once there are enough suggestions, only closer words can still make the list.
+                    ranked.sort()
+                    del ranked[max_suggestions:]
+                    limit = ranked[-1][0]
+        ranked.sort()
+        suggestions = []
+        for _, _, candidate in ranked:
+            spellings = self._spellings.get(candidate, (candidate,))
+            suggestions.extend(spelling for spelling in spellings if spelling != word)
+        return suggestions[:max_suggestions]
+
+
+class Suggester(object):
+    """
+    Suggester.
+
+    Builds a SymSpellIndex from a wordlist in the background on first use and returns suggestions for misspelled words.
+    """
+
+    def __init__(self, wordlist, max_distance=2, prefix_length=7, max_suggestions=5, wait=0):
+        """Stores the index settings, the index itself is built lazily."""
+        self.wordlist = wordlist
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.max_suggestions = max_suggestions
+        self.wait = wait
+        self.lookups = 0
+        self.skipped = 0
+        self.build_seconds = None
+        self.error = None
+        self._index = None
+        self._memory = 0
+        self._builder = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        """Returns a new index of the wordlist file as it is now."""
+        from spellcheckapp.spellcheck.engine import open_wordlist
+        started = time.monotonic()
+        words = open_wordlist(self.wordlist)
+        try:
+            index = SymSpellIndex(words, self.max_distance, self.prefix_length)
+        finally:
+            if hasattr(words, 'close'):
+                words.close()
+        self.build_seconds = time.monotonic() - started
+        return index, index.memory()
+
+    def _build_in_background(self, logger):
+        """Builder thread target, builds the index and swaps it in."""
+        try:
+            index, memory = self._build()
+            with self._lock:
+                self._index, self._memory = index, memory
+                self.error = None
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+            logger.warning('Unable to build the spelling suggestion index: %s', e)
+        finally:
+            with self._lock:
+                self._builder = None
+
+    def index(self, wait=None):
+        """
+        Returns the index, or None while it is being built.
+
+        The first call starts building it on a background thread, and waits up to wait seconds for it (default self.wait).
+        A build that failed is started again by the next call.
+        """
+        if self._index is not None:
+            return self._index
+        with self._lock:
+            if self._index is None and self._builder is None:
+                logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+                self._builder = threading.Thread(target=self._build_in_background, args=(logger,), name='suggest-index', daemon=True)
+                self._builder.start()
+            builder = self._builder
+        wait = self.wait if wait is None else wait
+        if builder is not None and wait:
+            builder.join(wait)
+        return self._index
+
+    def reload(self):
+        """
+        Builds a new index and swaps it in, lookups already running finish with the old one.
+
+        Returns the seconds spent building and swapping as a (build, swap) pair, or None if no index was built yet.
+        A build already running may have read the old wordlist, it is waited for and replaced.
+        """
+        builder = self._builder
+        if builder is not None:
+            builder.join()
+        if self._index is None:
+            return None
+        index, memory = self._build()
+        started = time.monotonic()
+        with self._lock:
+            self._index, self._memory = index, memory
+        return self.build_seconds, time.monotonic() - started
+
+    def suggest(self, words):
+        """Returns a list of (word, suggestions) pairs for misspelled words, in order and without repeats, or [] while the index is built."""
+        index = self.index()
+        if index is None:
+            self.skipped += len(set(words))
+            return []
+        suggestions = []
+        seen = set()
+        for word in words:
+            if word not in seen:
+                seen.add(word)
+                self.lookups += 1
+                suggestions.append((word, index.lookup(word, self.max_suggestions)))
+        return suggestions
+
+    def memory(self):
+        """Returns the estimated size of the index, 0 until it is built."""
+        return self._memory
+
+    def stats(self):
+        """Returns the suggester counters."""
+        return {'lookups': self.lookups,
+                'skipped': self.skipped,
+                'building': self._builder is not None,
+                'error': self.error,
+                'entries': len(self._index) if self._index is not None else 0,
+                'bytes': self._memory,
+                'build_seconds': self.build_seconds}
+
+
+def create_suggester(config, wordlist):
+    """Returns a suggester for wordlist configured from an app config, or None unless SPELLCHECK_SUGGESTIONS is enabled."""
+    if not config.get('SPELLCHECK_SUGGESTIONS', False):
+        return None
+    return Suggester(wordlist,
+                     max_distance=config.get('SPELLCHECK_SUGGEST_MAX_DISTANCE', 2),
+                     prefix_length=config.get('SPELLCHECK_SUGGEST_PREFIX_LENGTH', 7),
+                     max_suggestions=config.get('SPELLCHECK_SUGGEST_MAX', 5),
+                     wait=config.get('SPELLCHECK_SUGGEST_WAIT', 0))
+
+
+def suggest(words, language=None):
+    """
+    Returns (word, suggestions) pairs for misspelled words using the suggester of language, or of the default language.
+
+    Returns an empty list when suggestions are disabled, while the index is built, or when the wordlist can not be indexed.
+    """
+    from spellcheckapp.spellcheck.languages import get_dictionary
+    suggester = get_dictionary(language).suggester
+    if suggester is None or not words:
+        return []
+    return suggester.suggest(words)
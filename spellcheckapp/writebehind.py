@@ -0,0 +1,424 @@
+"""
+Write-Behind Queue for Spellcheckapp.
+
+When WRITE_BEHIND is enabled, audit rows (AuthLog and SpellChecks) are queued instead of committed in the request.
+A background thread inserts them in batches once WRITE_BEHIND_MAX_BATCH rows are waiting or the oldest row
+has waited WRITE_BEHIND_MAX_DELAY seconds, and again when the worker exits.
+
+WRITE_BEHIND_DURABILITY controls what happens to queued rows if a worker dies before they are written:
+
+- 'memory' keeps them in memory only, they are lost.
+- 'journal' also appends each row to a per-worker journal file in WRITE_BEHIND_JOURNAL_DIR (fsynced when WRITE_BEHIND_FSYNC is set).
+  Journals left behind by dead workers are replayed when the app starts.
+
+Each batch is committed together with the sequence number of its last row in the write_behind_commits table, so a worker
+that dies between the commit and recording it in its journal does not have the batch replayed a second time.
+"""
+import atexit
+import collections
+import contextlib
+import datetime
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, has_app_context
+
+from spellcheckapp import db
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class WriteBehindCommit(db.Model):
+    """
+    WriteBehindCommit Database Model.
+
+    Defines the last sequence number of each journal written to the database, in the same transaction as its rows.
+    """
+
+    __tablename__ = 'write_behind_commits'
+
+    journal = db.Column(db.String(100), primary_key=True)
+    seq = db.Column(db.Integer, unique=False, nullable=False)
+
+    def __repr__(self):
+        """Defines string representation of a WriteBehindCommit tuple."""
+        return '<Journal %r Seq %r>' % (self.journal, self.seq)
+
+
+def _encode(value):
+    """JSON encoder hook for datetimes."""
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.strftime(DATETIME_FORMAT)}
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _decode(value):
+    """JSON decoder hook for datetimes."""
+    if '$datetime' in value:
+        return datetime.datetime.strptime(value['$datetime'], DATETIME_FORMAT)
+    return value
+
+
+@contextlib.contextmanager
+def _current_context():
+    """Keeps using the app context that is already pushed."""
+    yield
+
+
+class Journal(object):
+    """
+    Write-Behind Journal.
+
+    An append-only file of queued rows, each tagged with a sequence number.
+    A commit marker records the last sequence number written to the database.
+    The file is held with an exclusive lock so a replay never touches a live worker's journal.
+    """
+
+    def __init__(self, path, fsync=True):
+        """Creates and locks the journal file."""
+        self.path = path
+        self.name = os.path.basename(path)
+        self.fsync = fsync
+        self._file = open(path, 'a+')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise
+
+    def current(self):
+        """Returns True if the locked file is still the one at path, another process may have replayed and removed it."""
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            return False
+
+    def _write(self, record):
+        """Appends one record and flushes it to disk."""
+        self._file.write(json.dumps(record, default=_encode) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def append(self, seq, kind, row):
+        """Records a queued row."""
+        self._write({'seq': seq, 'kind': kind, 'row': row})
+
+    def commit(self, seq):
+        """Records that every row up to seq has been written to the database."""
+        self._write({'committed': seq})
+
+    def truncate(self):
+        """Empties the journal, used once every row has been written."""
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+
+    def close(self, remove=False):
+        """Releases the journal, removing the file if requested."""
+        if remove:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        self._file.close()
+
+    @staticmethod
+    def pending(path, committed=0):
+        """Returns the (seq, kind, row) records in a journal file that were never committed, nor are up to committed."""
+        rows = collections.OrderedDict()
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    # A torn final line from a crash mid-write, the row was never acknowledged.
+                    continue
+                if 'committed' in record:
+                    for seq in [seq for seq in rows if seq <= record['committed']]:
+                        del rows[seq]
+                else:
+                    rows[record['seq']] = (record['seq'], record['kind'], record['row'])
+        return [record for seq, record in rows.items() if seq > committed]
+
+
+class WriteBehindQueue(object):
+    """
+    Write-Behind Queue.
+
+    Rows are queued with a kind, and written by the handler registered for that kind.
+    Each handler receives a list of rows and adds them to the session, the queue commits once per batch.
+    """
+
+    def __init__(self, app, handlers, max_batch=100, max_delay=1.0, max_pending=10000, journal_dir=None, fsync=True):
+        """Stores the queue settings, the background thread is started by the first enqueued row."""
+        self.app = app
+        self.handlers = handlers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._reset()
+
+    def _reset(self):
+        """Empties the queue, used on creation and after a fork."""
+        self._pid = os.getpid()
+        self._pending = collections.deque()
+        self._seq = 0
+        self._thread = None
+        self._journal = None
+
+    def _start(self):
+        """Starts the background thread and the journal for this process."""
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None:
+            if self.journal_dir is not None:
+                path = os.path.join(self.journal_dir, 'write_behind.%d.%s.journal' % (os.getpid(), uuid.uuid4().hex[:12]))
+                self._journal = Journal(path, fsync=self.fsync)
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, kind, row):
+        """
+        Queues a row, writing the queue out in the caller's thread if it is full.
+
+        A failed write is logged and the row stays queued, and journaled if enabled, for the background thread to retry.
+        """
+        if kind not in self.handlers:
+            raise ValueError('No write-behind handler for %r' % kind)
+        with self._lock:
+            self._start()
+            self._seq += 1
+            if self._journal is not None:
+                self._journal.append(self._seq, kind, row)
+            self._pending.append((self._seq, time.monotonic(), kind, row))
+            full = len(self._pending) >= self.max_pending
+            if len(self._pending) >= self.max_batch:
+                self._lock.notify()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Write-behind queue is full and could not be written out, keeping the rows queued.')
+
+    def _run(self):
+        """Background thread, writes batches out when they are big or old enough."""
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    if len(self._pending) >= self.max_batch:
+                        break
+                    if self._pending:
+                        wait = self._pending[0][1] + self.max_delay - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._lock.wait(wait)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Write-behind flush failed, retrying in %ss.', self.max_delay)
+                time.sleep(self.max_delay)
+
+    def flush(self):
+        """Writes every queued row to the database, one transaction per batch."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+                if not batch:
+                    return
+                started = time.monotonic()
+                try:
+                    self._write(batch, self._journal)
+                except Exception:
+                    self.errors += 1
+                    with self._lock:
+                        self._pending.extendleft(reversed(batch))
+                    raise
+                elapsed = time.monotonic() - started
+                self.flushes += 1
+                self.flushed += len(batch)
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                with self._lock:
+                    if self._journal is not None:
+                        if self._pending:
+                            self._journal.commit(batch[-1][0])
+                        else:
+                            self._journal.truncate()
+
+    def _write(self, batch, journal=None):
+        """Inserts a batch with the registered handlers and commits it, along with its last sequence number if journaled."""
+        rows = collections.OrderedDict()
+        for _, _, kind, row in batch:
+            rows.setdefault(kind, []).append(row)
+        commit = (journal.name, batch[-1][0]) if journal is not None else None
+        with self._app_context():
+            self._write_rows(rows, commit)
+
+    def _app_context(self):
+        """Returns the app context to use the database in, nothing is pushed if the caller already has one."""
+        return _current_context() if has_app_context() else self.app.app_context()
+
+    def _write_rows(self, rows, commit=None):
+        """Runs the handlers for rows grouped by kind, records the (journal name, seq) commit if given and commits."""
+        try:
+            for kind, kind_rows in rows.items():
+                self.handlers[kind](kind_rows)
+            if commit is not None:
+                name, seq = commit
+                if not WriteBehindCommit.query.filter_by(journal=name).update({WriteBehindCommit.seq: seq}, synchronize_session=False):
+                    db.session.add(WriteBehindCommit(journal=name, seq=seq))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def replay(self):
+        """Writes out rows left in the journals of workers that are no longer running."""
+        if self.journal_dir is None:
+            return 0
+        replayed = 0
+        for path in glob.glob(os.path.join(self.journal_dir, 'write_behind.*.journal')):
+            try:
+                journal = Journal(path, fsync=False)
+            except OSError:
+                # Locked by a running worker.
+                continue
+            if not journal.current():
+                journal.close()
+                continue
+            try:
+                rows = Journal.pending(path, self._committed(journal.name))
+                if rows:
+                    self._write([(seq, None, kind, row) for seq, kind, row in rows], journal)
+                    replayed += len(rows)
+            except Exception:
+                journal.close()
+                raise
+            journal.close(remove=True)
+            self._forget(journal.name)
+        return replayed
+
+    def _committed(self, name):
+        """Returns the last sequence number of the journal called name written to the database, 0 if there is none."""
+        with self._app_context():
+            commit = WriteBehindCommit.query.get(name)
+            return commit.seq if commit is not None else 0
+
+    def _forget(self, name):
+        """Deletes the commit record of a journal once its file has been removed."""
+        with self._app_context():
+            WriteBehindCommit.query.filter_by(journal=name).delete(synchronize_session=False)
+            db.session.commit()
+
+    def stats(self):
+        """Returns the queue counters."""
+        with self._lock:
+            depth = len(self._pending)
+            oldest = time.monotonic() - self._pending[0][1] if self._pending else 0.0
+        return {'depth': depth,
+                'oldest_seconds': oldest,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds}
+
+    def close(self):
+        """Stops the background thread and writes out everything still queued."""
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+            self._thread = None
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Write-behind flush at shutdown failed.')
+                return
+            if self._journal is not None:
+                self._journal.close(remove=True)
+                self._forget(self._journal.name)
+                self._journal = None
+
+
+def _write_auth_logs(rows):
+    """Write-behind handler for AuthLog rows, skips logins already inserted by the logout of another worker."""
+    from spellcheckapp.auth.models import AuthLog
+    existing = set(db.session.query(AuthLog.userid, AuthLog.login_time)
+                   .filter(AuthLog.login_time.in_([row['login_time'] for row in rows])))
+    rows = [row for row in rows if (row['userid'], row['login_time']) not in existing]
+    if rows:
+        db.session.bulk_insert_mappings(AuthLog, rows)
+
+
+def _write_spell_checks(rows):
+    """Write-behind handler for SpellChecks rows, keeps each user's counter in step."""
+    from spellcheckapp.spellcheck.spellcheck import store_spell_checks
+    by_user = collections.OrderedDict()
+    for row in rows:
+        by_user.setdefault(row['username'], []).append({'submitted_text': row['submitted_text'], 'misspelled_words': row['misspelled_words'],
+                                                        'suggestions': row.get('suggestions'), 'language': row.get('language')})
+    for username, spell_checks in by_user.items():
+        store_spell_checks(username, spell_checks)
+
+
+def init_app(app):
+    """Creates the write-behind queue if WRITE_BEHIND is enabled, replaying journals left by dead workers."""
+    from spellcheckapp import metrics
+    if not app.config.get('WRITE_BEHIND', False):
+        return
+    durability = app.config.get('WRITE_BEHIND_DURABILITY', 'memory')
+    if durability not in ('memory', 'journal'):
+        raise ValueError('Unknown WRITE_BEHIND_DURABILITY: %r' % durability)
+    journal_dir = app.config.get('WRITE_BEHIND_JOURNAL_DIR', app.instance_path) if durability == 'journal' else None
+    queue = WriteBehindQueue(app,
+                             {'auth_log': _write_auth_logs, 'spell_checks': _write_spell_checks},
+                             max_batch=app.config.get('WRITE_BEHIND_MAX_BATCH', 100),
+                             max_delay=app.config.get('WRITE_BEHIND_MAX_DELAY', 1.0),
+                             max_pending=app.config.get('WRITE_BEHIND_MAX_PENDING', 10000),
+                             journal_dir=journal_dir,
+                             fsync=app.config.get('WRITE_BEHIND_FSYNC', True))
+    replayed = queue.replay()
+    if replayed:
+        app.logger.info('Replayed %d write-behind rows from old journals.', replayed)
+    app.extensions['write_behind'] = queue
+    metrics.register(app, 'write_behind', queue.stats)
+    atexit.register(queue.close)
+
+
+def enabled():
+    """Returns True if the current app queues audit rows."""
+    return 'write_behind' in current_app.extensions
+
+
+def enqueue(kind, row):
+    """Queues a row on the current app's write-behind queue."""
+    current_app.extensions['write_behind'].enqueue(kind, row)
+
+
+def flush():
+    """Writes out the current app's queued rows, if write-behind is enabled."""
+    if enabled():
+        current_app.extensions['write_behind'].flush()
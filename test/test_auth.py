@@ -7,6 +7,7 @@ import os
 import sys
 import tempfile
 import unittest
+import unittest.mock
 
 import app
 
@@ -14,8 +15,12 @@ import bs4
 
 import onetimepass
 
+from spellcheckapp import db
+from spellcheckapp.auth import throttle, totp
 from spellcheckapp.auth.models import MFA, Users
 
+from werkzeug.security import generate_password_hash
+
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
@@ -488,13 +493,22 @@ class TestAuth(unittest.TestCase):
         csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
         with self.base_app.app_context():
             mfa_stored = MFA.query.filter_by(username='temp1234').first()
-            mfa_token = onetimepass.get_totp(mfa_stored.mfa_secret)
+            mfa_token = onetimepass.get_totp(mfa_stored.mfa_secret, as_string=True)
             response = self.login(uname='temp1234', pword='temp1234', mfa=mfa_token, csrf_token=csrf_token)
         self.assertEqual(response.status_code, 200)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find_all(id='result')
         self.assertGreater(len(results), 0, "No flash messages received")
         self.assertTrue(any("Login success" in s.text for s in results))
+        # The same code cannot be used again
+        self.logout()
+        response = self.app.get('/login', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.login(uname='temp1234', pword='temp1234', mfa=mfa_token, csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("Two-factor authentication failure" in s.text for s in soup.find_all(id='result')))
+        self.assertEqual(self.base_app.extensions['totp_verifier'].replays, 1)
 
     def test_login_invalid_mfa_login(self):
         """Tests that a login request with an invalid mfa entry fails."""
@@ -570,6 +584,39 @@ class TestAuth(unittest.TestCase):
         results = soup.find_all('p')
         self.assertTrue(any("Need to spell check some text?" in s.text for s in results))
 
+    def test_logged_in_user_cache(self):
+        """Tests that warm requests reuse the cached user and that account changes invalidate it."""
+        # Register a user
+        response = self.app.get('/register', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.register(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        # Login as a user
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.login(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 200)
+        user_cache = self.base_app.extensions['user_cache']
+        misses = user_cache.misses
+        for _ in range(3):
+            response = self.app.get('/account', follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_cache.misses, misses)
+        self.assertGreaterEqual(user_cache.hits, 3)
+        # Start MFA setup, the cached record must be reloaded afterwards
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        self.update_account(mfa_enabled=True, csrf_token=csrf_token)
+        response = self.app.get('/multifactor', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        misses = user_cache.misses
+        self.mfa_confirm(mfa_confirm=True, csrf_token=csrf_token)
+        self.assertGreater(user_cache.misses, misses)
+        # MFA is now registered so the setup page redirects to the account page
+        response = self.app.get('/multifactor')
+        self.assertEqual(response.status_code, 302)
+
     def test_login_history(self):
         """Tests that the login history page can be accessed by an admin user."""
         response = self.app.get('/login', follow_redirects=True)
@@ -597,6 +644,224 @@ class TestAuth(unittest.TestCase):
         self.assertGreater(len(soup.find_all('td', id='login1_time')), 0, "No column entry with id 'login1_time' found.")
         self.assertGreater(len(soup.find_all('td', id='logout1_time')), 0, "No column entry with id 'logout1_time' found.")
 
+    def test_password_rehash_on_login(self):
+        """Tests that a hash made with an older method or cost is replaced on a successful login."""
+        hasher = self.base_app.extensions['password_hasher']
+        with self.base_app.app_context():
+            self.assertTrue(Users.query.filter_by(username='replaceme').first().password.startswith(hasher.method + '$'))
+            Users.query.filter_by(username='replaceme').first().password = generate_password_hash('replaceme', 'pbkdf2:sha256:1000')
+            db.session.commit()
+        response = self.app.get('/login', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.login(uname='replaceme', pword='wrongpassword', csrf_token=csrf_token)
+        with self.base_app.app_context():
+            self.assertTrue(Users.query.filter_by(username='replaceme').first().password.startswith('pbkdf2:sha256:1000$'))
+        response = self.login(uname='replaceme', pword='replaceme', csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("Login success" in s.text for s in soup.find_all(id='result')))
+        self.assertEqual(hasher.rehashed, 1)
+        with self.base_app.app_context():
+            self.assertTrue(Users.query.filter_by(username='replaceme').first().password.startswith(hasher.method + '$'))
+        # The upgraded hash still matches
+        self.logout()
+        response = self.app.get('/login', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.login(uname='replaceme', pword='replaceme', csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("Login success" in s.text for s in soup.find_all(id='result')))
+        self.assertEqual(hasher.rehashed, 1)
+
+    def test_password_hasher_busy(self):
+        """Tests that logins are refused right away with a 503 while the password hasher is saturated."""
+        response = self.app.get('/login', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        hasher = self.base_app.extensions['password_hasher']
+        hasher.max_pending = 0
+        response = self.login(uname='replaceme', pword='replaceme', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("server is busy" in s.text for s in soup.find_all(id='result')))
+        self.assertEqual(hasher.rejected, 1)
+        self.assertEqual(self.app.get('/account').status_code, 302)
+        hasher.max_pending = 32
+        response = self.login(uname='replaceme', pword='replaceme', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/account').status_code, 200)
+
+    def test_qrcode_cache(self):
+        """Tests that the MFA QR code is rendered once per secret, revalidated with its ETag, and replaced when MFA is set up again."""
+        response = self.app.get('/register', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.register(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        self.login(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        response = self.app.get('/account', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        self.update_account(mfa_enabled=True, csrf_token=csrf_token)
+        qr_cache = self.base_app.extensions['qrcode_cache']
+        response = self.app.get('/qrcode')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'image/svg+xml')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache, no-store, must-revalidate')
+        svg = response.data
+        tag = response.headers['ETag']
+        response = self.app.get('/qrcode', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        response = self.app.get('/qrcode')
+        self.assertEqual(response.data, svg)
+        self.assertEqual((qr_cache.misses, qr_cache.hits), (1, 2))
+        # Starting MFA setup again creates a new secret, the old code is dropped and a new one rendered
+        self.update_account(mfa_enabled=True, csrf_token=csrf_token)
+        self.assertEqual(qr_cache.stats()['entries'], 0)
+        response = self.app.get('/qrcode', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], tag)
+        self.assertNotEqual(response.data, svg)
+
+    def test_account_update_single_commit(self):
+        """Tests that a password and an MFA change submitted together are applied with a single commit."""
+        response = self.app.get('/register', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.register(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        self.login(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        response = self.app.get('/account', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        with unittest.mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+            response = self.app.post('/account', data={"password": 'temp12345', "mfa_enabled": True, "csrf_token": csrf_token})
+        self.assertEqual(commit.call_count, 1)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith('/multifactor'))
+        with self.base_app.app_context():
+            user = Users.query.filter_by(username='temp1234').first()
+            self.assertTrue(self.base_app.extensions['password_hasher'].check(user.password, 'temp12345'))
+            self.assertFalse(user.mfa_registered)
+            self.assertEqual(MFA.query.filter_by(username='temp1234').count(), 1)
+        # The setup page sees the change right away
+        self.assertEqual(self.app.get('/multifactor').status_code, 200)
+
+    def test_login_throttle(self):
+        """Tests that login attempts beyond a username's or an IP's burst are refused with a 429 before the password is checked."""
+        response = self.app.get('/login', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        login_throttle = self.base_app.extensions['login_throttle']
+        hasher = self.base_app.extensions['password_hasher']
+        login_throttle.user_burst = 2
+        login_throttle.ip_burst = 4
+        for _ in range(2):
+            response = self.login(uname='replaceme', pword='wrongpassword', csrf_token=csrf_token)
+            self.assertEqual(response.status_code, 200)
+        checked = hasher.checked
+        response = self.login(uname='replaceme', pword='replaceme', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("Too many login attempts" in s.text for s in soup.find_all(id='result')))
+        self.assertEqual(hasher.checked, checked)
+        self.assertEqual(self.app.get('/account').status_code, 302)
+        # Other usernames are not affected until the IP's burst is used up
+        response = self.login(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 200)
+        response = self.login(uname='temp1234', pword='temp1234', csrf_token=csrf_token)
+        self.assertEqual(response.status_code, 429)
+        self.base_app.config['METRICS_ENABLED'] = True
+        stats = self.app.get('/metrics').get_json()['login_throttle']
+        self.assertEqual((stats['allowed'], stats['limited_user'], stats['limited_ip']), (3, 1, 1))
+
+    def test_login_throttle_database_store(self):
+        """Tests that the database bucket store shares buckets between stores and refills them over time."""
+        with self.base_app.app_context():
+            replica_one = throttle.DatabaseBucketStore()
+            replica_two = throttle.DatabaseBucketStore()
+            self.assertEqual(replica_one.take('user:temp1234', 2, 1 / 60.0), 0)
+            self.assertEqual(replica_two.take('user:temp1234', 2, 1 / 60.0), 0)
+            self.assertAlmostEqual(replica_one.take('user:temp1234', 2, 1 / 60.0), 60, delta=1)
+            self.assertEqual(replica_two.take('user:other', 2, 1 / 60.0), 0)
+            self.assertEqual(len(replica_one), 2)
+            # A fast refill rate makes a token available again right away
+            self.assertEqual(replica_two.take('user:temp1234', 2, 1000.0), 0)
+
+    def test_login_throttle_client_ip(self):
+        """Tests that attempts are only limited per IP when enabled, and that only X-Forwarded-For entries added by trusted proxies are used."""
+        self.assertIsNone(self.base_app.extensions['login_throttle'].ip_burst)
+        self.assertEqual(throttle.client_ip('10.0.0.1', '1.2.3.4', 0), '10.0.0.1')
+        self.assertEqual(throttle.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4', 1), '1.2.3.4')
+        self.assertEqual(throttle.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4, 10.0.0.2', 2), '1.2.3.4')
+        self.assertEqual(throttle.client_ip('10.0.0.1', None, 1), '10.0.0.1')
+        login_throttle = throttle.LoginThrottle(throttle.LocalBucketStore(), user_burst=100, ip_burst=1)
+        with self.base_app.app_context():
+            self.assertEqual(login_throttle.check('temp1234', '1.2.3.4'), 0)
+            self.assertGreater(login_throttle.check('other', '1.2.3.4'), 0)
+            self.assertEqual(login_throttle.check('other', '1.2.3.5'), 0)
+
+    def test_totp_verifier(self):
+        """Tests that TOTP codes of the window are accepted once, and that codes of earlier intervals are refused after a later one was used."""
+        verifier = totp.TOTPVerifier()
+        secret = MFA(username='temp1234').mfa_secret
+        now = 1000000 * totp.INTERVAL + 5
+
+        def code(offset):
+            return onetimepass.get_totp(secret, as_string=True, clock=now + offset * totp.INTERVAL).decode()
+
+        self.assertFalse(verifier.verify(1, secret, code(-2), now=now))
+        self.assertFalse(verifier.verify(1, secret, 'abcdef', now=now))
+        self.assertTrue(verifier.verify(1, secret, code(0), now=now))
+        self.assertFalse(verifier.verify(1, secret, code(0), now=now))
+        self.assertFalse(verifier.verify(1, secret, code(-1), now=now))
+        self.assertTrue(verifier.verify(1, secret, code(1), now=now))
+        # Other users are not affected
+        self.assertTrue(verifier.verify(2, secret, code(0), now=now))
+        self.assertEqual((verifier.accepted, verifier.replays), (3, 2))
+        self.assertGreater(verifier.code_hits, 0)
+        # Intervals that can no longer be submitted are dropped
+        self.assertTrue(verifier.verify(1, secret, code(10), now=now + 10 * totp.INTERVAL))
+        self.assertEqual(verifier.stats()['used'], 1)
+        # Only the codes of the new window up to the matching one are left
+        self.assertEqual(verifier.stats()['codes'], 2)
+
+    def test_totp_verifier_expiry(self):
+        """Tests that codes are dropped once their interval passes, whichever secret computed them first."""
+        verifier = totp.TOTPVerifier()
+        first = MFA(username='temp1234').mfa_secret
+        second = MFA(username='temp5678').mfa_secret
+        now = 1000000 * totp.INTERVAL + 5
+        verifier.verify(1, first, 'abcdef0', now=now)
+        self.assertEqual(verifier.stats()['codes'], 0)
+        verifier.verify(1, first, '000000', now=now)
+        verifier.verify(2, second, '000000', now=now)
+        self.assertEqual(verifier.stats()['codes'], 6)
+        # The first secret's codes are used again in the next interval, the second secret's earliest code has passed
+        verifier.verify(1, first, '000000', now=now + totp.INTERVAL)
+        self.assertEqual(verifier.stats()['codes'], 5)
+        verifier.verify(1, first, '000000', now=now + 10 * totp.INTERVAL)
+        self.assertEqual(verifier.stats()['codes'], 3)
+
+    def test_totp_leading_zero(self):
+        """Tests that a code with a leading zero is accepted as the string the form submits."""
+        verifier = totp.TOTPVerifier()
+        secret = MFA(username='temp1234').mfa_secret
+        now = 1000000 * totp.INTERVAL + 5
+        for offset in range(1000):
+            clock = now + offset * totp.INTERVAL
+            token = onetimepass.get_totp(secret, as_string=True, clock=clock).decode()
+            if token.startswith('0'):
+                break
+        self.assertTrue(token.startswith('0'))
+        self.assertFalse(verifier.verify(1, secret, token.lstrip('0'), now=clock))
+        self.assertTrue(verifier.verify(1, secret, token, now=clock))
+
 
 if __name__ == '__main__':
     unittest.main()
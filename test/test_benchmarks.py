@@ -0,0 +1,40 @@
+"""
+Tests the load test benchmark harness of the spellcheckapp.
+
+Runs a tiny benchmark so the harness keeps working as the app changes.
+"""
+import os
+import sys
+import unittest
+
+from benchmarks import run
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Groups benchmark harness tests."""
+
+    def test_percentile(self):
+        """Tests nearest-rank percentiles."""
+        values = list(range(1, 101))
+        self.assertEqual(run.percentile(values, 50), 50)
+        self.assertEqual(run.percentile(values, 95), 95)
+        self.assertEqual(run.percentile(values, 99), 99)
+        self.assertEqual(run.percentile([7], 99), 7)
+        self.assertIsNone(run.percentile([], 50))
+
+    def test_run_benchmark(self):
+        """Tests that every flow is driven without errors and reported per endpoint."""
+        results = run.run_benchmark(users=2, concurrency=2, spell_checks=2, history_reads=1, wordlist_size=200)
+        endpoints = results['endpoints']
+        self.assertEqual(sorted(endpoints), ['history', 'login', 'login_history', 'logout', 'register', 'spell_check'])
+        self.assertEqual(endpoints['spell_check']['requests'], 4)
+        self.assertEqual(endpoints['login_history']['requests'], 2)
+        self.assertEqual(results['overall']['errors'], 0)
+        for stats in endpoints.values():
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+        lines = run.compare(results, results)
+        self.assertTrue(any(line.startswith('spell_check') and line.endswith('+0.0%') for line in lines))
@@ -0,0 +1,809 @@
+"""
+Tests the spell check engines of the spellcheckapp.
+
+Engines are tested directly and through flask's test client.
+"""
+import datetime
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import app
+
+import bs4
+
+from spellcheckapp import db
+from spellcheckapp.auth.models import Users
+from spellcheckapp.spellcheck import bloom, cache, compiled, documents, engine, languages, pool, reloader, spellcheck, suggest
+from spellcheckapp.spellcheck.models import SpellCheckJob, SpellChecks
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+beautifulsoup = bs4.BeautifulSoup
+
+test_words = ['some', 'correct', 'words', 'incorrect', 'Paris']
+
+# Stand-in for a spell check executable that supports the worker pool line protocol.
+# The words 'hang' and 'crash' make the worker stop responding or exit.
+pool_worker_script = '''#!{python}
+import sys, time
+words = set(open(sys.argv[-1]).read().split())
+for line in sys.stdin:
+    if 'hang' in line.split():
+        time.sleep(30)
+    if 'crash' in line.split():
+        sys.exit(1)
+    for word in line.split():
+        if word not in words and word.lower() not in words:
+            sys.stdout.write(word + '\\n')
+    sys.stdout.write('\\n')
+    sys.stdout.flush()
+'''.format(python=sys.executable)
+
+# Stand-in for a spell check executable called as `<executable> <input file> <wordlist>`.
+executable_script = '''#!/bin/sh
+tr -s ' \\n' '\\n\\n' < "$1" | grep -vxF -f "$2"
+exit 0
+'''
+
+
+class TestEngine(unittest.TestCase):
+    """Groups engine tests to use the same wordlist and test client."""
+
+    def setUp(self):
+        """
+        Runs before each test.
+
+        Creates a temporary wordlist and a test flask client using the dictionary engine.
+        Creates temporary sqlite file.
+        """
+        wordlist_fd, wordlist_name = tempfile.mkstemp()
+        with os.fdopen(wordlist_fd, 'w') as wordlist:
+            wordlist.write('\n'.join(test_words) + '\n')
+        db_fd, database_name = tempfile.mkstemp()
+        test_config = {"SECRET_KEY": 'test',
+                       "TESTING": True,
+                       "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + database_name,
+                       "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                       "SPELLCHECK_ENGINE": 'dictionary',
+                       "SPELLCHECK_SUGGESTIONS": True,
+                       "SPELLCHECK_SUGGEST_WAIT": 10,
+                       "WORDLIST": wordlist_name}
+        base_app = app.create_app(test_config)
+        self.app = base_app.test_client()
+        self.db_fd = db_fd
+        self.database_name = database_name
+        self.wordlist_name = wordlist_name
+        self.base_app = base_app
+
+    def tearDown(self):
+        """Tears down the test client and removes the sqlite and wordlist files."""
+        os.close(self.db_fd)
+        os.unlink(self.database_name)
+        os.unlink(self.wordlist_name)
+
+    # Helper Funcs
+    def register_and_login(self, uname='temp1234', pword='temp1234'):
+        """Helper function to register and login a user, returns the spell_check page csrf token."""
+        response = self.app.get('/register', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.app.post('/register', data={"username": uname, "password": pword, "csrf_token": csrf_token}, follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        self.app.post('/login', data={"username": uname, "password": pword, "csrf_token": csrf_token}, follow_redirects=True)
+        response = self.app.get('/spell_check', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        return soup.find_all('input', id='csrf_token')[0]['value']
+
+    # Tests Start
+    def test_tokenize(self):
+        """Tests that words are split on whitespace and stripped of surrounding punctuation."""
+        self.assertEqual(list(engine.tokenize(" Hello, world!\n(it's) -- fine.")), ['Hello', 'world', "it's", 'fine'])
+
+    def test_find_misspelled(self):
+        """Tests that each distinct token is looked up once, and misspelled words are returned for every occurrence in order."""
+        class CountingWords(set):
+            lookups = 0
+
+            def __contains__(self, word):
+                CountingWords.lookups += 1
+                return super().__contains__(word)
+
+        words = CountingWords(test_words)
+        text = "wrods some wrods, -- Some SOME wrods Paris. flkfkef wrods"
+        self.assertEqual(engine.find_misspelled(text, words), ['wrods', 'wrods', 'wrods', 'flkfkef', 'wrods'])
+        self.assertEqual(engine.find_misspelled(text, words), [word for word in engine.tokenize(text) if word not in words and word.lower() not in words])
+        CountingWords.lookups = 0
+        engine.find_misspelled(text, words)
+        # wrods, 'wrods,' and flkfkef miss twice, Some and SOME hit on their lower case form, some and 'Paris.' hit straight away.
+        self.assertEqual(CountingWords.lookups, 12)
+        self.assertEqual(engine.find_misspelled("-- ... some", words), [])
+
+    def test_dictionary_engine_check(self):
+        """Tests that the dictionary engine returns only words missing from the wordlist."""
+        dictionary = engine.DictionaryEngine(self.wordlist_name)
+        self.assertEqual(dictionary.check("Some incorrect wrods, Paris paris flkfkef."), ['wrods', 'paris', 'flkfkef'])
+        self.assertEqual(dictionary.check("Some correct words"), [])
+
+    def test_dictionary_engine_loads_once(self):
+        """Tests that the dictionary engine keeps its wordlist after the first check."""
+        dictionary = engine.DictionaryEngine(self.wordlist_name)
+        words = dictionary.words()
+        os.unlink(self.wordlist_name)
+        open(self.wordlist_name, 'w').close()
+        self.assertIs(dictionary.words(), words)
+        self.assertEqual(dictionary.check("flkfkef words"), ['flkfkef'])
+
+    def test_dictionary_engine_missing_wordlist(self):
+        """Tests that a missing wordlist is reported as a SpellCheckError."""
+        dictionary = engine.DictionaryEngine(self.wordlist_name + '.missing')
+        with self.assertRaises(engine.SpellCheckError):
+            dictionary.check("some words")
+
+    def test_compiled_wordlist(self):
+        """Tests that a compiled wordlist holds exactly the words it was compiled from."""
+        compiled_name = self.wordlist_name + '.bin'
+        words = ['w%d' % i for i in range(1000)] + ['caf\u00e9', 'Paris']
+        try:
+            self.assertEqual(compiled.compile_wordlist(words + ['Paris'], compiled_name), len(words))
+            wordlist = compiled.CompiledWordlist(compiled_name)
+            self.assertEqual(len(wordlist), len(words))
+            self.assertTrue(all(word in wordlist for word in words))
+            self.assertFalse(any(word in wordlist for word in ['w1000', 'paris', 'caf', '', '\ud800']))
+            wordlist.close()
+            self.assertFalse(compiled.is_compiled(self.wordlist_name))
+            with self.assertRaises(ValueError):
+                compiled.CompiledWordlist(self.wordlist_name)
+        finally:
+            os.unlink(compiled_name)
+
+    def test_dictionary_engine_compiled_wordlist(self):
+        """Tests that the dictionary engine maps a wordlist compiled with the CLI and checks the same way."""
+        compiled_name = self.wordlist_name + '.bin'
+        result = self.base_app.test_cli_runner().invoke(args=['spellcheck', 'compile-wordlist', self.wordlist_name, compiled_name])
+        self.assertEqual(result.exit_code, 0)
+        try:
+            dictionary = engine.DictionaryEngine(compiled_name)
+            self.assertEqual(dictionary.check("Some incorrect wrods, Paris paris flkfkef."), ['wrods', 'paris', 'flkfkef'])
+            self.assertEqual(dictionary.stats(), {'engine': 'dictionary', 'words': len(test_words), 'compiled': True, 'reloads': 0})
+            dictionary.close()
+        finally:
+            os.unlink(compiled_name)
+
+    def test_bloom_filter(self):
+        """Tests that a Bloom filter holds every word it was built from and rejects about fp_rate of other words."""
+        words = ['w%d' % i for i in range(10000)]
+        prefilter = bloom.BloomFilter.from_words(words, 0.01)
+        self.assertTrue(all(word in prefilter for word in words))
+        false_positives = sum(('x%d' % i) in prefilter for i in range(10000))
+        self.assertLess(false_positives, 300)
+        with self.assertRaises(ValueError):
+            bloom.optimal_size(10, 0)
+
+    def test_dictionary_engine_bloom(self):
+        """Tests that the Bloom prefilter, built in process or stored in a compiled wordlist, does not change results."""
+        compiled_name = self.wordlist_name + '.bin'
+        compiled.compile_wordlist(test_words, compiled_name, bloom_fp_rate=0.01)
+        try:
+            for wordlist_name in (self.wordlist_name, compiled_name):
+                dictionary = engine.DictionaryEngine(wordlist_name, bloom_fp_rate=0.01)
+                self.assertEqual(dictionary.check("Some incorrect wrods, Paris paris flkfkef."), ['wrods', 'paris', 'flkfkef'])
+                stats = dictionary.stats()['bloom']
+                self.assertEqual(stats['rejected'] + stats['confirmed'], 10)
+                self.assertGreaterEqual(stats['rejected'], 4)
+                dictionary.close()
+            self.assertIsNotNone(compiled.CompiledWordlist(compiled_name).bloom())
+        finally:
+            os.unlink(compiled_name)
+
+    def test_edit_distance(self):
+        """Tests edit distances, including transpositions and the max_distance cut off."""
+        self.assertEqual(suggest.edit_distance('words', 'words', 2), 0)
+        self.assertEqual(suggest.edit_distance('wrods', 'words', 2), 1)
+        self.assertEqual(suggest.edit_distance('wods', 'words', 2), 1)
+        self.assertEqual(suggest.edit_distance('wordss', 'words', 2), 1)
+        self.assertEqual(suggest.edit_distance('wards', 'words', 2), 1)
+        self.assertEqual(suggest.edit_distance('wrdsx', 'words', 2), 2)
+        self.assertEqual(suggest.edit_distance('flkfkef', 'words', 2), 3)
+
+    def test_symspell_index(self):
+        """Tests that suggestions are ranked by edit distance and keep the dictionary's spelling."""
+        index = suggest.SymSpellIndex(test_words + ['sword', 'wordy', 'paris'])
+        self.assertEqual(index.lookup('wrods'), ['words', 'wordy'])
+        self.assertEqual(index.lookup('wordd'), ['words', 'wordy', 'sword'])
+        self.assertEqual(index.lookup('PARIS'), ['Paris', 'paris'])
+        self.assertEqual(index.lookup('incorect'), ['incorrect'])
+        self.assertEqual(index.lookup('wrods', max_suggestions=1), ['words'])
+        self.assertEqual(index.lookup('flkfkef'), [])
+
+    def test_suggester_background_build(self):
+        """Tests that suggestions are off by default, and that the index is built without blocking lookups."""
+        self.assertIsNone(suggest.create_suggester({}, self.wordlist_name))
+        suggester = suggest.create_suggester({'SPELLCHECK_SUGGESTIONS': True}, self.wordlist_name)
+        build = suggester._build
+
+        def slow_build():
+            time.sleep(0.5)
+            return build()
+
+        with unittest.mock.patch.object(suggester, '_build', slow_build):
+            started = time.monotonic()
+            self.assertEqual(suggester.suggest(['wrods']), [])
+            self.assertLess(time.monotonic() - started, 0.4)
+            self.assertTrue(suggester.stats()['building'])
+            self.assertIsNotNone(suggester.index(wait=10))
+        self.assertEqual(suggester.suggest(['wrods']), [('wrods', ['words'])])
+        self.assertEqual((suggester.skipped, suggester.lookups), (1, 1))
+        suggester = suggest.create_suggester({'SPELLCHECK_SUGGESTIONS': True}, self.wordlist_name + '.missing')
+        self.assertIsNone(suggester.index(wait=10))
+        self.assertIsNotNone(suggester.stats()['error'])
+
+    def test_create_engine(self):
+        """Tests that SPELLCHECK_ENGINE selects the engine implementation."""
+        config = {"SPELLCHECK": './spell_check.out', "WORDLIST": self.wordlist_name}
+        self.assertIsInstance(engine.create_engine(dict(config, SPELLCHECK_ENGINE='dictionary')), engine.DictionaryEngine)
+        self.assertIsInstance(engine.create_engine(dict(config, SPELLCHECK_ENGINE='executable')), engine.ExecutableEngine)
+        with self.assertRaises(ValueError):
+            engine.create_engine(dict(config, SPELLCHECK_ENGINE='unknown'))
+
+    def test_executable_engine_timeout(self):
+        """Tests that an executable that does not finish in time is reported as a SpellCheckError."""
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as script:
+            script.write('#!/bin/sh\nsleep 5\n')
+        os.chmod(script.name, 0o700)
+        try:
+            executable = engine.ExecutableEngine(script.name, self.wordlist_name, timeout=0.2)
+            with self.assertRaises(engine.SpellCheckError):
+                executable.check("some words")
+        finally:
+            os.unlink(script.name)
+
+    def test_executable_engine_io_modes(self):
+        """Tests that the executable engine gives the same results with temporary files, stdin and /dev/fd pipes."""
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as script:
+            script.write(executable_script)
+        os.chmod(script.name, 0o700)
+        try:
+            for io_mode in engine.ExecutableEngine.io_modes:
+                executable = engine.ExecutableEngine(script.name, self.wordlist_name, timeout=5, io_mode=io_mode)
+                self.assertEqual(executable.check("some wrods\nincorrect flkfkef"), ['wrods', 'flkfkef'], io_mode)
+                self.assertEqual(executable.check("some correct words"), [], io_mode)
+            executable = engine.ExecutableEngine(script.name, self.wordlist_name, timeout=5, io_mode='stdin')
+            chunks = [b'wro', b'ds some ', b'flkfkef']
+            self.assertEqual(list(executable.iter_check(chunks)), ['wrods', 'flkfkef'])
+            with self.assertRaises(ValueError):
+                engine.ExecutableEngine(script.name, self.wordlist_name, io_mode='unknown')
+        finally:
+            os.unlink(script.name)
+
+    def test_executable_engine_check_many(self):
+        """Tests that each text of a batch gets the same result as when checked alone, whatever words the executable splits on."""
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as script:
+            # Also splits on hyphens, which tokenize does not
+            script.write(executable_script.replace("' \\n' '\\n\\n'", "' \\n-' '\\n\\n\\n'"))
+        os.chmod(script.name, 0o700)
+        try:
+            executable = engine.ExecutableEngine(script.name, self.wordlist_name, timeout=5, io_mode='stdin')
+            texts = ["some wrods", "correct words", "wrods-some correct"]
+            self.assertEqual(executable.check_many(texts), [['wrods'], [], ['wrods']])
+            self.assertEqual(executable.check_many(texts), [executable.check(text) for text in texts])
+        finally:
+            os.unlink(script.name)
+
+    def test_executable_engine_missing_executable(self):
+        """Tests that a missing executable is reported as a SpellCheckError in every I/O mode, without leaking file descriptors."""
+        for io_mode in engine.ExecutableEngine.io_modes:
+            executable = engine.ExecutableEngine(self.wordlist_name + '.missing', self.wordlist_name, timeout=5, io_mode=io_mode)
+            open_fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+            for _ in range(5):
+                with self.assertRaises(engine.SpellCheckError):
+                    executable.check("some wrods")
+            if open_fds is not None:
+                self.assertEqual(len(os.listdir('/proc/self/fd')), open_fds, io_mode)
+
+    def test_executable_engine_pipe_timeout(self):
+        """Tests that the pipe modes also enforce the timeout."""
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as script:
+            script.write('#!/bin/sh\nsleep 5\n')
+        os.chmod(script.name, 0o700)
+        try:
+            executable = engine.ExecutableEngine(script.name, self.wordlist_name, timeout=0.2, io_mode='devfd')
+            with self.assertRaises(engine.SpellCheckError):
+                executable.check("some words")
+        finally:
+            os.unlink(script.name)
+
+    def test_worker_pool(self):
+        """Tests that pooled workers are reused, restarted after crashes and timeouts, and reject work when busy."""
+        with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as script:
+            script.write(pool_worker_script)
+        os.chmod(script.name, 0o700)
+        worker_pool = pool.WorkerPool([script.name, self.wordlist_name], size=1, timeout=2, acquire_timeout=0.1)
+        try:
+            self.assertEqual(worker_pool.check("some wrods"), ['wrods'])
+            self.assertEqual(worker_pool.check("some\ncorrect words"), [])
+            self.assertEqual(worker_pool.stats()['workers'], 1)
+            self.assertEqual(worker_pool._workers[0].requests, 2)
+            with self.assertRaises(engine.SpellCheckError):
+                worker_pool.check("crash")
+            self.assertEqual(worker_pool.check("flkfkef"), ['flkfkef'])
+            worker_pool.timeout = 0.2
+            with self.assertRaises(engine.SpellCheckError):
+                worker_pool.check("hang")
+            self.assertEqual(worker_pool.stats()['restarts'], 2)
+            worker_pool._slots.acquire()
+            with self.assertRaises(pool.PoolBusyError):
+                worker_pool.check("some words")
+            self.assertEqual(worker_pool.stats()['rejected'], 1)
+            worker_pool._slots.release()
+            worker = worker_pool._workers[0]
+            worker_pool.recycle()
+            self.assertEqual(worker_pool.check("some words"), [])
+            self.assertEqual(worker_pool._workers[0].generation, 1)
+            self.assertFalse(worker.alive())
+            # A worker that cannot be restarted after a crash is not handed out again, the next request starts a new one.
+            os.chmod(script.name, 0o600)
+            with self.assertRaises(engine.SpellCheckError):
+                worker_pool.check("crash")
+            self.assertEqual(worker_pool.stats()['idle'], 0)
+            os.chmod(script.name, 0o700)
+            self.assertEqual(worker_pool.check("flkfkef"), ['flkfkef'])
+        finally:
+            worker_pool.close()
+            os.unlink(script.name)
+
+    def test_local_cache_eviction(self):
+        """Tests that the local cache evicts least recently used entries once over its memory cap."""
+        local = cache.LocalCache(max_bytes=3 * cache.entry_size('k0', ['word']))
+        for i in range(3):
+            local.set('k%d' % i, ['word'])
+        self.assertEqual(local.get('k0'), ['word'])
+        local.set('k3', ['word'])
+        self.assertIsNone(local.get('k1'))
+        self.assertEqual(local.get('k0'), ['word'])
+        self.assertEqual(local.evictions, 1)
+        self.assertLessEqual(local.size, local.max_bytes)
+
+    def test_caching_engine(self):
+        """Tests that repeated submissions are served from the cache and that a new wordlist invalidates them."""
+        dictionary = engine.DictionaryEngine(self.wordlist_name)
+        caching = cache.CachingEngine(dictionary, cache.ResultCache(cache.LocalCache(1024 * 1024)))
+        self.assertEqual(caching.check("some wrods"), ['wrods'])
+        self.assertEqual(caching.check("  some\nwrods "), ['wrods'])
+        self.assertEqual(caching.check_many(["some wrods", "flkfkef"]), [['wrods'], ['flkfkef']])
+        self.assertEqual(caching.stats()['cache']['hits'], 2)
+        self.assertEqual(caching.stats()['cache']['misses'], 2)
+        self.assertNotEqual(cache.cache_key("some wrods", dictionary.fingerprint()), cache.cache_key("some wrods", 'other wordlist'))
+
+    def test_dictionary_engine_reload(self):
+        """Tests that a reload swaps in the new wordlist and fingerprint, cached results for the old one are not served."""
+        dictionary = engine.DictionaryEngine(self.wordlist_name)
+        caching = cache.CachingEngine(dictionary, cache.ResultCache(cache.LocalCache(1024 * 1024)))
+        self.assertEqual(caching.check("some flkfkef"), ['flkfkef'])
+        old_snapshot = dictionary.snapshot()
+        with open(self.wordlist_name, 'a') as wordlist:
+            wordlist.write('flkfkef\n')
+        self.assertEqual(caching.check("some flkfkef"), ['flkfkef'])
+        build_seconds, swap_seconds = caching.reload()
+        self.assertGreaterEqual(build_seconds, 0)
+        self.assertLess(swap_seconds, 1)
+        self.assertNotEqual(dictionary.fingerprint(), old_snapshot.fingerprint)
+        self.assertEqual(caching.check("some flkfkef"), [])
+        self.assertNotIn('flkfkef', old_snapshot.words)
+        self.assertEqual(dictionary.stats()['reloads'], 1)
+
+    def test_reload_wordlist_api(self):
+        """Tests that only admins can reload the wordlist, with a JSON request, and that suggestions follow the new wordlist."""
+        self.register_and_login()
+        response = self.app.post('/api/admin/reload_wordlist', json={})
+        self.assertEqual(response.status_code, 403)
+        self.app.get('/logout')
+        self.register_and_login(uname='replaceme', pword='replaceme')
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["flkfkef wrods"]})
+        self.assertEqual(response.get_json()['results'][0]['suggestions'], {'flkfkef': [], 'wrods': ['words']})
+        with open(self.wordlist_name, 'a') as wordlist:
+            wordlist.write('flkfkef\nflkfkeg\n')
+        response = self.app.post('/api/admin/reload_wordlist', data='{}')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/api/admin/reload_wordlist', json={})
+        self.assertEqual(response.status_code, 202)
+        reload_lock = self.base_app.extensions['wordlist_reloader']._running
+        self.assertTrue(reload_lock.acquire(timeout=5))
+        reload_lock.release()
+        self.assertEqual(self.base_app.extensions['wordlist_reloader'].stats()['reloads'], 1)
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["flkfkef flkfkeh"]})
+        self.assertEqual(response.get_json()['results'][0], {'textout': "flkfkef flkfkeh", 'misspelled': ['flkfkeh'],
+                                                             'suggestions': {'flkfkeh': ['flkfkef', 'flkfkeg']}})
+
+    def test_wordlist_watcher(self):
+        """Tests that the watcher reloads the wordlist once the file changes."""
+        watcher = reloader.WordlistReloader(self.base_app, interval=0.05)
+        dictionary = self.base_app.extensions['spellcheck_dictionaries'].get().engine.engine
+        self.assertEqual(dictionary.check("flkfkef"), ['flkfkef'])
+        watcher.ensure_watching()
+        try:
+            with open(self.wordlist_name, 'a') as wordlist:
+                wordlist.write('flkfkef\n')
+            deadline = time.monotonic() + 5
+            while watcher.reloads == 0 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            watcher.close()
+        self.assertEqual(watcher.reloads, 1)
+        self.assertEqual(dictionary.check("flkfkef"), [])
+
+    def test_database_cache_shared(self):
+        """Tests that entries stored through one replica's cache are found by another replica's cache."""
+        with self.base_app.app_context():
+            replica_one = cache.ResultCache(cache.LocalCache(1024), cache.DatabaseCache())
+            replica_two = cache.ResultCache(cache.LocalCache(1024), cache.DatabaseCache())
+            key = cache.cache_key("some wrods", 'fingerprint')
+            self.assertIsNone(replica_two.get(key))
+            replica_one.set(key, ['wrods'])
+            self.assertEqual(replica_two.get(key), ['wrods'])
+            self.assertEqual(replica_two.shared_hits, 1)
+            self.assertEqual(replica_two.local.get(key), ['wrods'])
+
+    def test_metrics(self):
+        """Tests that engine and cache counters are exposed on /metrics only when enabled."""
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+        self.base_app.config['METRICS_ENABLED'] = True
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['spellcheck']['languages'], {})
+        self.base_app.extensions['spellcheck_dictionaries'].get()
+        response = self.app.get('/metrics')
+        self.assertEqual(response.get_json()['spellcheck']['languages']['en']['engine']['engine'], 'dictionary')
+        self.assertIn('hits', response.get_json()['spellcheck']['languages']['en']['engine']['cache'])
+
+    def test_spell_check_dictionary_engine(self):
+        """Tests that spell check submissions are checked in process when the dictionary engine is configured."""
+        csrf_token = self.register_and_login()
+        response = self.app.post('/spell_check', data={"inputtext": "Some incorrect wrods flkfkef", "csrf_token": csrf_token}, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        soup = beautifulsoup(response.data, 'html.parser')
+        results = soup.find('p', id="misspelled")
+        self.assertEqual(results.text, "wrods, flkfkef")
+        suggestions = soup.find('ul', id="suggestions").find_all('li')
+        self.assertEqual([li.text for li in suggestions], ["wrods: words", "flkfkef: No suggestions"])
+        with self.base_app.app_context():
+            queryid = SpellChecks.query.filter_by(username='temp1234').first().id
+        response = self.app.get('/history/query%d' % queryid)
+        soup = beautifulsoup(response.data, 'html.parser')
+        suggestions = soup.find('td', id="querysuggestions").find_all('p')
+        self.assertEqual([p.text for p in suggestions], ["wrods: words", "flkfkef: No suggestions"])
+
+    def test_spell_check_batch(self):
+        """Tests that the batch API checks every text and stores them all as query history."""
+        self.register_and_login()
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["Some incorrect wrods", "some correct words", "flkfkef"]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([result['misspelled'] for result in results], [['wrods'], [], ['flkfkef']])
+        self.assertEqual([result['suggestions'] for result in results], [{'wrods': ['words']}, {}, {'flkfkef': []}])
+        with self.base_app.app_context():
+            stored = SpellChecks.query.filter_by(username='temp1234').order_by(SpellChecks.id).all()
+            self.assertEqual(len(stored), 3)
+            self.assertEqual(stored[0].misspelled_words, 'wrods')
+            self.assertEqual(stored[1].misspelled_words, "No misspelled words were found.")
+            self.assertEqual(stored[0].suggestion_list(), [('wrods', ['words'])])
+            self.assertEqual(stored[1].suggestion_list(), [])
+
+    def test_spell_check_batch_validation(self):
+        """Tests that the batch API requires a login and rejects malformed batches."""
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["some words"]})
+        self.assertEqual(response.status_code, 401)
+        self.register_and_login()
+        for data in ({}, {"texts": []}, {"texts": "some words"}, {"texts": ["some", ""]}, {"texts": ["a" * 501]}, {"texts": ["a"] * 101}):
+            response = self.app.post('/api/spell_check/batch', json=data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('error', response.get_json())
+        response = self.app.post('/api/spell_check/batch', data={"texts": "some words"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_dictionary_registry(self):
+        """Tests that dictionaries are created on first use and the least recently used ones are dropped once over the memory budget."""
+        created = []
+
+        def create_dictionary(language, wordlist):
+            created.append(language)
+            return languages.Dictionary(language, engine.DictionaryEngine(wordlist))
+
+        registry = languages.DictionaryRegistry({'en': self.wordlist_name, 'fr': self.wordlist_name, 'de': self.wordlist_name}, 'en',
+                                                create_dictionary, max_bytes=1)
+        self.assertEqual(registry.languages(), ['en', 'de', 'fr'])
+        self.assertEqual(created, [])
+        self.assertIs(registry.get(), registry.get('en'))
+        with self.assertRaises(languages.UnknownLanguageError):
+            registry.get('xx')
+        registry.get('en').engine.check("some words")
+        registry.get('fr').engine.check("some words")
+        self.assertEqual([dictionary.language for dictionary in registry.loaded()], ['fr'])
+        registry.get('de')
+        self.assertEqual([dictionary.language for dictionary in registry.loaded()], ['de'])
+        registry.get('en')
+        self.assertEqual([dictionary.language for dictionary in registry.loaded()], ['de', 'en'])
+        self.assertEqual(created, ['en', 'fr', 'de', 'en'])
+        self.assertEqual(registry.stats()['evictions'], 2)
+        self.assertEqual(registry.stats()['loads'], 4)
+        registry.max_bytes = None
+        registry.get('de').engine.check("some words")
+        registry.get('fr').engine.check("some words")
+        self.assertEqual([dictionary.language for dictionary in registry.loaded()], ['en', 'de', 'fr'])
+
+    def test_spell_check_languages(self):
+        """Tests that the selected language's wordlist is used and stored with the query."""
+        wordlist_fd, wordlist_name = tempfile.mkstemp()
+        with os.fdopen(wordlist_fd, 'w') as wordlist:
+            wordlist.write('quelques\nmots\n')
+        self.base_app.extensions['spellcheck_dictionaries'].wordlists['fr'] = wordlist_name
+        try:
+            csrf_token = self.register_and_login()
+            response = self.app.get('/spell_check')
+            soup = beautifulsoup(response.data, 'html.parser')
+            self.assertEqual([option['value'] for option in soup.find('select', id="language").find_all('option')], ['en', 'fr'])
+            response = self.app.post('/spell_check', data={"inputtext": "quelques mots words", "language": "fr", "csrf_token": csrf_token})
+            soup = beautifulsoup(response.data, 'html.parser')
+            self.assertEqual(soup.find('p', id="misspelled").text, "words")
+            response = self.app.post('/api/spell_check/batch', json={"texts": ["quelques mots words"]})
+            self.assertEqual(response.get_json()['language'], 'en')
+            self.assertEqual(response.get_json()['results'][0]['misspelled'], ['quelques', 'mots'])
+            response = self.app.post('/api/spell_check/batch', json={"texts": ["quelques mots"], "language": "fr"})
+            self.assertEqual(response.get_json()['results'][0]['misspelled'], [])
+            response = self.app.post('/api/spell_check/batch', json={"texts": ["quelques mots"], "language": "xx"})
+            self.assertEqual(response.status_code, 400)
+            with self.base_app.app_context():
+                stored = SpellChecks.query.filter_by(username='temp1234').order_by(SpellChecks.id).all()
+                self.assertEqual([spell_check.language for spell_check in stored], ['fr', 'en', 'fr'])
+            response = self.app.get('/history/query%d' % stored[0].id)
+            soup = beautifulsoup(response.data, 'html.parser')
+            self.assertEqual(soup.find('td', id="querylanguage").text, "fr")
+        finally:
+            os.unlink(wordlist_name)
+
+    def test_spell_check_jobs(self):
+        """Tests that a job is accepted right away, checked in the background and its results retrieved by polling."""
+        response = self.app.post('/api/spell_check/jobs', json={"texts": ["some wrods"]})
+        self.assertEqual(response.status_code, 401)
+        self.register_and_login()
+        response = self.app.post('/api/spell_check/jobs', json={"texts": []})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/api/spell_check/jobs', json={"texts": ["Some incorrect wrods", "flkfkef"]})
+        self.assertEqual(response.status_code, 202)
+        job = response.get_json()
+        self.assertIn(job['status'], ('pending', 'running', 'done'))
+        self.assertTrue(response.headers['Location'].endswith(job['url']))
+        deadline = time.monotonic() + 5
+        while job['status'] != 'done' and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = self.app.get('/api/spell_check/jobs/%s' % job['job']).get_json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['results'], [{'textout': "Some incorrect wrods", 'misspelled': ['wrods'], 'suggestions': {'wrods': ['words']}},
+                                          {'textout': 'flkfkef', 'misspelled': ['flkfkef'], 'suggestions': {'flkfkef': []}}])
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.filter_by(username='temp1234').count(), 2)
+        runner = self.base_app.extensions['spellcheck_jobs']
+        self.assertEqual(runner.stats()['completed'], 1)
+        self.assertEqual(runner.stats()['depth'], 0)
+        runner.max_pending = 0
+        response = self.app.post('/api/spell_check/jobs', json={"texts": ["some words"]})
+        self.assertEqual(response.status_code, 503)
+        self.app.get('/logout')
+        self.register_and_login(uname='temp5678')
+        self.assertEqual(self.app.get('/api/spell_check/jobs/%s' % job['job']).status_code, 404)
+
+    def test_prune_jobs(self):
+        """Tests that jobs that finished before the retention period, or were lost long ago, are deleted on submission and by the CLI."""
+        self.register_and_login()
+        now = datetime.datetime.now()
+        runner = self.base_app.extensions['spellcheck_jobs']
+        with self.base_app.app_context():
+            for job_id, created, finished in (('old', 48, 47), ('recent', 2, 1), ('lost', 48, None), ('running', 0, None)):
+                db.session.add(SpellCheckJob(id=job_id, username='temp1234', status='done' if finished else 'running', texts='[]',
+                                             created=now - datetime.timedelta(hours=created),
+                                             finished=now - datetime.timedelta(hours=finished) if finished else None))
+            db.session.commit()
+        runner.prune_every = 1
+        response = self.app.post('/api/spell_check/jobs', json={"texts": ["some words"]})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(runner.stats()['pruned'], 2)
+        with self.base_app.app_context():
+            self.assertEqual(SpellCheckJob.query.filter(SpellCheckJob.id.in_(['old', 'recent', 'lost', 'running'])).count(), 2)
+        result = self.base_app.test_cli_runner().invoke(args=['spellcheck', 'prune-jobs', '--hours', '0.5'])
+        self.assertIn('Deleted 1 spell check jobs.', result.output)
+        with self.base_app.app_context():
+            self.assertIsNone(SpellCheckJob.query.get('recent'))
+            self.assertIsNotNone(SpellCheckJob.query.get('running'))
+
+    def test_iter_chunks(self):
+        """Tests that documents are read in chunks cut at whitespace, splitting neither multi-byte characters nor words shorter than a chunk."""
+        text = 'some wrods ' * 10 + 'Paris\u00e9 ' + 'x' * 40
+        chunks = list(documents.iter_chunks(io.BytesIO(text.encode('utf-8')), chunk_size=16))
+        self.assertEqual(''.join(chunks), text)
+        self.assertTrue(all(chunk.endswith(' ') for chunk in chunks if 'x' not in chunk))
+        self.assertTrue(all(len(chunk) < 32 for chunk in chunks))
+        # Long words are split before the chunk holding them reaches twice the chunk size
+        text = 'ab ' + 'x' * 31 + ' ' + 'y' * 100
+        chunks = list(documents.iter_chunks(io.BytesIO(text.encode('utf-8')), chunk_size=16))
+        self.assertEqual(''.join(chunks), text)
+        self.assertTrue(all(len(chunk) < 32 for chunk in chunks))
+        with self.assertRaises(documents.DocumentTooLargeError):
+            list(documents.iter_chunks(io.BytesIO(text.encode('utf-8')), chunk_size=16, max_bytes=100))
+
+    def test_spell_check_document(self):
+        """Tests that a large document is checked in chunks, results are streamed as NDJSON and the text is stored compressed."""
+        self.base_app.config['DOCUMENT_CHUNK_SIZE'] = 64
+        self.base_app.config['DOCUMENT_MAX_BYTES'] = 4096
+        document = ('some correct words ' * 20 + 'wrods flkfkef\n') * 5
+        response = self.app.post('/api/spell_check/document', data=document, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 401)
+        self.register_and_login()
+        response = self.app.post('/api/spell_check/document', data=document, content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/api/spell_check/document', data='a' * 4097, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 413)
+        result_cache = self.base_app.extensions['spellcheck_dictionaries'].get().engine.cache
+        response = self.app.post('/api/spell_check/document', data=document, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        # Chunks are not cached
+        self.assertEqual((result_cache.misses, len(result_cache.local)), (0, 0))
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(lines[-1]['done'], True)
+        self.assertEqual(lines[-1]['size'], len(document))
+        self.assertEqual(lines[-1]['misspelled'], 10)
+        self.assertEqual([word for line in lines[:-1] for word in line['misspelled']], ['wrods', 'flkfkef'] * 5)
+        for line in lines[:-1]:
+            self.assertTrue(document[line['offset'] - 1].isspace())
+            self.assertIn(line['misspelled'][0], document[line['offset']:line['offset'] + 128].split())
+        self.assertIn({'wrods': ['words'], 'flkfkef': []}, [line['suggestions'] for line in lines[:-1]])
+        with self.base_app.app_context():
+            stored = SpellChecks.query.get(lines[-1]['query'])
+            self.assertEqual(stored.misspelled_words, 'wrods, flkfkef')
+            self.assertEqual(stored.document_size, len(document))
+            self.assertEqual(stored.submitted_text, document[:500])
+            self.assertEqual(Users.query.filter_by(username='temp1234').first().spell_check_count, 1)
+        response = self.app.get('/history/query%d' % lines[-1]['query'])
+        soup = beautifulsoup(response.data, 'html.parser')
+        response = self.app.get(soup.find('a', id="querydocument")['href'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.decode(), document)
+        self.assertEqual(self.app.get('/history/query%d/document' % (lines[-1]['query'] + 1)).status_code, 404)
+
+    def test_history_pagination(self):
+        """Tests that history is paginated by query ID and that the total covers every page."""
+        self.register_and_login()
+        self.base_app.config['HISTORY_PAGE_SIZE'] = 2
+        self.app.post('/api/spell_check/batch', json={"texts": ["some", "wrods", "flkfkef", "words", "correct"]})
+        seen = []
+        url = '/history'
+        while url:
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            soup = beautifulsoup(response.data, 'html.parser')
+            self.assertEqual(soup.find('h3', id="numqueries").text, "5")
+            links = soup.find('div', id="queryhistory").find_all('a')
+            self.assertLessEqual(len(links), 2)
+            seen.extend(link.text for link in links)
+            nextpage = soup.find('a', id="nextpage")
+            url = nextpage['href'] if nextpage else None
+        self.assertEqual(seen, ["Query %d" % i for i in range(1, 6)])
+        response = self.app.get('/history?after=5')
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertEqual(soup.find('h3', id="numqueries").text, "5")
+        self.assertIsNone(soup.find('div', id="queryhistory"))
+
+    def test_unquote_history(self):
+        """Tests that texts are checked and stored as submitted, and that texts stored shell quoted are unquoted."""
+        self.register_and_login()
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["it's some wrods", "some words"]})
+        self.assertEqual([result['textout'] for result in response.get_json()['results']], ["it's some wrods", "some words"])
+        old_texts = ["'it'\"'\"'s some wrods'", "some", "'some words'", "'two  spaces'"]
+        with self.base_app.app_context():
+            spellcheck.store_spell_checks('temp1234', [spellcheck.spell_check_row(text, [], [], 'en') for text in old_texts])
+            db.session.commit()
+        result = self.base_app.test_cli_runner().invoke(args=['spellcheck', 'unquote-history', '--up-to', '5', '--batch-size', '2'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Unquoted 2 spell check texts.', result.output)
+        with self.base_app.app_context():
+            stored = [spell_check.submitted_text for spell_check in SpellChecks.query.order_by(SpellChecks.id)]
+        self.assertEqual(stored, ["it's some wrods", "some words", "it's some wrods", "some", "some words", "'two  spaces'"])
+
+    def test_spell_check_counters(self):
+        """Tests that each user's spell check counter follows their submissions and can be rebuilt."""
+        csrf_token = self.register_and_login()
+        self.app.post('/spell_check', data={"inputtext": "wrods", "csrf_token": csrf_token}, follow_redirects=True)
+        self.app.post('/api/spell_check/batch', json={"texts": ["some", "wrods"]})
+        with self.base_app.app_context():
+            user = Users.query.filter_by(username='temp1234').first()
+            self.assertEqual(user.spell_check_count, 3)
+            user.spell_check_count = 42
+            db.session.commit()
+        result = self.base_app.test_cli_runner().invoke(args=['spellcheck', 'rebuild-counters'])
+        self.assertEqual(result.exit_code, 0)
+        with self.base_app.app_context():
+            self.assertEqual(Users.query.filter_by(username='temp1234').first().spell_check_count, 3)
+            self.assertEqual(Users.query.filter_by(username='replaceme').first().spell_check_count, 0)
+
+    def test_static_fingerprint(self):
+        """Tests that static URLs carry a content hash and that the current version of a static file is cached as immutable."""
+        response = self.app.get('/login')
+        href = beautifulsoup(response.data, 'html.parser').find('link', rel='stylesheet')['href']
+        self.assertRegex(href, r'^/static/style\.css\?v=[0-9a-f]{12}$')
+        response = self.app.get(href)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        response.close()
+        response = self.app.get('/static/style.css?v=000000000000')
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def test_compression(self):
+        """Tests that large responses are gzip compressed for clients that accept it, and small ones are not."""
+        self.register_and_login()
+        texts = ["some wrods %d" % i for i in range(50)]
+        response = self.app.post('/api/spell_check/batch', json={"texts": texts}, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        results = json.loads(gzip.decompress(response.data))['results']
+        self.assertEqual([result['textout'] for result in results], texts)
+        response = self.app.post('/api/spell_check/batch', json={"texts": texts})
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["some"]}, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.base_app.config['METRICS_ENABLED'] = True
+        self.assertEqual(self.app.get('/metrics').get_json()['compression']['compressed'], 1)
+        # Static files are compressed
+        href = beautifulsoup(self.app.get('/history').data, 'html.parser').find('link', rel='stylesheet')['href']
+        response = self.app.get(href, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        with open(os.path.join(self.base_app.static_folder, 'style.css'), 'rb') as stylesheet:
+            self.assertEqual(gzip.decompress(response.data), stylesheet.read())
+
+    def test_compression_html(self):
+        """Tests that HTML is not compressed by default, and that pages holding a CSRF token are never compressed."""
+        csrf_token = self.register_and_login()
+        inputtext = "some wrods " * 100
+        response = self.app.post('/spell_check', data={"inputtext": inputtext, "csrf_token": csrf_token}, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        compressor = self.base_app.extensions['compression']
+        compressor.mimetypes += ('text/html',)
+        compressor.min_size = 0
+        response = self.app.post('/spell_check', data={"inputtext": inputtext, "csrf_token": csrf_token}, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn(inputtext.strip(), response.data.decode())
+        # Pages without a form may be compressed once HTML is enabled
+        response = self.app.get('/history/query1', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_history_etags(self):
+        """Tests that unchanged history and query pages are answered with 304 Not Modified, and changed ones are rendered again."""
+        self.register_and_login()
+        self.app.post('/api/spell_check/batch', json={"texts": ["some wrods"]})
+        for url in ('/history', '/history/query1'):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            tag = response.headers['ETag']
+            self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+            response = self.app.get(url, headers={'If-None-Match': tag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], tag)
+            self.assertEqual(response.headers['X-Frame-Options'], 'SAMEORIGIN')
+        tag = self.app.get('/history').headers['ETag']
+        self.app.post('/api/spell_check/batch', json={"texts": ["words"]})
+        response = self.app.get('/history', headers={'If-None-Match': tag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], tag)
+        self.assertEqual(beautifulsoup(response.data, 'html.parser').find('h3', id="numqueries").text, "2")
@@ -265,7 +265,7 @@ class TestAuth(unittest.TestCase):
         self.assertTrue(subproc.called)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('p', id="textout")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('p', id="misspelled")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Did not return expected amount of misspelled words")
@@ -313,7 +313,7 @@ class TestAuth(unittest.TestCase):
         self.assertTrue(subproc.called)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('p', id="textout")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('p', id="misspelled")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Did not return expected amount of misspelled words")
@@ -369,7 +369,7 @@ class TestAuth(unittest.TestCase):
         self.assertTrue(subproc.called)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('p', id="textout")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('p', id="misspelled")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Did not return expected amount of misspelled words")
@@ -445,7 +445,7 @@ class TestAuth(unittest.TestCase):
         self.assertTrue(subproc.called)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('p', id="textout")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('p', id="misspelled")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Did not return expected amount of misspelled words")
@@ -465,7 +465,7 @@ class TestAuth(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('td', id="querytext")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('td', id="queryresults")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Query result page did not store expected amount of misspelled words")
@@ -548,7 +548,7 @@ class TestAuth(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         soup = beautifulsoup(response.data, 'html.parser')
         results = soup.find('p', id="textout")
-        self.assertEqual(inputtext, results.text.replace("'", ''))
+        self.assertEqual(inputtext, results.text)
         results = soup.find('p', id="misspelled")
         misspelled_words_out = results.text.split(", ")
         self.assertEqual(len(misspelled_words_out), 2, "Did not return expected amount of misspelled words")
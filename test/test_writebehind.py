@@ -0,0 +1,194 @@
+"""
+Tests the write-behind queue of the spellcheckapp.
+
+Makes use of flask's test client to perform integration tests.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import app
+
+import bs4
+
+from spellcheckapp import writebehind
+from spellcheckapp.auth.models import AuthLog, Users
+from spellcheckapp.spellcheck.models import SpellChecks
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+beautifulsoup = bs4.BeautifulSoup
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Groups write-behind tests to use the same test client."""
+
+    def setUp(self):
+        """
+        Runs before each test.
+
+        Creates test flask client with write-behind and journaling enabled, using a test config.
+        Creates temporary sqlite file, wordlist and journal directory.
+        """
+        wordlist_fd, wordlist_name = tempfile.mkstemp()
+        with os.fdopen(wordlist_fd, 'w') as wordlist:
+            wordlist.write('some\ncorrect\nwords\n')
+        db_fd, database_name = tempfile.mkstemp()
+        journal_dir = tempfile.mkdtemp()
+        test_config = {"SECRET_KEY": 'test',
+                       "TESTING": True,
+                       "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + database_name,
+                       "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+                       "SPELLCHECK_ENGINE": 'dictionary',
+                       "WORDLIST": wordlist_name,
+                       "WRITE_BEHIND": True,
+                       "WRITE_BEHIND_MAX_DELAY": 60,
+                       "WRITE_BEHIND_DURABILITY": 'journal',
+                       "WRITE_BEHIND_JOURNAL_DIR": journal_dir,
+                       "WRITE_BEHIND_FSYNC": False}
+        base_app = app.create_app(test_config)
+        self.app = base_app.test_client()
+        self.db_fd = db_fd
+        self.database_name = database_name
+        self.wordlist_name = wordlist_name
+        self.journal_dir = journal_dir
+        self.base_app = base_app
+        self.queue = base_app.extensions['write_behind']
+
+    def tearDown(self):
+        """Stops the queue and removes the sqlite file, wordlist and journals."""
+        self.queue.close()
+        os.close(self.db_fd)
+        os.unlink(self.database_name)
+        os.unlink(self.wordlist_name)
+        shutil.rmtree(self.journal_dir)
+
+    # Helper Funcs
+    def register_and_login(self, uname='temp1234', pword='temp1234'):
+        """Helper function to register and login a user."""
+        response = self.app.get('/register', follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.app.post('/register', data={"username": uname, "password": pword, "csrf_token": csrf_token}, follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        csrf_token = soup.find_all('input', id='csrf_token')[0]['value']
+        response = self.app.post('/login', data={"username": uname, "password": pword, "csrf_token": csrf_token}, follow_redirects=True)
+        soup = beautifulsoup(response.data, 'html.parser')
+        self.assertTrue(any("Login success" in s.text for s in soup.find_all(id='result')))
+
+    # Tests Start
+    def test_login_and_logout_queued(self):
+        """Tests that the login AuthLog row is queued and that logout still records the logout time."""
+        self.register_and_login()
+        self.assertEqual(self.queue.stats()['depth'], 1)
+        with self.base_app.app_context():
+            self.assertEqual(AuthLog.query.count(), 0)
+        self.app.get('/logout', follow_redirects=True)
+        self.assertEqual(self.queue.stats()['depth'], 0)
+        with self.base_app.app_context():
+            login_log = AuthLog.query.filter_by(username='temp1234').first()
+            self.assertIsNotNone(login_log)
+            self.assertIsNotNone(login_log.logout_time)
+
+    def test_logout_of_login_queued_elsewhere(self):
+        """Tests that logout records the logout time when the login is still queued by another worker."""
+        self.register_and_login()
+        # Another worker's queue: this worker's queue no longer holds the row.
+        with self.queue._lock:
+            queued = list(self.queue._pending)
+            self.queue._pending.clear()
+        self.app.get('/logout', follow_redirects=True)
+        with self.base_app.app_context():
+            login_log = AuthLog.query.filter_by(username='temp1234').one()
+            self.assertIsNotNone(login_log.logout_time)
+        # The other worker writes its queued login later, which must not add a second row.
+        self.queue._write(queued)
+        with self.base_app.app_context():
+            self.assertEqual(AuthLog.query.filter_by(username='temp1234').count(), 1)
+            self.assertIsNotNone(AuthLog.query.filter_by(username='temp1234').one().logout_time)
+
+    def test_spell_checks_flushed_in_batches(self):
+        """Tests that queued spell checks are inserted together with the user's counter when the queue is flushed."""
+        self.register_and_login()
+        self.queue.max_batch = 2
+        response = self.app.post('/api/spell_check/batch', json={"texts": ["some wrods", "correct words", "flkfkef"]})
+        self.assertEqual(response.status_code, 200)
+        self.queue.flush()
+        stats = self.queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['flushed'], 4)
+        self.assertGreaterEqual(stats['flushes'], 2)
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.filter_by(username='temp1234').count(), 3)
+            self.assertEqual(Users.query.filter_by(username='temp1234').first().spell_check_count, 3)
+
+    def test_full_queue_write_failure(self):
+        """Tests that a request filling the queue still succeeds when the database write fails, the rows stay queued."""
+        self.queue.max_pending = 1
+
+        def failing_write(batch, journal=None):
+            raise RuntimeError('database unavailable')
+
+        self.queue._write = failing_write
+        self.register_and_login()
+        stats = self.queue.stats()
+        self.assertEqual(stats['depth'], 1)
+        self.assertEqual(stats['errors'], 1)
+        del self.queue._write
+        self.queue.flush()
+        with self.base_app.app_context():
+            self.assertEqual(AuthLog.query.filter_by(username='temp1234').count(), 1)
+
+    def test_journal_replay(self):
+        """Tests that rows left in the journal of a worker that died are written when the app starts again."""
+        self.register_and_login()
+        self.app.post('/api/spell_check/batch', json={"texts": ["some wrods", "flkfkef"]})
+        # Simulate the worker dying: drop the queued rows and release the journal without writing anything out.
+        self.queue._journal._file.close()
+        self.queue._journal = None
+        self.queue._pending.clear()
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.count(), 0)
+        replayed = writebehind.WriteBehindQueue(self.base_app, self.queue.handlers, journal_dir=self.journal_dir).replay()
+        self.assertEqual(replayed, 3)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.count(), 2)
+            self.assertEqual(AuthLog.query.count(), 1)
+
+    def test_journal_skips_committed_rows(self):
+        """Tests that rows already written to the database are not replayed."""
+        path = os.path.join(self.journal_dir, 'write_behind.0.journal')
+        journal = writebehind.Journal(path, fsync=False)
+        for seq in range(1, 4):
+            journal.append(seq, 'auth_log', {'seq': seq})
+        journal.commit(2)
+        journal.append(4, 'auth_log', {'seq': 4})
+        journal.close()
+        self.assertEqual(writebehind.Journal.pending(path), [(3, 'auth_log', {'seq': 3}), (4, 'auth_log', {'seq': 4})])
+        self.assertEqual(writebehind.Journal.pending(path, committed=3), [(4, 'auth_log', {'seq': 4})])
+
+    def test_journal_replay_after_uncommitted_marker(self):
+        """Tests that a batch written to the database is not replayed when the worker died before marking it in its journal."""
+        self.register_and_login()
+        self.app.post('/api/spell_check/batch', json={"texts": ["some wrods", "flkfkef"]})
+        journal = self.queue._journal
+        # Simulate the worker dying right after the database commit: the journal never records it.
+        journal.commit = lambda seq: None
+        journal.truncate = lambda: None
+        self.queue.flush()
+        journal._file.close()
+        self.queue._journal = None
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.count(), 2)
+            self.assertEqual(writebehind.WriteBehindCommit.query.get(journal.name).seq, 3)
+        replayed = writebehind.WriteBehindQueue(self.base_app, self.queue.handlers, journal_dir=self.journal_dir).replay()
+        self.assertEqual(replayed, 0)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+        with self.base_app.app_context():
+            self.assertEqual(SpellChecks.query.count(), 2)
+            self.assertEqual(AuthLog.query.count(), 1)
+            self.assertEqual(writebehind.WriteBehindCommit.query.count(), 0)